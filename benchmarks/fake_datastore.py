@@ -0,0 +1,223 @@
+"""
+Substitut local et en mémoire de Google Cloud Datastore pour les benchmarks.
+
+Ce module reproduit le sous-ensemble de l'API `google.cloud.datastore.Client` utilisé
+par le property_service (clés, entités, requêtes filtrées et triées, projections,
+requêtes d'agrégation count, opérations unitaires et par lots). Les entités renvoyées
+sont des copies, comme le seraient des entités désérialisées depuis Datastore, afin que
+le coût de lecture reste réaliste.
+
+Il ne remplace pas l'émulateur Datastore : pour mesurer aussi le coût gRPC, lancer le
+benchmark avec `DATASTORE_EMULATOR_HOST` défini (voir `benchmarks/run.py --emulator`).
+"""
+
+import base64
+import contextlib
+import itertools
+import threading
+
+from google.cloud import datastore
+
+
+_OPERATORS = {
+    "=": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a is not None and a < b,
+    "<=": lambda a, b: a is not None and a <= b,
+    ">": lambda a, b: a is not None and a > b,
+    ">=": lambda a, b: a is not None and a >= b,
+    "IN": lambda a, b: a in b,
+    "NOT_IN": lambda a, b: a not in b,
+}
+
+
+def _key_sort_value(key):
+    return tuple((kind, id_or_name if id_or_name is not None else 0) for kind, id_or_name in zip(key.flat_path[::2], key.flat_path[1::2]))
+
+
+def _matches(value, op, expected):
+    # Une propriété liste correspond si l'une de ses valeurs correspond (sémantique Datastore)
+    if isinstance(value, list) and op in ("=", "IN"):
+        return any(_OPERATORS[op](item, expected) for item in value)
+    return _OPERATORS[op](value, expected)
+
+
+class _Iterator:
+    """Résultat d'une requête : itérable, avec un curseur de fin de page."""
+
+    def __init__(self, results, next_offset):
+        self._results = results
+        self.next_page_token = base64.urlsafe_b64encode(str(next_offset).encode())
+
+    def __iter__(self):
+        return iter(self._results)
+
+    @property
+    def pages(self):
+        yield iter(self._results)
+
+
+class _Query:
+    """Requête sur un type d'entité, compatible avec `google.cloud.datastore.Query`."""
+
+    def __init__(self, client, kind=None, filters=(), projection=(), order=(), distinct_on=(), ancestor=None):
+        self._client = client
+        self.kind = kind
+        self.filters = list(filters)
+        self.projection = list(projection)
+        self.order = list(order)
+        self.distinct_on = list(distinct_on)
+        self.ancestor = ancestor
+
+    def add_filter(self, property_name=None, operator=None, value=None, filter=None):
+        if filter is not None:
+            property_name, operator, value = filter.property_name, filter.operator, filter.value
+        self.filters.append((property_name, operator, value))
+        return self
+
+    def keys_only(self):
+        self.projection = ["__key__"]
+
+    def _value(self, key, entity, field):
+        return key if field == "__key__" else entity.get(field)
+
+    def _sort_value(self, key, entity, field):
+        value = self._value(key, entity, field)
+        if field == "__key__":
+            return _key_sort_value(value)
+        return (value is not None, value)
+
+    def fetch(self, limit=None, offset=0, start_cursor=None, **kwargs):
+        with self._client._lock:
+            rows = [(key, entity) for key, entity in self._client._store.values() if self.kind is None or key.kind == self.kind]
+
+        for field, op, expected in self.filters:
+            if field == "__key__":
+                rows = [(key, entity) for key, entity in rows
+                        if _OPERATORS[op](_key_sort_value(key), _key_sort_value(expected))]
+            else:
+                rows = [(key, entity) for key, entity in rows if field in entity and _matches(entity[field], op, expected)]
+
+        # Datastore renvoie les entités dans l'ordre des clés par défaut
+        rows.sort(key=lambda row: _key_sort_value(row[0]))
+        for field in reversed(self.order):
+            descending = field.startswith("-")
+            name = field.lstrip("-")
+            rows = [row for row in rows if name == "__key__" or name in row[1]]
+            rows.sort(key=lambda row: self._sort_value(row[0], row[1], name), reverse=descending)
+
+        if self.distinct_on:
+            seen = set()
+            distinct = []
+            for key, entity in rows:
+                value = tuple(repr(entity.get(field)) for field in self.distinct_on)
+                if value not in seen:
+                    seen.add(value)
+                    distinct.append((key, entity))
+            rows = distinct
+
+        if start_cursor:
+            offset += int(base64.urlsafe_b64decode(start_cursor).decode())
+        page = rows[offset:offset + limit] if limit is not None else rows[offset:]
+
+        keys_only = self.projection == ["__key__"]
+        results = []
+        for key, entity in page:
+            copy = datastore.Entity(key=key)
+            if not keys_only:
+                copy.update({field: entity[field] for field in self.projection if field in entity} if self.projection else entity)
+            results.append(copy)
+        return _Iterator(results, offset + len(page))
+
+
+class _AggregationResult:
+    def __init__(self, alias, value):
+        self.alias = alias
+        self.value = value
+
+
+class _AggregationQuery:
+    """Requête d'agrégation, compatible avec `google.cloud.datastore.aggregation.AggregationQuery`."""
+
+    def __init__(self, query):
+        self._query = query
+        self._aliases = []
+
+    def count(self, alias=None):
+        self._aliases.append(alias)
+        return self
+
+    def fetch(self, **kwargs):
+        total = len(list(self._query.fetch()))
+        return [[_AggregationResult(alias, total) for alias in self._aliases]]
+
+
+class InMemoryDatastore:
+    """Client Datastore en mémoire, thread-safe.
+
+    Paramètres:
+        - project (str): Identifiant de projet utilisé pour construire les clés.
+    """
+
+    def __init__(self, project="bench"):
+        self.project = project
+        self._store = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def key(self, *path_args, **kwargs):
+        kwargs.setdefault("project", self.project)
+        return datastore.Key(*path_args, **kwargs)
+
+    def query(self, **kwargs):
+        return _Query(self, **kwargs)
+
+    def aggregation_query(self, query):
+        return _AggregationQuery(query)
+
+    def _complete(self, key):
+        if key.is_partial:
+            key = key.completed_key(next(self._ids))
+        return key
+
+    def allocate_ids(self, incomplete_key, num_ids, **kwargs):
+        with self._lock:
+            return [incomplete_key.completed_key(next(self._ids)) for _ in range(num_ids)]
+
+    def get(self, key, **kwargs):
+        with self._lock:
+            stored = self._store.get(key.flat_path)
+        if stored is None:
+            return None
+        entity = datastore.Entity(key=stored[0], exclude_from_indexes=tuple(stored[1].exclude_from_indexes))
+        entity.update(stored[1])
+        return entity
+
+    def get_multi(self, keys, **kwargs):
+        return [entity for entity in (self.get(key) for key in keys) if entity is not None]
+
+    def put(self, entity, **kwargs):
+        with self._lock:
+            entity.key = self._complete(entity.key)
+            stored = datastore.Entity(key=entity.key, exclude_from_indexes=tuple(entity.exclude_from_indexes))
+            stored.update(entity)
+            self._store[entity.key.flat_path] = (entity.key, stored)
+
+    def put_multi(self, entities, **kwargs):
+        for entity in entities:
+            self.put(entity)
+
+    def delete(self, key, **kwargs):
+        with self._lock:
+            self._store.pop(key.flat_path, None)
+
+    def delete_multi(self, keys, **kwargs):
+        for key in keys:
+            self.delete(key)
+
+    def transaction(self, **kwargs):
+        # Les opérations sont déjà atomiques individuellement : pas d'isolation supplémentaire
+        return contextlib.nullcontext(self)
+
+    def batch(self, **kwargs):
+        return contextlib.nullcontext(self)
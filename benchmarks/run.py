@@ -0,0 +1,318 @@
+"""
+Suite de benchmarks reproductible pour le user_service et le property_service.
+
+Le script démarre les deux services sur des ports locaux (user_service sur une base
+SQLite temporaire, property_service sur un substitut Datastore en mémoire ou sur
+l'émulateur Datastore), injecte un jeu de données, puis génère de la charge.
+
+Scénarios :
+- login   : tempête de connexions (`POST /login`, coût bcrypt).
+- listing : liste des propriétés d'une ville contenant `--entities` entités.
+- crud    : création, mise à jour, lecture et suppression avec validation de l'utilisateur.
+- mixed   : mélange pondéré des trois scénarios précédents.
+
+Pour chaque endpoint, le débit et les latences p50/p95/p99 sont rapportés puis comparés
+à une référence stockée (`benchmarks/baseline.json`, versionnée) ; le script se termine
+avec le code 1 en cas de régression, et avec le code 2 si la référence est introuvable.
+
+Usage :
+    python -m benchmarks.run --duration 10 --concurrency 16
+    python -m benchmarks.run --update-baseline
+    python -m benchmarks.run --emulator          # nécessite DATASTORE_EMULATOR_HOST
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+CITY = "Nice"
+
+
+def percentile(sorted_values, fraction):
+    """Percentile par rang le plus proche d'une liste déjà triée."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    """Collecte thread-safe des latences et erreurs par endpoint."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, label, seconds, ok):
+        with self._lock:
+            self.latencies[label].append(seconds)
+            if not ok:
+                self.errors[label] += 1
+
+    def summary(self, elapsed):
+        result = {}
+        for label, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            result[label] = {
+                "count": len(values),
+                "errors": self.errors[label],
+                "rps": round(len(values) / elapsed, 2),
+                "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+            }
+        return result
+
+
+def _serve(app):
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def boot(args, workdir):
+    """Démarre les deux services et retourne leurs URLs et le client Datastore utilisé."""
+    from user_service.app import create_app as create_user_app
+    from user_service.config import Config
+    from user_service.models import db
+    from property_service.app import create_app as create_property_app
+    from property_service.models import get_client
+    from benchmarks.fake_datastore import InMemoryDatastore
+
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        JWT_SECRET_KEY = "benchmark-secret-key-with-enough-bytes"
+        SLOW_REQUEST_THRESHOLD_MS = 0
+
+    user_app = create_user_app(BenchmarkConfig)
+    with user_app.app_context():
+        db.create_all()
+
+    if args.emulator:
+        if not os.getenv("DATASTORE_EMULATOR_HOST"):
+            sys.exit("--emulator nécessite la variable DATASTORE_EMULATOR_HOST.")
+        property_config = {}
+    else:
+        property_config = {"DATASTORE_CLIENT": InMemoryDatastore()}
+    property_config["SLOW_REQUEST_THRESHOLD_MS"] = 0
+
+    user_server, user_url = _serve(user_app)
+    property_config["USER_SERVICE_URL"] = user_url
+    property_app = create_property_app(property_config)
+    property_server, property_url = _serve(property_app)
+    return {
+        "user_url": user_url,
+        "property_url": property_url,
+        "client": get_client(property_app),
+        "servers": [user_server, property_server],
+    }
+
+
+def seed(args, context):
+    """Crée les utilisateurs de test et les entités de la ville de référence."""
+    import requests
+    from property_service.models import Property, Piece, create_property
+
+    users = []
+    for index in range(args.users):
+        credentials = {"email": f"bench{index}@example.com", "password": f"password{index}"}
+        requests.post(f"{context['user_url']}/users", json={
+            **credentials, "nom": "Bench", "prenom": f"User{index}", "date_de_naissance": "1990-01-01",
+        })
+        token = requests.post(f"{context['user_url']}/login", json=credentials).json()["token"]
+        users.append({**credentials, "token": token})
+    context["users"] = users
+
+    client = context["client"]
+    for index in range(args.entities):
+        create_property(client, Property(
+            nom=f"Propriété {index}",
+            description="Appartement lumineux proche de la mer, rénové récemment. " * 4,
+            type_de_bien=random.choice(["Appartement", "Maison individuelle", "Villa", "Studio"]),
+            ville=CITY,
+            proprietaire=index % 1000 + 10_000,
+            pieces=[Piece(nom="Salon", surface=30, etage="1", caracteristiques=["Balcon"]),
+                    Piece(nom="Chambre", surface=14, etage="1", caracteristiques=[])],
+        ))
+
+
+def _timed(session, recorder, label, method, url, expected=(200, 201), **kwargs):
+    start = time.perf_counter()
+    try:
+        response = session.request(method, url, **kwargs)
+        ok = response.status_code in expected
+    except Exception:
+        response, ok = None, False
+    recorder.record(label, time.perf_counter() - start, ok)
+    return response
+
+
+def scenario_login(session, context, recorder):
+    user = random.choice(context["users"])
+    _timed(session, recorder, "POST /login", "POST", f"{context['user_url']}/login",
+           json={"email": user["email"], "password": user["password"]})
+
+
+def scenario_listing(session, context, recorder):
+    _timed(session, recorder, "GET /properties?city", "GET", f"{context['property_url']}/properties",
+           params={"city": CITY}, headers={"Accept-Encoding": "gzip"})
+
+
+def scenario_crud(session, context, recorder):
+    base = f"{context['property_url']}/properties"
+    headers = {"Authorization": f"Bearer {random.choice(context['users'])['token']}"}
+
+    response = _timed(session, recorder, "POST /properties", "POST", base, headers=headers, json={
+        "nom": "Maison de test", "description": "Maison créée par le benchmark.",
+        "type_de_bien": "Maison individuelle", "ville": "Antibes",
+        "pieces": [{"nom": "Salon", "surface": 25, "etage": "0", "caracteristiques": []}],
+    })
+    if response is None or response.status_code != 201:
+        return
+    property_id = response.json()["id"]
+
+    _timed(session, recorder, "PUT /properties/<id>", "PUT", f"{base}/{property_id}", headers=headers,
+           json={"nom": "Maison de test modifiée"})
+    _timed(session, recorder, "GET /properties/<id>", "GET", f"{base}/{property_id}")
+    _timed(session, recorder, "DELETE /properties/<id>", "DELETE", f"{base}/{property_id}", headers=headers)
+
+
+def scenario_mixed(session, context, recorder):
+    roll = random.random()
+    if roll < 0.6:
+        scenario_listing(session, context, recorder)
+    elif roll < 0.9:
+        scenario_crud(session, context, recorder)
+    else:
+        scenario_login(session, context, recorder)
+
+
+SCENARIOS = {
+    "login": scenario_login,
+    "listing": scenario_listing,
+    "crud": scenario_crud,
+    "mixed": scenario_mixed,
+}
+
+
+def run_scenario(name, args, context):
+    """Exécute un scénario avec `--concurrency` clients pendant `--duration` secondes."""
+    import requests
+
+    recorder = Recorder()
+    scenario = SCENARIOS[name]
+    deadline = time.perf_counter() + args.duration
+
+    def worker():
+        with requests.Session() as session:
+            while time.perf_counter() < deadline:
+                scenario(session, context, recorder)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(args.concurrency)]:
+            future.result()
+    return recorder.summary(time.perf_counter() - start)
+
+
+def compare(results, baseline, threshold):
+    """Compare les résultats à la référence et retourne la liste des régressions."""
+    regressions = []
+    for scenario, endpoints in results.items():
+        for label, stats in endpoints.items():
+            reference = baseline.get(scenario, {}).get(label)
+            if not reference:
+                continue
+            if reference["p95_ms"] and stats["p95_ms"] > reference["p95_ms"] * (1 + threshold):
+                regressions.append(f"{scenario} {label}: p95 {stats['p95_ms']}ms > {reference['p95_ms']}ms")
+            if reference["rps"] and stats["rps"] < reference["rps"] * (1 - threshold):
+                regressions.append(f"{scenario} {label}: débit {stats['rps']}/s < {reference['rps']}/s")
+            if stats["errors"] > reference["errors"]:
+                regressions.append(f"{scenario} {label}: {stats['errors']} erreurs (référence : {reference['errors']})")
+    return regressions
+
+
+def print_report(results):
+    header = f"{'scénario':<10} {'endpoint':<26} {'requêtes':>9} {'erreurs':>8} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    print(header)
+    print("-" * len(header))
+    for scenario, endpoints in results.items():
+        for label, stats in endpoints.items():
+            print(f"{scenario:<10} {label:<26} {stats['count']:>9} {stats['errors']:>8} {stats['rps']:>9} "
+                  f"{stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks du user_service et du property_service.")
+    parser.add_argument("--scenarios", default="login,listing,crud,mixed",
+                        help="Scénarios à exécuter, séparés par des virgules.")
+    parser.add_argument("--duration", type=float, default=10.0, help="Durée de chaque scénario (secondes).")
+    parser.add_argument("--concurrency", type=int, default=16, help="Nombre de clients simultanés.")
+    parser.add_argument("--entities", type=int, default=10_000, help="Nombre d'entités dans la ville de référence.")
+    parser.add_argument("--users", type=int, default=8, help="Nombre d'utilisateurs de test.")
+    parser.add_argument("--seed", type=int, default=42, help="Graine aléatoire (reproductibilité).")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Fichier de référence JSON.")
+    parser.add_argument("--update-baseline", action="store_true", help="Remplace la référence par ces résultats.")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Dégradation tolérée (0.2 = 20 %%).")
+    parser.add_argument("--output", help="Écrit les résultats JSON dans ce fichier.")
+    parser.add_argument("--emulator", action="store_true", help="Utilise l'émulateur Datastore.")
+    args = parser.parse_args(argv)
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Scénarios inconnus : {', '.join(sorted(unknown))}")
+
+    random.seed(args.seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        context = boot(args, workdir)
+        try:
+            seed(args, context)
+            results = {name: run_scenario(name, args, context) for name in names}
+        finally:
+            for server in context["servers"]:
+                server.shutdown()
+
+    print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\nRéférence mise à jour : {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        # Une comparaison impossible ne doit pas passer pour un succès en intégration continue
+        print(f"\nAucune référence trouvée ({args.baseline}) : lancer avec --update-baseline.")
+        return 2
+
+    with open(args.baseline, encoding="utf-8") as f:
+        regressions = compare(results, json.load(f), args.threshold)
+    if regressions:
+        print("\nRégressions détectées :")
+        for regression in regressions:
+            print(f"- {regression}")
+        return 1
+    print("\nAucune régression par rapport à la référence.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+"""
+Contrôle d'admission et délestage des requêtes, partagés par les deux services.
+
+Chaque requête appartient à une classe de priorité. Avant d'exécuter la vue, elle doit
+obtenir une place : si les limites de concurrence sont atteintes, elle attend dans une file
+bornée, au plus `ADMISSION_QUEUE_TIMEOUT` secondes ; si la file de sa classe est pleine ou
+si le délai expire, elle est refusée aussitôt (503 avec `Retry-After`) au lieu d'occuper
+un thread du worker.
+
+Classes, de la plus prioritaire à la moins prioritaire :
+- "critical" : validation des jetons (`/users/validate`), dont dépendent les autres services.
+- "read" : lectures (GET / HEAD).
+- "write" : écritures (autres méthodes).
+- "auth" : connexion et inscription, bornées par le coût de bcrypt.
+
+Une vue choisit sa classe avec le décorateur `admission_class` ; à défaut, la classe
+dépend de la méthode HTTP. Les places libérées sont attribuées d'abord aux classes les plus
+prioritaires. `/metrics` et la route de santé ne sont jamais soumises au contrôle.
+
+Les limites s'appliquent à chaque processus worker. Une requête en attente occupe un
+thread : `THREADS` doit rester supérieur aux limites pour que la priorisation joue. Aucune
+limite n'est fixée par défaut : elles se dimensionnent d'après `THREADS` et le coût mesuré
+des requêtes (ex. `auth` à la moitié des threads).
+
+Configuration (via `app.config`) :
+- ADMISSION_ENABLED (bool): Active le contrôle. Défaut : True.
+- ADMISSION_MAX_CONCURRENCY (int): Requêtes exécutées simultanément, toutes classes
+  confondues (0 : pas de limite globale). Défaut : 0.
+- ADMISSION_CLASS_LIMITS (str | dict): Limite par classe, ex. "auth=2". Défaut : "" (aucune).
+- ADMISSION_ROUTE_LIMITS (str | dict): Limite par endpoint Flask, ex. "user.login_user=1". Défaut : "".
+- ADMISSION_QUEUE_SIZE (int): Taille de la file d'attente de chaque classe. Défaut : 8.
+- ADMISSION_QUEUE_SIZES (str | dict): Tailles propres à certaines classes, ex. "auth=1".
+  Défaut : "".
+- ADMISSION_QUEUE_TIMEOUT (float): Attente maximale dans la file, en secondes. Défaut : 2.
+- ADMISSION_RETRY_AFTER (int): Valeur de l'en-tête `Retry-After` des refus. Défaut : 1.
+
+Métriques exposées :
+- admission_in_flight{class}
+- admission_queue_depth{class}
+- admission_rejections_total{class, reason}
+- admission_wait_seconds{class}
+"""
+
+import threading
+import time
+from collections import deque
+
+from flask import current_app, g, jsonify, request
+
+from common.metrics import Counter, Gauge, Histogram
+
+
+CLASSES = ("critical", "read", "write", "auth")
+
+# Endpoints jamais soumis au contrôle : supervision et santé
+EXEMPT_ENDPOINTS = frozenset({"metrics", "health_check"})
+
+ADMISSION_IN_FLIGHT = Gauge(
+    "admission_in_flight", "Requêtes admises en cours d'exécution, par classe.", ("class",))
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "admission_queue_depth", "Requêtes en attente d'admission, par classe.", ("class",))
+ADMISSION_REJECTIONS = Counter(
+    "admission_rejections_total", "Requêtes refusées par le contrôle d'admission, par classe et motif.",
+    ("class", "reason"))
+ADMISSION_WAIT = Histogram(
+    "admission_wait_seconds", "Attente des requêtes avant leur admission.", ("class",))
+
+
+class Rejected(Exception):
+    """Levée lorsqu'une requête n'est pas admise.
+
+    Attributs:
+        - reason (str): Motif du refus ("queue_full" ou "timeout").
+    """
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class _Waiter:
+    """Requête en attente d'une place."""
+
+    __slots__ = ("route", "admitted")
+
+    def __init__(self, route):
+        self.route = route
+        self.admitted = threading.Event()
+
+
+def parse_limits(value):
+    """Convertit une liste "nom=limite,..." en dictionnaire.
+
+    Paramètres:
+        - value (str | dict | None): Valeur de configuration.
+
+    Retourne:
+        - dict: Limite par nom.
+    """
+    if not value:
+        return {}
+    if isinstance(value, dict):
+        return dict(value)
+    limits = {}
+    for item in value.split(","):
+        name, _, limit = item.strip().partition("=")
+        limits[name.strip()] = int(limit)
+    return limits
+
+
+class AdmissionController:
+    """Limites de concurrence et files d'attente par classe de priorité.
+
+    Paramètres:
+        - max_concurrency (int): Limite globale (0 : aucune).
+        - class_limits (dict): Limite par classe.
+        - route_limits (dict): Limite par endpoint.
+        - queue_size (int): Taille par défaut de la file de chaque classe.
+        - queue_sizes (dict): Tailles propres à certaines classes.
+        - queue_timeout (float): Attente maximale dans la file, en secondes.
+    """
+
+    def __init__(self, max_concurrency=0, class_limits=None, route_limits=None, queue_size=8,
+                 queue_sizes=None, queue_timeout=2.0):
+        unknown = set(class_limits or {}) | set(queue_sizes or {})
+        if not unknown.issubset(CLASSES):
+            raise ValueError(f"Classes d'admission inconnues : {', '.join(sorted(unknown - set(CLASSES)))}")
+        self.max_concurrency = max_concurrency
+        self.class_limits = dict(class_limits or {})
+        self.route_limits = dict(route_limits or {})
+        self.queue_sizes = {name: (queue_sizes or {}).get(name, queue_size) for name in CLASSES}
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._total = 0
+        self._by_class = dict.fromkeys(CLASSES, 0)
+        self._by_route = {}
+        self._queues = {name: deque() for name in CLASSES}
+
+    def _can_run(self, name, route):
+        return ((not self.max_concurrency or self._total < self.max_concurrency)
+                and self._by_class[name] < self.class_limits.get(name, float("inf"))
+                and self._by_route.get(route, 0) < self.route_limits.get(route, float("inf")))
+
+    def _start(self, name, route):
+        self._total += 1
+        self._by_class[name] += 1
+        self._by_route[route] = self._by_route.get(route, 0) + 1
+        ADMISSION_IN_FLIGHT.inc(name)
+
+    def acquire(self, name, route):
+        """Obtient une place pour une requête, en attendant si nécessaire.
+
+        Paramètres:
+            - name (str): Classe de la requête.
+            - route (str): Endpoint de la requête.
+
+        Lève:
+            - Rejected: File de la classe pleine ou attente trop longue.
+        """
+        with self._lock:
+            if self._can_run(name, route):
+                self._start(name, route)
+                return
+            queue = self._queues[name]
+            if len(queue) >= self.queue_sizes[name]:
+                ADMISSION_REJECTIONS.inc(name, "queue_full")
+                raise Rejected("queue_full")
+            waiter = _Waiter(route)
+            queue.append(waiter)
+            ADMISSION_QUEUE_DEPTH.inc(name)
+
+        start = time.perf_counter()
+        admitted = waiter.admitted.wait(self.queue_timeout)
+        if not admitted:
+            with self._lock:
+                # La place a pu être attribuée entre l'expiration du délai et le verrou
+                admitted = waiter.admitted.is_set()
+                if not admitted:
+                    queue.remove(waiter)
+                    ADMISSION_QUEUE_DEPTH.dec(name)
+        ADMISSION_WAIT.observe(time.perf_counter() - start, name)
+        if not admitted:
+            ADMISSION_REJECTIONS.inc(name, "timeout")
+            raise Rejected("timeout")
+
+    def release(self, name, route):
+        """Libère la place d'une requête terminée et admet les requêtes en attente.
+
+        Paramètres:
+            - name (str): Classe de la requête.
+            - route (str): Endpoint de la requête.
+        """
+        with self._lock:
+            self._total -= 1
+            self._by_class[name] -= 1
+            self._by_route[route] -= 1
+            ADMISSION_IN_FLIGHT.dec(name)
+            self._dispatch()
+
+    def _dispatch(self):
+        # Classes les plus prioritaires d'abord, ordre d'arrivée dans chaque classe
+        for name in CLASSES:
+            queue = self._queues[name]
+            for waiter in list(queue):
+                if self.max_concurrency and self._total >= self.max_concurrency:
+                    return
+                if self._can_run(name, waiter.route):
+                    queue.remove(waiter)
+                    ADMISSION_QUEUE_DEPTH.dec(name)
+                    self._start(name, waiter.route)
+                    waiter.admitted.set()
+
+
+def admission_class(name):
+    """Décorateur fixant la classe de priorité d'une vue.
+
+    Exemple:
+        @user_blueprint.route('/login', methods=['POST'])
+        @admission_class("auth")
+        def login_user():
+            ...
+
+    Paramètres:
+        - name (str): Classe (voir `CLASSES`).
+    """
+    if name not in CLASSES:
+        raise ValueError(f"Classe d'admission inconnue : {name}")
+
+    def decorator(view):
+        view.admission_class = name
+        return view
+    return decorator
+
+
+def _request_class():
+    view = current_app.view_functions.get(request.endpoint)
+    name = getattr(view, "admission_class", None)
+    if name is not None:
+        return name
+    return "read" if request.method in ("GET", "HEAD") else "write"
+
+
+def init_admission(app):
+    """Enregistre le contrôle d'admission sur l'application.
+
+    Paramètres:
+        - app (Flask): Application Flask.
+    """
+    if not app.config.get("ADMISSION_ENABLED", True):
+        return
+
+    controller = app.extensions["admission"] = AdmissionController(
+        max_concurrency=app.config.get("ADMISSION_MAX_CONCURRENCY", 0),
+        class_limits=parse_limits(app.config.get("ADMISSION_CLASS_LIMITS")),
+        route_limits=parse_limits(app.config.get("ADMISSION_ROUTE_LIMITS")),
+        queue_size=app.config.get("ADMISSION_QUEUE_SIZE", 8),
+        queue_sizes=parse_limits(app.config.get("ADMISSION_QUEUE_SIZES")),
+        queue_timeout=app.config.get("ADMISSION_QUEUE_TIMEOUT", 2.0),
+    )
+    retry_after = str(app.config.get("ADMISSION_RETRY_AFTER", 1))
+
+    @app.before_request
+    def _admit():
+        # Routes inconnues (404) et routes de supervision : pas de contrôle
+        if request.endpoint is None or request.endpoint in EXEMPT_ENDPOINTS:
+            return None
+        name = _request_class()
+        try:
+            controller.acquire(name, request.endpoint)
+        except Rejected:
+            return jsonify({"error": "Service saturé, réessayez plus tard."}), 503, {"Retry-After": retry_after}
+        g._admission = (name, request.endpoint)
+        return None
+
+    @app.teardown_request
+    def _release(exc):
+        admitted = g.pop("_admission", None)
+        if admitted is not None:
+            controller.release(*admitted)
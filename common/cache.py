@@ -0,0 +1,246 @@
+"""
+Cache clé-valeur à expiration, partagé par les deux services.
+
+Toutes les implémentations offrent la même interface (`get`, `set`, `delete`, `clear`,
+`generation`) :
+- `MemoryCache` : LRU à expiration, propre au processus.
+- `TieredSharedMemoryCache` (voir `common/shm_cache.py`) : tables de hachage de taille fixe
+  en mémoire partagée (mmap), communes à tous les workers d'un hôte ; un worker fraîchement
+  forké profite aussitôt des entrées des autres. Les valeurs courtes vont dans une table à
+  petits emplacements, les plus volumineuses dans une table à grands emplacements.
+- `NullCache` : cache désactivé.
+
+Les clés sont des chaînes préfixées par leur usage (ex. "property:42") ; le préfixe
+étiquette les métriques. Une valeur `None` n'est jamais mise en cache. Les valeurs
+retournées par `MemoryCache` sont partagées entre threads et ne doivent pas être modifiées.
+
+Configuration (via `app.config`) :
+- CACHE_BACKEND (str): "shared", "memory" ou "none". Défaut : "shared" (repli sur
+  "memory" si la plateforme ne le permet pas).
+- CACHE_MAX_ENTRIES (int): Nombre d'entrées. Défaut : 4096.
+- CACHE_ENTRY_SIZE (int): Taille d'un petit emplacement du cache partagé, en octets.
+  Défaut : 2048.
+- CACHE_LARGE_MAX_ENTRIES (int): Nombre de grands emplacements du cache partagé (0 pour
+  s'en passer). Défaut : 1024.
+- CACHE_LARGE_ENTRY_SIZE (int): Taille d'un grand emplacement, en octets : taille maximale
+  d'une entrée sérialisée (clé comprise). Défaut : 16384 (une propriété d'environ 8000
+  caractères de description et 12 pièces occupe 9 Ko une fois sérialisée).
+- CACHE_SHM_PATH (str): Fichier du cache partagé (mode 0600, propriété de l'utilisateur du
+  service). Défaut : `/dev/shm/<service>-<uid>-<empreinte du répertoire de l'application>.cache`.
+- CACHE_TTL (float): Durée de vie par défaut d'une entrée, en secondes. Défaut : 60.
+
+Métriques exposées :
+- cache_requests_total{prefix, outcome}
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from common.metrics import Counter
+from common.singleflight import SingleFlight
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "Lectures du cache, par préfixe de clé et par issue (hit / miss).", ("prefix", "outcome"))
+
+# Lectures manquées en cours dans le processus, regroupées par clé
+_flights = SingleFlight()
+
+# Compteurs d'invalidation de `MemoryCache`, chacun partagé par un groupe de clés
+_GENERATION_STRIPES = 256
+
+
+class NullCache:
+    """Cache désactivé : aucune valeur n'est conservée."""
+
+    def get(self, key):
+        return None
+
+    def generation(self, key):
+        return 0
+
+    def set(self, key, value, ttl=None, generation=None):
+        return False
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryCache:
+    """Cache LRU à expiration, propre au processus.
+
+    Paramètres:
+        - max_entries (int): Nombre maximal d'entrées.
+        - ttl (float): Durée de vie par défaut d'une entrée, en secondes.
+    """
+
+    def __init__(self, max_entries=4096, ttl=60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._generations = [0] * _GENERATION_STRIPES
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Retourne la valeur associée à une clé, ou None si elle est absente ou expirée."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def generation(self, key):
+        """Retourne le compteur d'invalidation d'une clé (partagé par un groupe de clés)."""
+        return self._generations[hash(key) % _GENERATION_STRIPES]
+
+    def set(self, key, value, ttl=None, generation=None):
+        """Associe une valeur à une clé pour `ttl` secondes (durée par défaut si None).
+
+        Si `generation` est fourni (valeur de `generation(key)` lue avant de calculer la
+        valeur), la valeur n'est conservée que si la clé n'a pas été supprimée entre-temps.
+
+        Retourne:
+            - bool: True si la valeur a été conservée.
+        """
+        with self._lock:
+            if generation is not None and self._generations[hash(key) % _GENERATION_STRIPES] != generation:
+                return False
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return True
+
+    def delete(self, key):
+        """Retire une clé du cache."""
+        with self._lock:
+            self._generations[hash(key) % _GENERATION_STRIPES] += 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Vide le cache."""
+        with self._lock:
+            self._generations = [generation + 1 for generation in self._generations]
+            self._entries.clear()
+
+
+def get_or_load(cache, key, loader, ttl=None):
+    """Lit une valeur dans le cache, ou la calcule et la conserve en cas d'absence.
+
+    Les appels simultanés qui manquent la même clé sont regroupés (voir
+    `common/singleflight.py`) : `loader` n'est exécuté qu'une fois et son résultat partagé,
+    y compris lorsque le cache est désactivé. Une valeur dont la clé est supprimée pendant
+    son calcul (modification concurrente) est retournée mais n'est pas conservée : elle peut
+    avoir été lue avant la modification.
+
+    Exemple:
+        entity = get_or_load(cache, f"property:{property_id}", lambda: get_property(client, property_id))
+
+    Paramètres:
+        - cache: Cache (voir l'interface ci-dessus).
+        - key (str): Clé préfixée par son usage.
+        - loader (callable): Fonction sans argument calculant la valeur.
+        - ttl (float): Durée de vie de la valeur (durée par défaut du cache si None).
+
+    Retourne:
+        - La valeur lue ou calculée (None n'est pas conservé).
+    """
+    prefix = key.partition(":")[0]
+    value = cache.get(key)
+    if value is not None:
+        CACHE_REQUESTS.inc(prefix, "hit")
+        return value
+    CACHE_REQUESTS.inc(prefix, "miss")
+    generation = cache.generation(key)
+
+    def load():
+        loaded = loader()
+        if loaded is not None:
+            cache.set(key, loaded, ttl, generation=generation)
+        return loaded
+
+    return _flights.do(key, load)
+
+
+def _default_shm_path(app):
+    # Un fichier par service, par utilisateur et par déploiement (répertoire de l'application) :
+    # deux copies du dépôt sur un même hôte ne partagent pas leur cache. /dev/shm évite toute
+    # écriture sur disque
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    service = app.import_name.partition(".")[0]
+    uid = os.getuid() if hasattr(os, "getuid") else 0
+    deployment = hashlib.sha256(os.path.realpath(app.root_path).encode()).hexdigest()[:12]
+    return os.path.join(directory, f"{service}-{uid}-{deployment}.cache")
+
+
+def init_cache(app):
+    """Crée le cache de l'application selon `CACHE_BACKEND`.
+
+    Le cache partagé est ouvert ici, avant le fork des workers : sa projection mémoire est
+    héritée par chacun d'eux. Des fichiers existants d'une autre géométrie (`CACHE_*ENTRIES`
+    ou `CACHE_*ENTRY_SIZE` modifiés entre deux déploiements) sont remplacés : les processus de
+    l'ancien déploiement conservent leur projection jusqu'à leur arrêt.
+
+    Paramètres:
+        - app (Flask): Application Flask.
+    """
+    backend = app.config.get("CACHE_BACKEND", "shared")
+    max_entries = app.config.get("CACHE_MAX_ENTRIES", 4096)
+    ttl = app.config.get("CACHE_TTL", 60.0)
+
+    cache = None
+    if backend == "shared":
+        from common.shm_cache import SharedMemoryCache, TieredSharedMemoryCache
+
+        path = app.config.get("CACHE_SHM_PATH") or _default_shm_path(app)
+        entry_size = app.config.get("CACHE_ENTRY_SIZE", 2048)
+        large_max_entries = app.config.get("CACHE_LARGE_MAX_ENTRIES", 1024)
+        large_entry_size = app.config.get("CACHE_LARGE_ENTRY_SIZE", 16384)
+
+        def open_shared():
+            if large_max_entries > 0:
+                return TieredSharedMemoryCache(path, max_entries=max_entries, entry_size=entry_size,
+                                               large_max_entries=large_max_entries,
+                                               large_entry_size=large_entry_size, ttl=ttl)
+            return SharedMemoryCache(path, max_entries=max_entries, entry_size=entry_size, ttl=ttl)
+
+        try:
+            try:
+                cache = open_shared()
+            except ValueError as error:
+                logger.warning("%s ; les fichiers du cache partagé sont recréés.", error)
+                for stale in (path, path + ".large"):
+                    if os.path.exists(stale):
+                        os.unlink(stale)
+                cache = open_shared()
+        except (OSError, RuntimeError, ValueError) as error:
+            logger.warning("Cache partagé indisponible (%s) : repli sur un cache par processus.", error)
+            backend = "memory"
+    if backend == "memory":
+        cache = MemoryCache(max_entries=max_entries, ttl=ttl)
+    elif cache is None:
+        cache = NullCache()
+    app.extensions["cache"] = cache
+
+
+def get_cache(app):
+    """Retourne le cache de l'application (désactivé si `init_cache` n'a pas été appelé).
+
+    Paramètres:
+        - app (Flask): Application Flask.
+    """
+    return app.extensions.get("cache") or NullCache()
@@ -0,0 +1,81 @@
+"""
+Compression négociée des réponses HTTP (gzip / brotli).
+
+Ce module enregistre un hook `after_request` qui compresse les réponses dépassant
+un seuil de taille, selon l'en-tête `Accept-Encoding` envoyé par le client.
+
+Configuration (via `app.config`) :
+- COMPRESS_MIN_SIZE (int): Taille minimale (en octets) avant compression. Défaut : 1024.
+- COMPRESS_LEVEL (int): Niveau de compression gzip (1-9). Défaut : 6.
+- COMPRESS_BROTLI_QUALITY (int): Qualité brotli (0-11). Défaut : 4.
+- COMPRESS_MIMETYPES (set): Types MIME compressibles.
+
+Brotli n'est proposé que si le paquet `brotli` est installé.
+"""
+
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - dépend de l'environnement
+    brotli = None
+
+
+DEFAULT_MIMETYPES = {"application/json", "text/plain", "text/html", "text/csv"}
+
+
+def _available_encodings():
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def compress_response(response, app):
+    """Compresse une réponse si le client le permet et si elle est assez volumineuse.
+
+    Paramètres:
+        - response (flask.Response): Réponse à compresser.
+        - app (Flask): Application courante (pour la configuration).
+
+    Retourne:
+        - flask.Response: La réponse, éventuellement compressée.
+    """
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code in (204, 304)
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in app.config.get("COMPRESS_MIMETYPES", DEFAULT_MIMETYPES)
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+
+    data = response.get_data()
+    if len(data) < app.config.get("COMPRESS_MIN_SIZE", 1024):
+        return response
+
+    encoding = request.accept_encodings.best_match(_available_encodings())
+    if encoding == "br":
+        data = brotli.compress(data, quality=app.config.get("COMPRESS_BROTLI_QUALITY", 4))
+    elif encoding == "gzip":
+        data = gzip.compress(data, compresslevel=app.config.get("COMPRESS_LEVEL", 6), mtime=0)
+    else:
+        return response
+
+    response.set_data(data)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def init_compression(app):
+    """Active la compression des réponses pour l'application Flask.
+
+    Paramètres:
+        - app (Flask): Application Flask.
+    """
+
+    @app.after_request
+    def _compress(response):
+        return compress_response(response, app)
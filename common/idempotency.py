@@ -0,0 +1,303 @@
+"""
+Clés d'idempotence (en-tête `Idempotency-Key`) pour les requêtes de création.
+
+Un client qui renvoie une requête après un délai dépassé réutilise la même clé : la
+réponse d'origine (statut et corps) est alors rejouée sans réexécuter la vue, donc sans
+nouvelle écriture dans le stockage ni nouveau hachage bcrypt.
+
+Points principaux :
+- Les réponses sont conservées dans un magasin borné (LRU) à expiration (TTL) propre à
+  chaque processus et, avec le cache partagé (`CACHE_BACKEND=shared`, voir
+  `common/shm_cache.py`), dans la mémoire partagée par les workers de l'hôte : une
+  relance est reconnue quel que soit le worker qui la reçoit. La clé y est réservée par
+  une insertion conditionnelle (`add`) avant l'exécution de la vue ; une réservation
+  abandonnée (worker arrêté en cours de requête) expire après `IDEMPOTENCY_PENDING_TTL`.
+- Une clé est rattachée à la route et à l'utilisateur authentifié (`scope`) : deux
+  utilisateurs ne partagent jamais une réponse, et un même utilisateur la retrouve avec un
+  nouveau jeton.
+- Les requêtes simultanées portant la même clé sont regroupées : une seule exécute la
+  vue, les autres attendent puis rejouent sa réponse.
+- La réutilisation d'une clé avec un corps différent est refusée (422).
+- Seules les réponses 2xx et les refus définitifs (409, 422) sont conservées : après une
+  erreur de requête (400), d'authentification (401, 403) ou serveur (5xx), le client peut
+  réessayer avec la même clé.
+
+Configuration (via `app.config`) :
+- IDEMPOTENCY_MAX_ENTRIES (int): Nombre maximal de réponses conservées. Défaut : 10000.
+- IDEMPOTENCY_TTL (float): Durée de conservation d'une réponse, en secondes. Défaut : 86400.
+- IDEMPOTENCY_WAIT_TIMEOUT (float): Attente maximale d'une requête regroupée, en secondes. Défaut : 30.
+- IDEMPOTENCY_PENDING_TTL (float): Durée de la réservation d'une clé dans le cache partagé,
+  en secondes ; doit dépasser la durée d'exécution de la vue. Défaut : 60.
+
+Le magasin partagé dépend de `init_cache`, à appeler avant `init_idempotency`.
+"""
+
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, current_app, jsonify, make_response, request
+
+from common.cache import get_cache
+from common.metrics import Counter
+
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+# Refus conservés, en plus des réponses 2xx : conflit et requête sémantiquement invalide
+STORED_ERROR_STATUSES = frozenset({409, 422})
+
+IDEMPOTENCY_REQUESTS = Counter(
+    "idempotency_requests_total", "Requêtes portant une clé d'idempotence, par issue.", ("outcome",))
+
+
+# Intervalle d'interrogation du cache partagé pendant l'exécution d'un autre worker
+_POLL_INTERVAL = 0.05
+
+
+class _Pending:
+    """Exécution en cours pour une clé dans ce processus (les requêtes regroupées attendent `done`)."""
+
+    __slots__ = ("fingerprint", "done")
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+
+    def wait(self, timeout):
+        return self.done.wait(timeout)
+
+
+class _RemotePending:
+    """Exécution en cours pour une clé dans un autre worker, suivie dans le cache partagé."""
+
+    __slots__ = ("fingerprint", "shared", "shared_key")
+
+    def __init__(self, fingerprint, shared, shared_key):
+        self.fingerprint = fingerprint
+        self.shared = shared
+        self.shared_key = shared_key
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            record = self.shared.get(self.shared_key)
+            if record is None or record[0] != "pending":
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(_POLL_INTERVAL)
+
+
+class _StoredResponse:
+    """Réponse conservée pour une clé."""
+
+    __slots__ = ("expires", "fingerprint", "status", "body", "content_type")
+
+    def __init__(self, expires, fingerprint, status, body, content_type):
+        self.expires = expires
+        self.fingerprint = fingerprint
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+
+
+class IdempotencyStore:
+    """Magasin borné et à expiration des réponses associées aux clés d'idempotence.
+
+    Paramètres:
+        - max_entries (int): Nombre maximal de réponses conservées par le processus (les plus
+          anciennes sont évincées).
+        - ttl (float): Durée de conservation d'une réponse, en secondes.
+        - shared (SharedMemoryCache): Cache partagé par les workers de l'hôte (facultatif :
+          magasin propre au processus sinon).
+        - pending_ttl (float): Durée de la réservation d'une clé dans le cache partagé.
+    """
+
+    def __init__(self, max_entries=10000, ttl=86400, shared=None, pending_ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+        self.pending_ttl = pending_ttl
+        self._responses = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._responses)
+
+    def begin(self, key, fingerprint):
+        """Réserve une clé ou retourne ce qui lui est déjà associé.
+
+        Paramètres:
+            - key (tuple): Clé d'idempotence (portée incluse).
+            - fingerprint (str): Empreinte du corps de la requête.
+
+        Retourne:
+            - tuple(str, object): ("owner", None) si l'appelant doit exécuter la requête,
+              ("stored", _StoredResponse) si une réponse est conservée, ("pending", objet dont
+              `wait(timeout)` attend la fin de l'exécution) si une exécution est en cours.
+        """
+        with self._lock:
+            stored = self._responses.get(key)
+            if stored is not None:
+                if stored.expires > time.monotonic():
+                    self._responses.move_to_end(key)
+                    return "stored", stored
+                del self._responses[key]
+
+            pending = self._pending.get(key)
+            if pending is not None:
+                return "pending", pending
+
+            if self.shared is not None:
+                shared_key = self._shared_key(key)
+                # La réservation échoue si un autre worker a déjà réservé la clé ou conservé sa réponse
+                while not self.shared.add(shared_key, ("pending", fingerprint), self.pending_ttl):
+                    record = self.shared.get(shared_key)
+                    if record is None:
+                        continue
+                    if record[0] == "pending":
+                        return "pending", _RemotePending(record[1], self.shared, shared_key)
+                    _, stored_fingerprint, status, body, content_type = record
+                    return "stored", _StoredResponse(None, stored_fingerprint, status, body, content_type)
+
+            self._pending[key] = _Pending(fingerprint)
+            return "owner", None
+
+    @staticmethod
+    def _shared_key(key):
+        return "idempotency:" + hashlib.sha256(repr(key).encode()).hexdigest()
+
+    def complete(self, key, fingerprint, status=None, body=None, content_type=None):
+        """Termine l'exécution d'une clé réservée et réveille les requêtes en attente.
+
+        Sans `status`, aucune réponse n'est conservée (erreur serveur ou exception).
+        """
+        with self._lock:
+            if status is not None:
+                self._responses[key] = _StoredResponse(time.monotonic() + self.ttl, fingerprint, status, body, content_type)
+                self._responses.move_to_end(key)
+                self._evict()
+            if self.shared is not None:
+                shared_key = self._shared_key(key)
+                # Une réponse trop volumineuse pour le cache partagé n'est rejouée que par ce worker
+                if status is None or not self.shared.set(
+                        shared_key, ("stored", fingerprint, status, body, content_type), self.ttl):
+                    self.shared.delete(shared_key)
+            pending = self._pending.pop(key, None)
+        if pending is not None:
+            pending.done.set()
+
+    def _evict(self):
+        # Les entrées expirées en tête sont retirées, puis les moins récemment utilisées
+        now = time.monotonic()
+        while self._responses:
+            oldest_key, oldest = next(iter(self._responses.items()))
+            if oldest.expires > now and len(self._responses) <= self.max_entries:
+                break
+            del self._responses[oldest_key]
+
+
+def _replay(stored):
+    response = Response(stored.body, status=stored.status, content_type=stored.content_type)
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _mismatch():
+    IDEMPOTENCY_REQUESTS.inc("mismatch")
+    return jsonify({"error": "Clé d'idempotence déjà utilisée avec une requête différente."}), 422
+
+
+def _storable(status):
+    return 200 <= status < 300 or status in STORED_ERROR_STATUSES
+
+
+def idempotent(view=None, scope=None):
+    """Décorateur de vue rejouant la réponse d'une requête déjà traitée avec la même clé.
+
+    Sans en-tête `Idempotency-Key`, la vue est exécutée normalement.
+
+    Exemples:
+        @idempotent                                  # vue anonyme (inscription)
+        @idempotent(scope=authenticated_user_id)     # clés propres à chaque utilisateur
+
+    Paramètres:
+        - scope (callable): Fonction sans argument retournant l'identifiant de l'utilisateur
+          authentifié, auquel les clés sont rattachées ; si elle retourne None (requête non
+          authentifiée), la vue est exécutée sans idempotence. Sans `scope`, les clés sont
+          communes à tous les clients.
+    """
+    if view is None:
+        return functools.partial(idempotent, scope=scope)
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        idempotency_key = request.headers.get(HEADER)
+        if not idempotency_key:
+            return view(*args, **kwargs)
+        if len(idempotency_key) > MAX_KEY_LENGTH:
+            return jsonify({"error": f"{HEADER} ne doit pas dépasser {MAX_KEY_LENGTH} caractères."}), 400
+        owner = None
+        if scope is not None:
+            owner = scope()
+            if owner is None:
+                return view(*args, **kwargs)
+
+        store = current_app.extensions["idempotency"]
+        key = (request.method, request.path, owner, idempotency_key)
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        deadline = time.monotonic() + current_app.config.get("IDEMPOTENCY_WAIT_TIMEOUT", 30)
+
+        while True:
+            state, value = store.begin(key, fingerprint)
+            if state == "owner":
+                break
+            if value.fingerprint != fingerprint:
+                return _mismatch()
+            if state == "stored":
+                IDEMPOTENCY_REQUESTS.inc("replayed")
+                return _replay(value)
+            # Exécution en cours : on attend son résultat, puis on réessaie (la clé est
+            # libérée sans réponse si l'exécution a échoué)
+            IDEMPOTENCY_REQUESTS.inc("coalesced")
+            if not value.wait(max(deadline - time.monotonic(), 0)):
+                response = jsonify({"error": "Une requête avec la même clé d'idempotence est en cours."})
+                response.headers["Retry-After"] = "1"
+                return response, 409
+
+        status = None
+        try:
+            response = make_response(view(*args, **kwargs))
+            if _storable(response.status_code) and not response.is_streamed:
+                status = response.status_code
+                IDEMPOTENCY_REQUESTS.inc("stored")
+            return response
+        finally:
+            if status is None:
+                store.complete(key, fingerprint)
+            else:
+                store.complete(key, fingerprint, status, response.get_data(), response.content_type)
+
+    return wrapper
+
+
+def init_idempotency(app):
+    """Crée le magasin des clés d'idempotence de l'application.
+
+    Le magasin est partagé par les workers de l'hôte lorsque le cache de l'application
+    (voir `init_cache`) est en mémoire partagée.
+
+    Paramètres:
+        - app (Flask): Application Flask.
+    """
+    cache = get_cache(app)
+    app.extensions["idempotency"] = IdempotencyStore(
+        max_entries=app.config.get("IDEMPOTENCY_MAX_ENTRIES", 10000),
+        ttl=app.config.get("IDEMPOTENCY_TTL", 86400),
+        shared=cache if hasattr(cache, "add") else None,
+        pending_ttl=app.config.get("IDEMPOTENCY_PENDING_TTL", 60),
+    )
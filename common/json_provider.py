@@ -0,0 +1,117 @@
+"""
+Fournisseur JSON haute performance partagé par les deux services.
+
+Ce module remplace le fournisseur JSON par défaut de Flask par une implémentation
+basée sur `orjson` (avec repli automatique sur le module `json` standard si `orjson`
+n'est pas installé).
+
+Points principaux :
+- Les entités Datastore (ou tout dictionnaire possédant un attribut `key`) sont
+  sérialisées avec l'identifiant de leur clé dans le champ `id`, qui remplace un éventuel
+  champ `id` de l'entité.
+- Les dates et datetimes gardent le format du fournisseur par défaut de Flask (date HTTP,
+  ex. "Tue, 10 Apr 2001 00:00:00 GMT") ; les clés Datastore sont réduites à leur identifiant.
+- Le fournisseur est enfichable : il suffit de sous-classer `FastJSONProvider`
+  et de l'installer via `init_json(app, provider_class=...)`.
+"""
+
+import datetime
+import json
+import time
+
+from flask.json.provider import JSONProvider
+from werkzeug.http import http_date
+
+from common.profiling import record_phase
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dépend de l'environnement
+    orjson = None
+
+
+def _default(obj):
+    """Sérialise les types non gérés nativement par l'encodeur."""
+    # Clé Datastore : on expose uniquement son identifiant
+    if hasattr(obj, "id_or_name") and hasattr(obj, "flat_path"):
+        return obj.id_or_name
+    if isinstance(obj, (datetime.date, datetime.datetime)):
+        # Même format que le fournisseur JSON par défaut de Flask
+        return http_date(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Objet de type {type(obj).__name__} non sérialisable en JSON")
+
+
+def _entity_key(obj):
+    """Retourne la clé d'une entité Datastore (ou d'un objet équivalent), sinon None."""
+    if isinstance(obj, dict):
+        return getattr(obj, "key", None)
+    return None
+
+
+class FastJSONProvider(JSONProvider):
+    """Fournisseur JSON compact basé sur orjson, conscient des entités Datastore.
+
+    Attributs:
+        - mimetype (str): Type MIME des réponses produites.
+    """
+
+    mimetype = "application/json"
+
+    def encode(self, obj):
+        """Encode un objet en octets JSON.
+
+        Une entité (ou une liste d'entités) est encodée avec l'identifiant de sa clé dans
+        le champ `id`.
+
+        Paramètres:
+            - obj: Objet à sérialiser.
+
+        Retourne:
+            - bytes: Document JSON encodé en UTF-8.
+        """
+        if _entity_key(obj) is not None:
+            return self._encode_entity(obj)
+        if isinstance(obj, list) and obj and _entity_key(obj[0]) is not None:
+            return b"[" + b",".join(self._encode_entity(entity) for entity in obj) + b"]"
+        return self._dumps(obj)
+
+    def _dumps(self, obj):
+        if orjson is not None:
+            return orjson.dumps(obj, default=_default,
+                                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+        return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def _encode_entity(self, entity):
+        key = entity.key
+        if key is None:
+            return self._dumps(entity)
+        # Un champ `id` de l'entité ne doit pas produire une clé JSON en double
+        return self._dumps({**entity, "id": key.id})
+
+    def dumps(self, obj, **kwargs):
+        return self.encode(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if orjson is not None:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        start = time.perf_counter()
+        body = self.encode(obj)
+        record_phase("serialization", time.perf_counter() - start)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def init_json(app, provider_class=FastJSONProvider):
+    """Installe le fournisseur JSON sur l'application Flask.
+
+    Paramètres:
+        - app (Flask): Application Flask.
+        - provider_class (type): Classe du fournisseur à utiliser.
+    """
+    app.json_provider_class = provider_class
+    app.json = provider_class(app)
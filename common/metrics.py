@@ -0,0 +1,498 @@
+"""
+Métriques au format texte Prometheus, partagées par les deux services.
+
+Ce module fournit un registre léger (sans dépendance externe) et les hooks Flask
+qui mesurent chaque requête.
+
+Contenu:
+- `Counter`, `Gauge`, `Histogram` : métriques étiquetées et thread-safe.
+- `track(system, operation)` : gestionnaire de contexte chronométrant un appel
+  vers un système externe (Datastore, user_service, SQL, bcrypt...).
+- `init_metrics(app)` : enregistre les hooks de mesure et l'endpoint `/metrics`.
+
+Plusieurs workers : chaque processus a son propre registre. Si `METRICS_MULTIPROC_DIR` est
+défini, chaque worker y écrit l'état de son registre (`metrics-<pid>.json`) toutes les
+`METRICS_FLUSH_INTERVAL` secondes et à chaque appel de `/metrics`. L'endpoint, servi par
+n'importe quel worker, additionne alors les fichiers de tous les workers : compteurs et
+histogrammes de tous les fichiers (y compris ceux des workers arrêtés, pour rester
+monotones), jauges des seuls fichiers récents. Un worker qui s'arrête ajoute ses compteurs
+et histogrammes au fichier `metrics-aggregate.json` et retire le sien ; un nouveau worker
+qui hérite du PID d'un worker disparu sans le faire y ajoute d'abord le fichier de ce
+dernier. Le répertoire est vidé une seule fois, par le processus maître de Gunicorn
+(`clear_multiprocess_dir`, voir `common/server.py`), et ne doit servir qu'à un service.
+
+Métriques exposées :
+- http_requests_total{method, route, status}
+- http_request_duration_seconds{method, route}
+- http_requests_in_flight
+- downstream_call_duration_seconds{system, operation}
+"""
+
+import atexit
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, request
+
+from common.profiling import record_phase
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - dépend de la plateforme
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Compteurs et histogrammes des workers arrêtés (lu avec les fichiers `metrics-<pid>.json`)
+AGGREGATE_FILE = "metrics-aggregate.json"
+_LOCK_FILE = "metrics.lock"
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+@contextmanager
+def _directory_lock(directory, exclusive):
+    # Verrou fcntl du répertoire : une fusion dans le fichier agrégé et le retrait du fichier
+    # du worker paraissent atomiques aux lectures de `render_multiprocess`
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(os.path.join(directory, _LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+    finally:
+        os.close(fd)
+
+
+def _write_json(path, state):
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(state, file)
+    os.replace(path + ".tmp", path)
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base commune des métriques : nom, aide, étiquettes et verrou."""
+
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _check(self, labelvalues):
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(f"{self.name} attend les étiquettes {self.labelnames}")
+
+    def snapshot(self):
+        """Retourne une copie des valeurs par étiquettes."""
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def combine(first, second):
+        """Additionne les valeurs d'une même série provenant de deux processus."""
+        return first + second
+
+    def collect(self, values=None):
+        """Retourne les lignes de texte Prometheus de la métrique (valeurs fournies ou propres)."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        items = sorted((self.snapshot() if values is None else values).items())
+        for labelvalues, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """Compteur monotone."""
+
+    type_name = "counter"
+
+    def inc(self, *labelvalues, amount=1):
+        self._check(labelvalues)
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues):
+        return self._values.get(labelvalues, 0)
+
+
+class Gauge(_Metric):
+    """Jauge pouvant augmenter et diminuer."""
+
+    type_name = "gauge"
+
+    def inc(self, *labelvalues, amount=1):
+        self._check(labelvalues)
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, value, *labelvalues):
+        self._check(labelvalues)
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def value(self, *labelvalues):
+        return self._values.get(labelvalues, 0)
+
+
+class _Timer:
+    """Chronomètre une portion de code et l'enregistre dans un histogramme."""
+
+    __slots__ = ("histogram", "labelvalues", "phase", "start", "elapsed")
+
+    def __init__(self, histogram, labelvalues, phase=None):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+        self.phase = phase
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self.start
+        self.histogram.observe(self.elapsed, *self.labelvalues)
+        if self.phase is not None:
+            record_phase(self.phase, self.elapsed)
+        return False
+
+
+class Histogram(_Metric):
+    """Histogramme cumulatif à seaux fixes."""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labelvalues):
+        self._check(labelvalues)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                # [compteurs par seau (+Inf inclus), somme, nombre]
+                state = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, *labelvalues, phase=None):
+        """Retourne un gestionnaire de contexte chronométrant le bloc.
+
+        Si `phase` est fourni, la durée est aussi ajoutée à cette phase de la requête courante.
+        """
+        return _Timer(self, labelvalues, phase)
+
+    def count(self, *labelvalues):
+        state = self._values.get(labelvalues)
+        return state[2] if state else 0
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: [list(state[0]), state[1], state[2]] for labels, state in self._values.items()}
+
+    @staticmethod
+    def combine(first, second):
+        return [[a + b for a, b in zip(first[0], second[0])], first[1] + second[1], first[2] + second[2]]
+
+    def collect(self, values=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        items = sorted((self.snapshot() if values is None else values).items())
+        for labelvalues, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, labelvalues, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """Registre des métriques d'un processus."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        # Plus aucune écriture de `dump` après `retire`
+        self._dump_lock = threading.Lock()
+        self._retired = False
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Métrique déjà enregistrée : {metric.name}")
+            self._metrics[metric.name] = metric
+
+    def render(self):
+        """Produit l'exposition complète au format texte Prometheus."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+    def _state(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: [[list(labels), value] for labels, value in metric.snapshot().items()]
+                for metric in metrics}
+
+    def dump(self, directory):
+        """Écrit l'état du registre du processus dans `directory/metrics-<pid>.json`."""
+        with self._dump_lock:
+            if not self._retired:
+                _write_json(os.path.join(directory, f"metrics-{os.getpid()}.json"), self._state())
+
+    def _merge_into_aggregate(self, directory, state):
+        # Sous le verrou exclusif du répertoire ; les jauges d'un processus arrêté sont ignorées
+        path = os.path.join(directory, AGGREGATE_FILE)
+        try:
+            with open(path, encoding="utf-8") as file:
+                aggregate = json.load(file)
+        except (OSError, ValueError):
+            aggregate = {}
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            if metric.type_name == "gauge":
+                continue
+            values = {tuple(labels): value for labels, value in aggregate.get(metric.name, ())}
+            for labels, value in state.get(metric.name, ()):
+                labels = tuple(labels)
+                values[labels] = metric.combine(values[labels], value) if labels in values else value
+            aggregate[metric.name] = [[list(labels), value] for labels, value in values.items()]
+        _write_json(path, aggregate)
+
+    def adopt_stale(self, directory):
+        """Ajoute au fichier agrégé le fichier d'un processus arrêté qui portait le PID courant.
+
+        À appeler avant la première écriture du processus : sans cela, `dump` écraserait les
+        compteurs du processus disparu (PID réutilisé).
+        """
+        path = os.path.join(directory, f"metrics-{os.getpid()}.json")
+        with _directory_lock(directory, exclusive=True):
+            try:
+                with open(path, encoding="utf-8") as file:
+                    state = json.load(file)
+            except (OSError, ValueError):
+                return
+            self._merge_into_aggregate(directory, state)
+            os.unlink(path)
+
+    def retire(self, directory):
+        """Ajoute les compteurs et histogrammes du processus au fichier agrégé et retire son
+        fichier (arrêt du worker)."""
+        with self._dump_lock:
+            if self._retired:
+                return
+            self._retired = True
+            with _directory_lock(directory, exclusive=True):
+                self._merge_into_aggregate(directory, self._state())
+                path = os.path.join(directory, f"metrics-{os.getpid()}.json")
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    def render_multiprocess(self, directory, stale_after):
+        """Produit l'exposition des registres de tous les processus écrits dans `directory`.
+
+        Paramètres:
+            - directory (str): Répertoire des fichiers écrits par `dump`.
+            - stale_after (float): Âge, en secondes, au-delà duquel les jauges d'un fichier
+              (processus arrêté) sont ignorées.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        merged = {metric.name: {} for metric in metrics}
+        now = time.time()
+        states = []
+        with _directory_lock(directory, exclusive=False):
+            for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+                try:
+                    fresh = now - os.path.getmtime(path) <= stale_after
+                    with open(path, encoding="utf-8") as file:
+                        states.append((fresh, json.load(file)))
+                except (OSError, ValueError):
+                    # Fichier retiré ou en cours de remplacement
+                    continue
+        for fresh, state in states:
+            for metric in metrics:
+                if metric.type_name == "gauge" and not fresh:
+                    continue
+                values = merged[metric.name]
+                for labels, value in state.get(metric.name, ()):
+                    labels = tuple(labels)
+                    values[labels] = metric.combine(values[labels], value) if labels in values else value
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect(merged[metric.name]))
+        return "\n".join(lines) + "\n"
+
+
+# Registre global du processus
+REGISTRY = Registry()
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "Nombre de requêtes HTTP traitées.", ("method", "route", "status"))
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "Durée de traitement des requêtes HTTP.", ("method", "route"))
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Nombre de requêtes HTTP en cours de traitement.")
+DOWNSTREAM_LATENCY = Histogram(
+    "downstream_call_duration_seconds", "Durée des appels vers les systèmes externes.", ("system", "operation"))
+
+# Phase de requête (voir common.profiling) à laquelle est imputé chaque système externe
+PHASES = {"datastore": "storage", "sql": "storage", "user_service": "auth", "bcrypt": "auth"}
+
+
+def track(system, operation):
+    """Chronomètre un appel vers un système externe.
+
+    Exemple:
+        with track("datastore", "put"):
+            client.put(entity)
+
+    Paramètres:
+        - system (str): Système appelé (datastore, user_service, sql, bcrypt...).
+        - operation (str): Opération effectuée.
+    """
+    return DOWNSTREAM_LATENCY.time(system, operation, phase=PHASES.get(system, system))
+
+
+def _route_label():
+    # On utilise le motif de la route (et non le chemin) pour borner la cardinalité
+    rule = request.url_rule
+    return rule.rule if rule is not None else "<unmatched>"
+
+
+# Processus dont le registre est écrit périodiquement (le thread ne survit pas au fork)
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _start_flusher(directory, interval):
+    global _flusher_pid
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        # Avant toute écriture du processus, y compris par `/metrics` dans un autre thread
+        REGISTRY.adopt_stale(directory)
+        _flusher_pid = os.getpid()
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                REGISTRY.dump(directory)
+            except OSError:
+                logger.exception("Écriture des métriques impossible dans %s.", directory)
+
+    threading.Thread(target=run, name="metrics-flush", daemon=True).start()
+    # Dernières valeurs d'un worker qui s'arrête normalement
+    atexit.register(lambda: REGISTRY.retire(directory) if os.path.isdir(directory) else None)
+
+
+def clear_multiprocess_dir(directory):
+    """Crée ou vide le répertoire des registres des workers.
+
+    À appeler une seule fois au démarrage du service, dans le processus maître (hook
+    `on_starting` de Gunicorn), jamais à la création de l'application : un worker (ou le
+    processus `flask cascade-worker`) effacerait sinon les compteurs des autres.
+
+    Paramètres:
+        - directory (str): Valeur de `METRICS_MULTIPROC_DIR`.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "metrics-*.json*")):
+        os.unlink(path)
+
+
+def init_metrics(app):
+    """Enregistre les hooks de mesure et l'endpoint `/metrics` sur l'application.
+
+    Avec `METRICS_MULTIPROC_DIR`, le répertoire est créé s'il n'existe pas (il est vidé par
+    `clear_multiprocess_dir`) et `/metrics` agrège les registres de tous les workers.
+
+    Paramètres:
+        - app (Flask): Application Flask.
+    """
+    directory = app.config.get("METRICS_MULTIPROC_DIR")
+    interval = app.config.get("METRICS_FLUSH_INTERVAL", 5.0)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    @app.before_request
+    def _start_timer():
+        if directory:
+            _start_flusher(directory, interval)
+        g._metrics_start = time.perf_counter()
+        g._metrics_in_flight = True
+        HTTP_IN_FLIGHT.inc()
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop("_metrics_start", None)
+        if start is not None:
+            route = _route_label()
+            HTTP_LATENCY.observe(time.perf_counter() - start, request.method, route)
+            HTTP_REQUESTS.inc(request.method, route, str(response.status_code))
+        return response
+
+    @app.teardown_request
+    def _end_request(exc):
+        if g.pop("_metrics_in_flight", False):
+            HTTP_IN_FLIGHT.dec()
+        # Requête interrompue par une exception non gérée
+        start = g.pop("_metrics_start", None)
+        if start is not None:
+            route = _route_label()
+            HTTP_LATENCY.observe(time.perf_counter() - start, request.method, route)
+            HTTP_REQUESTS.inc(request.method, route, "500")
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        if not directory:
+            return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+        REGISTRY.dump(directory)
+        return Response(REGISTRY.render_multiprocess(directory, stale_after=3 * interval),
+                        mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,137 @@
+"""
+Profilage à la demande et journal des requêtes lentes, partagés par les deux services.
+
+Ce module s'appuie sur les hooks Flask `before_request` / `after_request`.
+
+Points principaux :
+- Profilage cProfile (et optionnellement tracemalloc) d'une requête, déclenché par un
+  en-tête privilégié ou par échantillonnage ; le résultat est écrit dans un répertoire.
+- Mesure des durées par phase (auth, storage, serialization) via `record_phase`.
+- Journalisation des requêtes dépassant un seuil avec leur découpage par phase.
+
+Configuration (via `app.config`) :
+- PROFILE_HEADER (str): En-tête déclenchant le profilage. Défaut : "X-Profile".
+- PROFILE_TOKEN (str): Valeur attendue de l'en-tête ; le déclenchement par en-tête est désactivé si absent.
+- PROFILE_SAMPLE_RATE (float): Proportion de requêtes profilées aléatoirement. Défaut : 0.
+- PROFILE_DIR (str): Répertoire de sortie des profils. Défaut : "profiles".
+- PROFILE_MEMORY (bool): Capture également les allocations avec tracemalloc. Défaut : False.
+- SLOW_REQUEST_THRESHOLD_MS (float): Seuil du journal des requêtes lentes (0 pour désactiver). Défaut : 1000.
+"""
+
+import cProfile
+import hmac
+import os
+import random
+import time
+import tracemalloc
+
+from flask import g, has_request_context, request
+
+
+def record_phase(phase, seconds):
+    """Ajoute une durée à une phase de la requête courante.
+
+    Sans effet en dehors d'un contexte de requête.
+
+    Paramètres:
+        - phase (str): Nom de la phase (auth, storage, serialization...).
+        - seconds (float): Durée à ajouter, en secondes.
+    """
+    if not has_request_context():
+        return
+    phases = g.get("_phases")
+    if phases is None:
+        phases = g._phases = {}
+    phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+def _should_profile(app):
+    token = app.config.get("PROFILE_TOKEN")
+    header = request.headers.get(app.config.get("PROFILE_HEADER", "X-Profile"))
+    if token and header and hmac.compare_digest(header, token):
+        return True
+    rate = app.config.get("PROFILE_SAMPLE_RATE", 0)
+    return rate > 0 and random.random() < rate
+
+
+def _start_profile(app):
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Un autre outil de profilage est déjà actif sur ce thread
+        return
+    g._profiler = profiler
+
+    if app.config.get("PROFILE_MEMORY") and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        g._profile_memory = True
+
+
+def _dump_profile(app, response):
+    profiler = g.pop("_profiler")
+    profiler.disable()
+
+    directory = app.config.get("PROFILE_DIR", "profiles")
+    os.makedirs(directory, exist_ok=True)
+    endpoint = (request.endpoint or "unmatched").replace(".", "-")
+    name = f"{int(time.time() * 1000)}-{os.getpid()}-{request.method}-{endpoint}"
+    profiler.dump_stats(os.path.join(directory, f"{name}.prof"))
+
+    if g.pop("_profile_memory", False):
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        with open(os.path.join(directory, f"{name}.mem.txt"), "w", encoding="utf-8") as f:
+            for stat in snapshot.statistics("lineno")[:50]:
+                f.write(f"{stat}\n")
+
+    response.headers["X-Profile-Id"] = name
+
+
+def _log_if_slow(app, response):
+    threshold_ms = app.config.get("SLOW_REQUEST_THRESHOLD_MS", 1000)
+    start = g.get("_profiling_start")
+    if not threshold_ms or start is None:
+        return
+
+    total_ms = (time.perf_counter() - start) * 1000
+    if total_ms < threshold_ms:
+        return
+
+    phases = {name: seconds * 1000 for name, seconds in g.get("_phases", {}).items()}
+    phases["other"] = max(total_ms - sum(phases.values()), 0.0)
+    details = " ".join(f"{name}={duration:.1f}ms" for name, duration in sorted(phases.items()))
+    app.logger.warning(
+        "Requête lente : %s %s %d %.1fms [%s]",
+        request.method, request.path, response.status_code, total_ms, details,
+    )
+
+
+def init_profiling(app):
+    """Enregistre les hooks de profilage et de journal des requêtes lentes.
+
+    Paramètres:
+        - app (Flask): Application Flask.
+    """
+
+    @app.before_request
+    def _start_request_profiling():
+        g._profiling_start = time.perf_counter()
+        if _should_profile(app):
+            _start_profile(app)
+
+    @app.after_request
+    def _finish_request_profiling(response):
+        if "_profiler" in g:
+            _dump_profile(app, response)
+        _log_if_slow(app, response)
+        return response
+
+    @app.teardown_request
+    def _stop_request_profiling(exc):
+        # Requête interrompue par une exception : on arrête la capture sans l'écrire
+        profiler = g.pop("_profiler", None)
+        if profiler is not None:
+            profiler.disable()
+        if g.pop("_profile_memory", False):
+            tracemalloc.stop()
@@ -0,0 +1,72 @@
+"""
+Lancement des services en mode production (plusieurs processus).
+
+Ce module démarre une application Flask derrière Gunicorn, avec des workers `gthread`.
+L'application est chargée une seule fois dans le processus maître (`preload_app`) puis
+partagée par fork : elle ne doit donc ouvrir aucune connexion à la création, les
+clients (Datastore, SQLAlchemy) étant créés ou réinitialisés dans chaque worker.
+
+Gunicorn n'est disponible que sous Linux / macOS.
+"""
+
+import os
+
+from common.metrics import clear_multiprocess_dir
+
+
+def default_workers():
+    """Nombre de workers par défaut : (2 x CPU) + 1."""
+    return (os.cpu_count() or 1) * 2 + 1
+
+
+def serve_production(app, host, port, workers, threads, post_fork=None):
+    """Sert l'application avec Gunicorn.
+
+    Paramètres:
+        - app (Flask): Application créée par la fabrique `create_app()`.
+        - host (str): Adresse d'écoute.
+        - port (int): Port d'écoute.
+        - workers (int): Nombre de processus workers.
+        - threads (int): Nombre de threads par worker.
+        - post_fork (callable): Fonction `post_fork(app)` exécutée dans chaque worker après le fork.
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError as exc:
+        raise SystemExit("Le mode production nécessite gunicorn (pip install gunicorn).") from exc
+
+    class _Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("threads", threads)
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("preload_app", True)
+            if post_fork is not None:
+                self.cfg.set("post_fork", lambda server, worker: post_fork(app))
+            if app.config.get("METRICS_MULTIPROC_DIR"):
+                # Une seule fois, dans le maître : les workers relancés gardent les fichiers des autres
+                self.cfg.set("on_starting",
+                             lambda server: clear_multiprocess_dir(app.config["METRICS_MULTIPROC_DIR"]))
+
+        def load(self):
+            return app
+
+    _Application().run()
+
+
+def add_server_arguments(parser, default_port):
+    """Ajoute les options communes des points d'entrée `run.py`.
+
+    Paramètres:
+        - parser (argparse.ArgumentParser): Analyseur à compléter.
+        - default_port (int): Port par défaut du service.
+    """
+    parser.add_argument("--production", action="store_true",
+                        help="Sert l'application avec plusieurs workers Gunicorn.")
+    parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"), help="Adresse d'écoute.")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", default_port)), help="Port d'écoute.")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKERS", default_workers())),
+                        help="Nombre de processus workers (mode production).")
+    parser.add_argument("--threads", type=int, default=int(os.getenv("THREADS", 4)),
+                        help="Nombre de threads par worker (mode production).")
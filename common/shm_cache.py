@@ -0,0 +1,456 @@
+"""
+Cache partagé par les processus d'un hôte, en mémoire partagée (fichier projeté par mmap).
+
+Le fichier contient une table de hachage de taille fixe : `max_entries` emplacements de
+`entry_size` octets, regroupés en ensembles de `WAYS` emplacements. Une clé est rangée
+dans l'ensemble désigné par son empreinte (blake2b, stable d'un processus à l'autre) ;
+lorsque l'ensemble est plein, l'emplacement remplacé est choisi par l'algorithme CLOCK
+(bit de référence positionné à chaque lecture, aiguille propre à l'ensemble). Les
+valeurs sont sérialisées avec pickle et expirent après leur TTL.
+
+Concurrence :
+- Lectures sans verrou : chaque emplacement porte un numéro de version (seqlock), impair
+  pendant une écriture ; une lecture qui observe une version impaire ou modifiée recommence.
+- Écritures sous verrous répartis (`STRIPES` verrous) : verrou de thread du processus et
+  verrou `fcntl` sur un octet du fichier, pour exclure les autres processus.
+- Chaque ensemble porte un compteur de génération, incrémenté par `delete` : une valeur
+  calculée pendant une suppression n'est pas réécrite (`set(..., generation=...)`).
+
+Le fichier est créé avec les droits 0600 : seuls les processus du même utilisateur
+peuvent y lire ou écrire. Tous les processus qui l'ouvrent doivent utiliser la même
+géométrie (`max_entries`, `entry_size`). Disponible sous Linux / macOS uniquement.
+"""
+
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+
+from common.metrics import Counter
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - dépend de la plateforme
+    fcntl = None
+
+
+MAGIC = b"SHMCACH2"
+WAYS = 8
+STRIPES = 64
+
+# En-tête du fichier : magique, nombre d'emplacements, taille d'un emplacement
+_HEADER = struct.Struct("<8sII")
+_HEADER_SIZE = 64
+# En-tête d'un emplacement : version, empreinte, expiration, occupé, référencé,
+# longueur de la clé, longueur de la valeur
+_SLOT = struct.Struct("<IQdBBHI")
+_SLOT_HEADER_SIZE = 32
+_VERSION = struct.Struct("<I")
+_REF_OFFSET = 21
+_HAND = struct.Struct("<I")
+# Génération d'un ensemble : incrémentée à chaque suppression d'une de ses clés
+_GENERATION = struct.Struct("<Q")
+
+# Tentatives d'une lecture concurrente d'une écriture avant de conclure à une absence
+_READ_RETRIES = 8
+
+SHM_CACHE_EVICTIONS = Counter(
+    "shm_cache_evictions_total", "Entrées du cache partagé remplacées avant expiration.")
+SHM_CACHE_OVERSIZED = Counter(
+    "shm_cache_oversized_total", "Valeurs non conservées par le cache partagé car trop volumineuses.")
+
+
+class SharedMemoryCache:
+    """Table de hachage à expiration en mémoire partagée.
+
+    Paramètres:
+        - path (str): Fichier projeté en mémoire (de préférence sous /dev/shm).
+        - max_entries (int): Nombre d'emplacements (arrondi au multiple de `WAYS` supérieur).
+        - entry_size (int): Taille d'un emplacement, en-tête compris, en octets.
+        - ttl (float): Durée de vie par défaut d'une entrée, en secondes.
+
+    Lève:
+        - RuntimeError: Si la plateforme ne fournit pas `fcntl`.
+        - ValueError: Si le fichier existe avec une autre géométrie ou appartient à un autre
+          utilisateur.
+    """
+
+    def __init__(self, path, max_entries=4096, entry_size=2048, ttl=60.0):
+        if fcntl is None:
+            raise RuntimeError("Le cache partagé nécessite fcntl (Linux / macOS).")
+        self.path = path
+        self.sets = max(-(-max_entries // WAYS), 1)
+        self.slots = self.sets * WAYS
+        self.entry_size = entry_size
+        self.ttl = ttl
+        self._generations_offset = _HEADER_SIZE + self.sets * _HAND.size
+        self._slots_offset = self._generations_offset + self.sets * _GENERATION.size
+        size = self._slots_offset + self.slots * entry_size
+        self._thread_locks = [threading.Lock() for _ in range(STRIPES)]
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            # Les valeurs sont désérialisées avec pickle : le fichier doit appartenir au
+            # processus et n'être lisible et modifiable que par lui
+            status = os.fstat(self._fd)
+            if status.st_uid != os.geteuid():
+                raise ValueError(f"{path} appartient à un autre utilisateur ; changez de chemin.")
+            if status.st_mode & 0o077:
+                os.fchmod(self._fd, 0o600)
+            # Verrou d'initialisation (octet 0) : un seul processus crée l'en-tête
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, 0)
+            try:
+                if os.fstat(self._fd).st_size == 0:
+                    os.ftruncate(self._fd, size)
+                    os.pwrite(self._fd, _HEADER.pack(MAGIC, self.slots, entry_size), 0)
+                header = _HEADER.unpack(os.pread(self._fd, _HEADER.size, 0))
+                if header != (MAGIC, self.slots, entry_size) or os.fstat(self._fd).st_size != size:
+                    raise ValueError(f"{path} existe avec une autre géométrie ; supprimez-le ou changez de chemin.")
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, 0)
+            self._map = mmap.mmap(self._fd, size)
+        except BaseException:
+            os.close(self._fd)
+            raise
+
+    @staticmethod
+    def _hash(key_bytes):
+        return int.from_bytes(hashlib.blake2b(key_bytes, digest_size=8).digest(), "little")
+
+    def _slot_offset(self, index):
+        return self._slots_offset + index * self.entry_size
+
+    def _read(self, offset):
+        # Copie cohérente d'un emplacement (seqlock), ou None si une écriture est en cours
+        for _ in range(_READ_RETRIES):
+            version = _VERSION.unpack_from(self._map, offset)[0]
+            if version & 1:
+                continue
+            header = _SLOT.unpack_from(self._map, offset)
+            start = offset + _SLOT_HEADER_SIZE
+            end = min(start + header[5] + header[6], offset + self.entry_size)
+            payload = self._map[start:end]
+            if _VERSION.unpack_from(self._map, offset)[0] == version:
+                return header, payload
+        return None
+
+    def _lookup(self, key_bytes, digest):
+        # Emplacement et contenu d'une clé non expirée, lus sans verrou, ou None
+        first = (digest % self.sets) * WAYS
+        now = time.time()
+        for index in range(first, first + WAYS):
+            offset = self._slot_offset(index)
+            entry = self._read(offset)
+            if entry is None:
+                continue
+            (_, slot_hash, expires, used, referenced, key_length, _), payload = entry
+            if not used or slot_hash != digest or payload[:key_length] != key_bytes:
+                continue
+            if expires <= now:
+                return None
+            return offset, referenced, payload[key_length:]
+        return None
+
+    def get(self, key):
+        """Retourne la valeur associée à une clé, ou None si elle est absente ou expirée."""
+        key_bytes = key.encode()
+        entry = self._lookup(key_bytes, self._hash(key_bytes))
+        if entry is None:
+            return None
+        offset, referenced, value = entry
+        if not referenced:
+            # Bit de référence CLOCK : écriture d'un octet, sans verrou
+            self._map[offset + _REF_OFFSET] = 1
+        try:
+            return pickle.loads(value)
+        except Exception:
+            return None
+
+    def contains(self, key):
+        """Indique, sans verrou ni désérialisation, si une clé est présente et non expirée."""
+        key_bytes = key.encode()
+        return self._lookup(key_bytes, self._hash(key_bytes)) is not None
+
+    def _locked(self, set_index):
+        return _StripeLock(self, set_index % STRIPES)
+
+    def _find(self, set_index, key_bytes, digest):
+        # Emplacement de la clé, sinon premier emplacement libre ou expiré, sinon None
+        first = set_index * WAYS
+        free = None
+        now = time.time()
+        for index in range(first, first + WAYS):
+            offset = self._slot_offset(index)
+            _, slot_hash, expires, used, _, key_length, _ = _SLOT.unpack_from(self._map, offset)
+            start = offset + _SLOT_HEADER_SIZE
+            if used and slot_hash == digest and self._map[start:start + key_length] == key_bytes:
+                return index, True
+            if free is None and (not used or expires <= now):
+                free = index
+        return free, False
+
+    def _evict(self, set_index):
+        # CLOCK : on retire le bit de référence des entrées lues jusqu'à en trouver une non lue
+        hand_offset = _HEADER_SIZE + set_index * _HAND.size
+        hand = _HAND.unpack_from(self._map, hand_offset)[0] % WAYS
+        for _ in range(2 * WAYS):
+            offset = self._slot_offset(set_index * WAYS + hand)
+            victim = hand
+            hand = (hand + 1) % WAYS
+            if self._map[offset + _REF_OFFSET]:
+                self._map[offset + _REF_OFFSET] = 0
+                continue
+            break
+        _HAND.pack_into(self._map, hand_offset, hand)
+        SHM_CACHE_EVICTIONS.inc()
+        return set_index * WAYS + victim
+
+    def _write(self, index, header, payload):
+        offset = self._slot_offset(index)
+        version = _VERSION.unpack_from(self._map, offset)[0]
+        _VERSION.pack_into(self._map, offset, version + 1)
+        _SLOT.pack_into(self._map, offset, version + 1, *header)
+        self._map[offset + _SLOT_HEADER_SIZE:offset + _SLOT_HEADER_SIZE + len(payload)] = payload
+        _VERSION.pack_into(self._map, offset, version + 2)
+
+    def fits(self, size):
+        """Indique si une valeur sérialisée de `size` octets (clé comprise) tient dans un emplacement."""
+        return size <= self.entry_size - _SLOT_HEADER_SIZE
+
+    def _generation_offset(self, set_index):
+        return self._generations_offset + set_index * _GENERATION.size
+
+    def _bump(self, set_index):
+        # Sous le verrou de l'ensemble
+        offset = self._generation_offset(set_index)
+        _GENERATION.pack_into(self._map, offset, _GENERATION.unpack_from(self._map, offset)[0] + 1)
+
+    def generation(self, key):
+        """Retourne le compteur d'invalidation d'une clé (partagé par les clés de son ensemble)."""
+        set_index = self._hash(key.encode()) % self.sets
+        return _GENERATION.unpack_from(self._map, self._generation_offset(set_index))[0]
+
+    def _store(self, key_bytes, payload, ttl, only_if_absent=False, generation=None):
+        # Écrit `payload` (clé suivie de la valeur sérialisée) ; False si la clé est déjà
+        # présente et `only_if_absent`, ou si elle a été invalidée depuis `generation`
+        digest = self._hash(key_bytes)
+        set_index = digest % self.sets
+        now = time.time()
+        with self._locked(set_index):
+            if generation is not None and \
+                    _GENERATION.unpack_from(self._map, self._generation_offset(set_index))[0] != generation:
+                return False
+            index, found = self._find(set_index, key_bytes, digest)
+            if only_if_absent and found and _SLOT.unpack_from(self._map, self._slot_offset(index))[2] > now:
+                return False
+            if index is None:
+                index = self._evict(set_index)
+            self._write(index, (digest, now + (self.ttl if ttl is None else ttl), 1, 1, len(key_bytes),
+                                len(payload) - len(key_bytes)), payload)
+        return True
+
+    def set(self, key, value, ttl=None, generation=None):
+        """Associe une valeur à une clé pour `ttl` secondes (durée par défaut si None).
+
+        Si `generation` est fourni (valeur de `generation(key)` lue avant de calculer la
+        valeur), la valeur n'est conservée que si la clé n'a pas été supprimée entre-temps.
+
+        Retourne:
+            - bool: True si la valeur a été conservée (False si elle est trop volumineuse ou
+              si la clé a été invalidée).
+        """
+        key_bytes = key.encode()
+        payload = key_bytes + pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if not self.fits(len(payload)):
+            SHM_CACHE_OVERSIZED.inc()
+            # Une ancienne valeur ne doit pas survivre à sa mise à jour
+            if self.contains(key):
+                self.delete(key)
+            return False
+        return self._store(key_bytes, payload, ttl, generation=generation)
+
+    def add(self, key, value, ttl=None):
+        """Associe une valeur à une clé seulement si elle est absente ou expirée.
+
+        L'opération est atomique entre les processus de l'hôte (réservation d'une clé).
+
+        Retourne:
+            - bool: True si la valeur a été conservée, False si la clé est déjà présente ou
+              si la valeur est trop volumineuse.
+        """
+        key_bytes = key.encode()
+        payload = key_bytes + pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if not self.fits(len(payload)):
+            SHM_CACHE_OVERSIZED.inc()
+            return False
+        return self._store(key_bytes, payload, ttl, only_if_absent=True)
+
+    def delete(self, key):
+        """Retire une clé du cache."""
+        key_bytes = key.encode()
+        digest = self._hash(key_bytes)
+        set_index = digest % self.sets
+        with self._locked(set_index):
+            # Même absente, la clé peut être en cours de calcul (voir `generation`)
+            self._bump(set_index)
+            index, found = self._find(set_index, key_bytes, digest)
+            if found:
+                self._write(index, (0, 0.0, 0, 0, 0, 0), b"")
+
+    def clear(self):
+        """Vide le cache."""
+        for set_index in range(self.sets):
+            with self._locked(set_index):
+                self._bump(set_index)
+                for index in range(set_index * WAYS, (set_index + 1) * WAYS):
+                    self._write(index, (0, 0.0, 0, 0, 0, 0), b"")
+
+    def close(self):
+        """Ferme la projection mémoire (le fichier est conservé)."""
+        self._map.close()
+        os.close(self._fd)
+
+
+class TieredSharedMemoryCache:
+    """Cache partagé à deux classes de taille d'emplacement.
+
+    Une table à petits emplacements reçoit la majorité des valeurs (jetons, réponses
+    courtes) ; les valeurs qui n'y tiennent pas (propriétés avec une longue description
+    ou de nombreuses pièces) sont rangées dans une seconde table, à grands emplacements
+    moins nombreux, dans le fichier `path + ".large"`. Une clé n'est présente que dans
+    une des deux tables : l'écriture dans l'une retire la clé de l'autre.
+
+    Paramètres:
+        - path (str): Fichier de la petite table ; la grande utilise `path + ".large"`.
+        - max_entries (int): Nombre d'emplacements de la petite table.
+        - entry_size (int): Taille d'un petit emplacement, en octets.
+        - large_max_entries (int): Nombre d'emplacements de la grande table.
+        - large_entry_size (int): Taille d'un grand emplacement, en octets.
+        - ttl (float): Durée de vie par défaut d'une entrée, en secondes.
+
+    Lève:
+        - RuntimeError: Si la plateforme ne fournit pas `fcntl`.
+        - ValueError: Si l'un des fichiers existe avec une autre géométrie.
+    """
+
+    def __init__(self, path, max_entries=4096, entry_size=2048, large_max_entries=1024,
+                 large_entry_size=16384, ttl=60.0):
+        self.small = SharedMemoryCache(path, max_entries, entry_size, ttl)
+        try:
+            self.large = SharedMemoryCache(path + ".large", large_max_entries, large_entry_size, ttl)
+        except BaseException:
+            self.small.close()
+            raise
+        self.path = path
+        self.ttl = ttl
+
+    def _tiers(self, size):
+        # Table qui reçoit une valeur de `size` octets et l'autre table, ou None si trop volumineuse
+        if self.small.fits(size):
+            return self.small, self.large
+        if self.large.fits(size):
+            return self.large, self.small
+        return None
+
+    def get(self, key):
+        """Retourne la valeur associée à une clé, ou None si elle est absente ou expirée."""
+        value = self.small.get(key)
+        if value is None:
+            value = self.large.get(key)
+        return value
+
+    def contains(self, key):
+        """Indique si une clé est présente et non expirée dans l'une des tables."""
+        return self.small.contains(key) or self.large.contains(key)
+
+    def generation(self, key):
+        """Retourne les compteurs d'invalidation d'une clé dans les deux tables."""
+        return self.small.generation(key), self.large.generation(key)
+
+    def set(self, key, value, ttl=None, generation=None):
+        """Associe une valeur à une clé, dans la table adaptée à sa taille.
+
+        `generation` : voir `SharedMemoryCache.set`.
+
+        Retourne:
+            - bool: True si la valeur a été conservée (False si elle dépasse les grands
+              emplacements ou si la clé a été invalidée).
+        """
+        key_bytes = key.encode()
+        payload = key_bytes + pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        tiers = self._tiers(len(payload))
+        if tiers is None:
+            SHM_CACHE_OVERSIZED.inc()
+            self.delete(key)
+            return False
+        target, other = tiers
+        # `delete` invalide les deux tables : la génération de la table cible suffit
+        expected = None if generation is None else generation[0 if target is self.small else 1]
+        if not target._store(key_bytes, payload, ttl, generation=expected):
+            return False
+        # L'ancienne valeur, d'une autre taille, ne doit pas masquer la nouvelle
+        if other.contains(key):
+            other.delete(key)
+        return True
+
+    def add(self, key, value, ttl=None):
+        """Associe une valeur à une clé seulement si elle est absente ou expirée des deux tables.
+
+        Retourne:
+            - bool: True si la valeur a été conservée, False si la clé est déjà présente ou
+              si la valeur est trop volumineuse.
+        """
+        key_bytes = key.encode()
+        payload = key_bytes + pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        tiers = self._tiers(len(payload))
+        if tiers is None:
+            SHM_CACHE_OVERSIZED.inc()
+            return False
+        target, other = tiers
+        if other.contains(key) or not target._store(key_bytes, payload, ttl, only_if_absent=True):
+            return False
+        # Une valeur écrite dans l'autre table entre les deux vérifications l'emporte : son
+        # écrivain l'y a rangée avant de retirer la clé de cette table
+        if other.contains(key):
+            target.delete(key)
+            return False
+        return True
+
+    def delete(self, key):
+        """Retire une clé des deux tables."""
+        for tier in (self.small, self.large):
+            tier.delete(key)
+
+    def clear(self):
+        """Vide les deux tables."""
+        self.small.clear()
+        self.large.clear()
+
+    def close(self):
+        """Ferme les projections mémoire (les fichiers sont conservés)."""
+        self.small.close()
+        self.large.close()
+
+
+class _StripeLock:
+    """Verrou d'écriture d'un groupe d'ensembles, entre threads et entre processus."""
+
+    __slots__ = ("cache", "stripe")
+
+    def __init__(self, cache, stripe):
+        self.cache = cache
+        self.stripe = stripe
+
+    def __enter__(self):
+        self.cache._thread_locks[self.stripe].acquire()
+        # Octets 1 à STRIPES de l'en-tête : un verrou fcntl par groupe
+        fcntl.lockf(self.cache._fd, fcntl.LOCK_EX, 1, 1 + self.stripe)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        fcntl.lockf(self.cache._fd, fcntl.LOCK_UN, 1, 1 + self.stripe)
+        self.cache._thread_locks[self.stripe].release()
+        return False
@@ -0,0 +1,82 @@
+"""
+Regroupement des lectures identiques simultanées (single-flight).
+
+Lorsque plusieurs threads d'un worker demandent en même temps la même clé absente du
+cache, un seul (le « meneur ») exécute la lecture ; les autres attendent sa fin et
+partagent son résultat, ou son exception. Le regroupement ne concerne que les appels
+simultanés : aucun résultat n'est conservé une fois la lecture terminée (voir
+`common/cache.py` pour la mise en cache).
+
+Métriques exposées :
+- singleflight_requests_total{prefix, role} : appels par préfixe de clé, en tant que
+  meneur ("leader") ou en attente d'un meneur ("follower"). Le taux de regroupement est
+  follower / (leader + follower).
+"""
+
+import threading
+
+from common.metrics import Counter
+
+
+SINGLEFLIGHT_REQUESTS = Counter(
+    "singleflight_requests_total", "Lectures regroupées, par préfixe de clé et par rôle (leader / follower).",
+    ("prefix", "role"))
+
+
+class _Call:
+    """Lecture en cours pour une clé."""
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Groupe de lectures regroupées par clé."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """Exécute `func`, ou attend l'exécution déjà en cours pour la même clé.
+
+        Paramètres:
+            - key (str): Clé de la lecture, préfixée par son usage (ex. "property:42").
+            - func (callable): Fonction sans argument effectuant la lecture.
+
+        Retourne:
+            - Le résultat de `func` (partagé par tous les appels regroupés : il ne doit pas
+              être modifié).
+
+        Lève:
+            - L'exception levée par `func`, pour le meneur comme pour les appels en attente.
+        """
+        prefix = key.partition(":")[0]
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            SINGLEFLIGHT_REQUESTS.inc(prefix, "follower")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        SINGLEFLIGHT_REQUESTS.inc(prefix, "leader")
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
@@ -1,47 +1,271 @@
 """
 Fichier principal de l'application pour le service de gestion des propriétés.
 
-Ce fichier configure et initialise l'application Flask, les extensions nécessaires et enregistre les routes pour les propriétés.
+Ce fichier fournit la fabrique `create_app()` qui configure et initialise l'application Flask,
+les extensions nécessaires et enregistre les routes pour les propriétés.
 
 Points principaux :
 - Chargement des variables d'environnement.
-- Configuration de Google Datastore pour stocker les propriétés.
-- Initialisation de Flask-JWT-Extended pour la gestion des JWT.
-- Route de santé pour vérifier le bon fonctionnement de l'application.
+- Configuration de Google Datastore pour stocker les propriétés (client créé au premier
+  usage dans chaque processus, donc après le fork des workers).
+- Sérialisation JSON rapide et compression des réponses.
+- Exposition des métriques Prometheus sur `/metrics`.
+- Rejeu des créations relancées avec le même en-tête `Idempotency-Key`.
+- Cache partagé par les workers de l'hôte (validations de jetons, propriétés par identifiant).
+- Contrôle d'admission : limites de concurrence par classe de priorité et délestage (503).
+- Profilage à la demande et journal des requêtes lentes.
+- Commande `flask cascade-worker` supprimant les propriétés des utilisateurs supprimés.
+- Commande `flask prune-changes` purgeant le journal des modifications.
+- Commande `flask backfill-index-policy` réécrivant les propriétés selon la politique d'indexation.
+- Commande `flask reconcile-stats` corrigeant les compteurs par ville et type de bien.
+- Commande `flask export-properties` exportant toutes les propriétés en Parquet.
+- Ingestion différée (write-behind) des créations de propriétés, si `WRITE_BEHIND` est activé.
+- Commande `flask replay-spill` rejouant les fichiers de débordement de l'écriture différée.
+- Flux en mémoire des dernières propriétés publiées par ville.
+- Préchauffage des caches de chaque worker (villes et propriétés les plus consultées).
+- Route de santé pour vérifier le bon fonctionnement de l'application (503 pendant le préchauffage).
 """
 
 
+import datetime
+
+import click
 from flask import Flask
-from google.cloud import datastore
 from dotenv import load_dotenv
 from property_service.routes import property_blueprint
+from property_service.cascade import run_worker
+from property_service.changes import prune_changes
+from property_service.stats import reconcile_stats
+from property_service.export import ExportBusy, export_properties
+from property_service.ingestion import replay_spill
+from property_service.latest import LatestFeed
+from property_service.warmup import AccessStats, is_warming
+from property_service.models import get_client, backfill_index_policy
+from common.json_provider import init_json
+from common.profiling import init_profiling
+from common.compression import init_compression
+from common.metrics import init_metrics
+from common.idempotency import init_idempotency
+from common.admission import init_admission
+from common.cache import init_cache, MemoryCache, NullCache
 import os
 
 load_dotenv()
 
-# Initialisation de l'application Flask
-app = Flask(__name__)
 
-# Charger le chemin des informations d'identification pour Google Datastore
-credentials_path =os.getenv("DATASTORE_CREDENTIALS")
-# URL du service utilisateur
-app.config['USER_SERVICE_URL'] = os.getenv("USER_SERVICE_URL")
-app.config['PORT'] = os.getenv("PORT",5001)
+def create_app(config=None):
+    """Crée et configure une instance de l'application.
+
+    Aucune connexion à Datastore n'est ouverte ici : le client est créé au premier usage
+    par `property_service.models.get_client()`.
+
+    Paramètres:
+        - config (dict): Valeurs de configuration supplémentaires (ex: `DATASTORE_CLIENT`
+          pour injecter un client déjà construit).
+
+    Retourne:
+        - Flask: L'application configurée.
+    """
+
+    # Initialisation de l'application Flask
+    app = Flask(__name__)
+
+    # Charger le chemin des informations d'identification pour Google Datastore
+    app.config['DATASTORE_CREDENTIALS'] = os.getenv("DATASTORE_CREDENTIALS")
+    app.config['DATASTORE_EMULATOR_HOST'] = os.getenv("DATASTORE_EMULATOR_HOST")
+    app.config['DATASTORE_PROJECT_ID'] = os.getenv("DATASTORE_PROJECT_ID", "local")
+    # URL du service utilisateur
+    app.config['USER_SERVICE_URL'] = os.getenv("USER_SERVICE_URL")
+    app.config['PORT'] = os.getenv("PORT",5001)
+
+    # Consommation de la file d'événements du user_service (voir property_service/cascade.py)
+    app.config['SERVICE_TOKEN'] = os.getenv("SERVICE_TOKEN")
+    app.config['CASCADE_WORKER'] = os.getenv("CASCADE_WORKER", "false").lower() == "true"
+    app.config['CASCADE_BATCH_SIZE'] = int(os.getenv("CASCADE_BATCH_SIZE", "250"))
+    app.config['CASCADE_POLL_INTERVAL'] = float(os.getenv("CASCADE_POLL_INTERVAL", "5"))
+
+    # Journal des modifications (voir property_service/changes.py)
+    app.config['CHANGE_FEED_LAG'] = float(os.getenv("CHANGE_FEED_LAG", "1"))
+    app.config['CHANGE_FEED_READBACK'] = float(os.getenv("CHANGE_FEED_READBACK", "30"))
+    app.config['CHANGE_FEED_MAX_WAIT'] = float(os.getenv("CHANGE_FEED_MAX_WAIT", "25"))
+
+    # Ingestion différée des créations (voir property_service/ingestion.py)
+    app.config['WRITE_BEHIND'] = os.getenv("WRITE_BEHIND", "false").lower() == "true"
+    app.config['WRITE_BEHIND_MAX_SIZE'] = int(os.getenv("WRITE_BEHIND_MAX_SIZE", "10000"))
+    app.config['WRITE_BEHIND_FLUSH_SIZE'] = int(os.getenv("WRITE_BEHIND_FLUSH_SIZE", "250"))
+    app.config['WRITE_BEHIND_FLUSH_INTERVAL'] = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "1"))
+    app.config['WRITE_BEHIND_ENQUEUE_TIMEOUT'] = float(os.getenv("WRITE_BEHIND_ENQUEUE_TIMEOUT", "0.5"))
+    app.config['WRITE_BEHIND_SPILL_DIR'] = os.getenv("WRITE_BEHIND_SPILL_DIR", "spill")
+
+    # Dernières propriétés par ville, servies depuis la mémoire (voir property_service/latest.py)
+    app.config['LATEST_FEED_SIZE'] = int(os.getenv("LATEST_FEED_SIZE", "50"))
+    app.config['LATEST_FEED_MAX_CITIES'] = int(os.getenv("LATEST_FEED_MAX_CITIES", "1000"))
+    app.config['LATEST_SYNC_INTERVAL'] = float(os.getenv("LATEST_SYNC_INTERVAL", "1"))
+
+    # Recherches sur plusieurs villes / types de bien (voir property_service/fanout.py)
+    app.config['SEARCH_MAX_STREAMS'] = int(os.getenv("SEARCH_MAX_STREAMS", "20"))
+    app.config['SEARCH_WORKERS'] = int(os.getenv("SEARCH_WORKERS", "8"))
+
+    # Export Parquet des propriétés (voir property_service/export.py)
+    app.config['EXPORT_DIR'] = os.getenv("EXPORT_DIR", "exports")
+    app.config['EXPORT_PARTITION_SIZE'] = int(os.getenv("EXPORT_PARTITION_SIZE", "50000"))
+    app.config['EXPORT_PAGE_SIZE'] = int(os.getenv("EXPORT_PAGE_SIZE", "500"))
+    app.config['EXPORT_WORKERS'] = int(os.getenv("EXPORT_WORKERS", "4"))
+
+    # Rayon maximal d'une recherche géographique (voir property_service/geo.py)
+    app.config['GEO_MAX_RADIUS_M'] = float(os.getenv("GEO_MAX_RADIUS_M", "50000"))
+    app.config['GEO_MAX_RESULTS'] = int(os.getenv("GEO_MAX_RESULTS", "200"))
+    app.config['GEO_MAX_SCANNED'] = int(os.getenv("GEO_MAX_SCANNED", "5000"))
+
+    # Réponses conservées pour les clés d'idempotence (voir common/idempotency.py)
+    app.config['IDEMPOTENCY_MAX_ENTRIES'] = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+    app.config['IDEMPOTENCY_TTL'] = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+    app.config['IDEMPOTENCY_PENDING_TTL'] = float(os.getenv("IDEMPOTENCY_PENDING_TTL", "60"))
+
+    # Cache partagé par les workers de l'hôte (voir common/cache.py et common/shm_cache.py)
+    app.config['CACHE_BACKEND'] = os.getenv("CACHE_BACKEND", "shared")
+    app.config['CACHE_MAX_ENTRIES'] = int(os.getenv("CACHE_MAX_ENTRIES", "4096"))
+    app.config['CACHE_ENTRY_SIZE'] = int(os.getenv("CACHE_ENTRY_SIZE", "2048"))
+    app.config['CACHE_LARGE_MAX_ENTRIES'] = int(os.getenv("CACHE_LARGE_MAX_ENTRIES", "1024"))
+    app.config['CACHE_LARGE_ENTRY_SIZE'] = int(os.getenv("CACHE_LARGE_ENTRY_SIZE", "16384"))
+    app.config['CACHE_SHM_PATH'] = os.getenv("CACHE_SHM_PATH")
+    app.config['CACHE_TTL'] = float(os.getenv("CACHE_TTL", "60"))
+    app.config['VALIDATION_CACHE_TTL'] = float(os.getenv("VALIDATION_CACHE_TTL", "30"))
+    app.config['PROPERTY_CACHE_TTL'] = float(os.getenv("PROPERTY_CACHE_TTL", "10"))
+    app.config['STATS_CACHE_TTL'] = float(os.getenv("STATS_CACHE_TTL", "5"))
+    # Listes par ville, trop volumineuses pour le cache partagé : cache propre au worker
+    app.config['CITY_CACHE_TTL'] = float(os.getenv("CITY_CACHE_TTL", "10"))
+    app.config['CITY_CACHE_MAX_ENTRIES'] = int(os.getenv("CITY_CACHE_MAX_ENTRIES", "256"))
+
+    # Préchauffage des caches et statistiques d'accès (voir property_service/warmup.py)
+    app.config['WARMUP_ENABLED'] = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+    app.config['WARMUP_CITIES'] = os.getenv("WARMUP_CITIES", "")
+    app.config['WARMUP_TOP_CITIES'] = int(os.getenv("WARMUP_TOP_CITIES", "20"))
+    app.config['WARMUP_TOP_PROPERTIES'] = int(os.getenv("WARMUP_TOP_PROPERTIES", "500"))
+    app.config['WARMUP_CONCURRENCY'] = int(os.getenv("WARMUP_CONCURRENCY", "4"))
+    app.config['WARMUP_TIMEOUT'] = float(os.getenv("WARMUP_TIMEOUT", "30"))
+    app.config['WARMUP_CACHE_TTL'] = float(os.getenv("WARMUP_CACHE_TTL", "120"))
+    app.config['ACCESS_STATS_FLUSH_INTERVAL'] = float(os.getenv("ACCESS_STATS_FLUSH_INTERVAL", "60"))
+    app.config['ACCESS_STATS_HALF_LIFE'] = float(os.getenv("ACCESS_STATS_HALF_LIFE", "86400"))
+
+    # Limites de concurrence et délestage (voir common/admission.py)
+    app.config['ADMISSION_ENABLED'] = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+    app.config['ADMISSION_MAX_CONCURRENCY'] = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "0"))
+    app.config['ADMISSION_CLASS_LIMITS'] = os.getenv("ADMISSION_CLASS_LIMITS", "")
+    app.config['ADMISSION_ROUTE_LIMITS'] = os.getenv("ADMISSION_ROUTE_LIMITS", "")
+    app.config['ADMISSION_QUEUE_SIZE'] = int(os.getenv("ADMISSION_QUEUE_SIZE", "8"))
+    app.config['ADMISSION_QUEUE_SIZES'] = os.getenv("ADMISSION_QUEUE_SIZES", "")
+    app.config['ADMISSION_QUEUE_TIMEOUT'] = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2"))
+    app.config['ADMISSION_RETRY_AFTER'] = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+
+    # Agrégation des métriques des workers (voir common/metrics.py)
+    app.config['METRICS_MULTIPROC_DIR'] = os.getenv("METRICS_MULTIPROC_DIR")
+    app.config['METRICS_FLUSH_INTERVAL'] = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+    # Profilage à la demande et journal des requêtes lentes (voir common/profiling.py)
+    app.config['PROFILE_TOKEN'] = os.getenv("PROFILE_TOKEN")
+    app.config['PROFILE_SAMPLE_RATE'] = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+    app.config['PROFILE_DIR'] = os.getenv("PROFILE_DIR", "profiles")
+    app.config['PROFILE_MEMORY'] = os.getenv("PROFILE_MEMORY", "false").lower() == "true"
+    app.config['SLOW_REQUEST_THRESHOLD_MS'] = float(os.getenv("SLOW_REQUEST_THRESHOLD_MS", "1000"))
+
+    if config:
+        app.config.update(config)
+
+    # Vérifier si les informations d'identification pour Google Datastore sont correctement définies
+    if not (app.config.get('DATASTORE_CLIENT') or app.config['DATASTORE_EMULATOR_HOST'] or app.config['DATASTORE_CREDENTIALS']):
+        raise ValueError("DATASTORE_CREDENTIALS n'est pas défini dans le fichier .env.")
+
+    # Sérialisation JSON, profilage, compression et métriques des réponses
+    init_json(app)
+    init_profiling(app)
+    init_compression(app)
+    init_metrics(app)
+    init_admission(app)
+    init_cache(app)
+    init_idempotency(app)
+    if app.config['CACHE_BACKEND'] == "none":
+        app.extensions['listing_cache'] = NullCache()
+    else:
+        app.extensions['listing_cache'] = MemoryCache(max_entries=app.config['CITY_CACHE_MAX_ENTRIES'],
+                                                      ttl=app.config['CITY_CACHE_TTL'])
+    app.extensions['access_stats'] = AccessStats(half_life=app.config['ACCESS_STATS_HALF_LIFE'],
+                                                 flush_interval=app.config['ACCESS_STATS_FLUSH_INTERVAL'])
+
+    # Chaque worker tient ses propres listes (construites au premier accès, donc après le fork)
+    app.extensions['latest_feed'] = LatestFeed(
+        size=app.config['LATEST_FEED_SIZE'],
+        max_cities=app.config['LATEST_FEED_MAX_CITIES'],
+        sync_interval=app.config['LATEST_SYNC_INTERVAL'],
+        lag=app.config['CHANGE_FEED_LAG'],
+        readback=app.config['CHANGE_FEED_READBACK'],
+    )
+
+    # Enregistrement des routes pour les propriétés via un blueprint
+    app.register_blueprint(property_blueprint)
+
+    # Processus dédié à la suppression des propriétés des utilisateurs supprimés
+    @app.cli.command('cascade-worker')
+    def cascade_worker():
+        """Consomme la file d'événements du user_service."""
+        click.echo("Consommation des événements utilisateur...")
+        run_worker(app)
 
+    # Purge des entrées anciennes du journal des modifications
+    @app.cli.command('prune-changes')
+    @click.option('--days', default=30, show_default=True, help="Âge maximal des entrées conservées.")
+    def prune_changes_command(days):
+        """Supprime les entrées du journal des modifications plus anciennes que --days jours."""
+        older_than = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)
+        click.echo(f"Entrées supprimées : {prune_changes(get_client(app), older_than)}")
 
-# Vérifier si les informations d'identification pour Google Datastore sont correctement définies
-if not credentials_path:
-    raise ValueError("GOOGLE_APPLICATION_CREDENTIALS n'est pas défini dans le fichier .env.")
+    # Réécriture ponctuelle des propriétés existantes selon la politique d'indexation
+    @app.cli.command('backfill-index-policy')
+    def backfill_index_policy_command():
+        """Exclut des index les champs non interrogés de toutes les propriétés existantes."""
+        click.echo(f"Propriétés réécrites : {backfill_index_policy(get_client(app))}")
 
-# Initialisation du client Google Datastore avec le fichier d'identification JSON
-app.config['DATASTORE_CLIENT'] = datastore.Client.from_service_account_json(credentials_path)
+    # Correction des compteurs par ville et type de bien
+    @app.cli.command('reconcile-stats')
+    def reconcile_stats_command():
+        """Recalcule les compteurs de propriétés et corrige les écarts."""
+        corrections = reconcile_stats(get_client(app))
+        for (ville, type_de_bien), delta in sorted(corrections.items()):
+            click.echo(f"{ville} / {type_de_bien} : {delta:+d}")
+        click.echo(f"Compteurs corrigés : {len(corrections)}")
 
-# Enregistrement des routes pour les propriétés via un blueprint
-app.register_blueprint(property_blueprint)
+    # Rejeu des créations différées qui n'ont pas pu être écrites avant un arrêt
+    @app.cli.command('replay-spill')
+    def replay_spill_command():
+        """Écrit dans Datastore les propriétés des fichiers de débordement."""
+        click.echo(f"Propriétés rejouées : {replay_spill(app)}")
 
+    # Export Parquet de toutes les propriétés, repris s'il a été interrompu
+    @app.cli.command('export-properties')
+    @click.argument('name', default=lambda: datetime.date.today().isoformat())
+    @click.option('--workers', type=int, default=None, help="Partitions exportées simultanément (EXPORT_WORKERS).")
+    def export_properties_command(name, workers):
+        """Exporte les propriétés dans EXPORT_DIR/NAME (date du jour par défaut)."""
+        output_dir = os.path.join(app.config['EXPORT_DIR'], name)
+        try:
+            manifest = export_properties(get_client(app), output_dir,
+                                         partition_size=app.config['EXPORT_PARTITION_SIZE'],
+                                         page_size=app.config['EXPORT_PAGE_SIZE'],
+                                         max_workers=workers or app.config['EXPORT_WORKERS'])
+        except ExportBusy:
+            raise click.ClickException(f"Export déjà en cours dans {output_dir}.")
+        except RuntimeError as error:
+            raise click.ClickException(str(error))
+        partitions = manifest['partitions']
+        click.echo(f"Export terminé dans {output_dir} : {len(partitions)} partitions, "
+                   f"{sum(p['proprietes'] for p in partitions)} propriétés, {sum(p['pieces'] for p in partitions)} pièces")
 
-# Route pour vérifier si l'application fonctionne correctement
-@app.route('/',methods=['GET'])
-def health_check():
-    return {"status":"healthy"},200
+    # Route pour vérifier si l'application fonctionne correctement
+    # (le répartiteur de charge attend la fin du préchauffage des caches)
+    @app.route('/',methods=['GET'])
+    def health_check():
+        if is_warming(app):
+            return {"status":"warming"},503
+        return {"status":"healthy"},200
 
+    return app
@@ -0,0 +1,237 @@
+"""
+Suppression en arrière-plan des propriétés des utilisateurs supprimés.
+
+Le user_service enregistre un événement `utilisateur_supprime` dans sa file d'événements
+(outbox) lors de la suppression d'un compte. Ce module consomme cette file et supprime
+les propriétés orphelines par lots, sans ralentir la requête DELETE de l'utilisateur.
+
+Contenu:
+- `delete_properties_of_owner` : requête de projection paginée sur `proprietaire` (clé,
+  ville et type de bien, pour décrémenter les compteurs de `stats.py`) et suppressions par
+  lots, validées avec leurs entrées « delete » du journal des modifications, avec reprise
+  sur erreur transitoire et suivi de la progression dans l'entité `NettoyageProprietaire`.
+- `process_pending_events` : lit, traite puis acquitte un lot d'événements ; les validations
+  de jetons en cache de l'utilisateur supprimé sont invalidées avant ses propriétés.
+- `run_worker` / `start_cascade_worker` : boucle de consommation (processus dédié ou thread).
+
+Configuration (via `app.config`) :
+- SERVICE_TOKEN (str): Jeton partagé avec le user_service pour lire la file d'événements.
+- CASCADE_BATCH_SIZE (int): Taille des lots de suppression (250 au plus). Défaut : 250.
+- CASCADE_POLL_INTERVAL (float): Intervalle d'interrogation de la file, en secondes. Défaut : 5.
+- CASCADE_MAX_RETRIES (int): Nombre de tentatives par lot. Défaut : 5.
+"""
+
+import datetime
+import logging
+import threading
+import time
+
+import requests
+from google.api_core import exceptions as api_exceptions
+from google.cloud import datastore
+
+from common.cache import get_cache
+from common.metrics import track
+from property_service.changes import build_change, notify_changes
+from property_service.models import get_client
+from property_service.stats import facet_of, increment_facets
+
+
+logger = logging.getLogger(__name__)
+
+# Limite Datastore de 500 mutations par appel : chaque suppression s'accompagne de son
+# entrée dans le journal des modifications
+MAX_BATCH_SIZE = 250
+
+TRANSIENT_ERRORS = (
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.InternalServerError,
+    api_exceptions.Aborted,
+    api_exceptions.TooManyRequests,
+)
+
+
+def _with_retry(func, *args, max_retries=5, backoff=0.5):
+    for attempt in range(max_retries):
+        try:
+            return func(*args)
+        except TRANSIENT_ERRORS:
+            if attempt == max_retries - 1:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+def _delete_batch(client, keys):
+    # Suppressions et entrées du journal validées en un seul appel, comme `delete_property`
+    with client.batch() as batch:
+        for key in keys:
+            batch.delete(key)
+            batch.put(build_change(client, key.id, "delete", []))
+
+
+def revoked_key(user_id):
+    """Clé du marqueur de révocation des jetons d'un utilisateur dans le cache."""
+    return f"token-revoked:{user_id}"
+
+
+def revoke_user_validations(app, user_id):
+    """Invalide les validations de jetons en cache d'un utilisateur supprimé.
+
+    Un marqueur est conservé `VALIDATION_CACHE_TTL` secondes (durée maximale d'une validation
+    en cache) : tant qu'il existe, les jetons de l'utilisateur sont revalidés auprès du
+    user_service. Appelé par le nettoyage en cascade avant de supprimer les propriétés.
+
+    Paramètres:
+        - app (Flask): Application Flask.
+        - user_id (int): Identifiant de l'utilisateur supprimé.
+    """
+    get_cache(app).set(revoked_key(user_id), True, ttl=app.config['VALIDATION_CACHE_TTL'])
+
+
+def delete_properties_of_owner(client, proprietaire, batch_size=MAX_BATCH_SIZE, max_retries=5,
+                               cache=None, listing_cache=None):
+    """Supprime toutes les propriétés d'un propriétaire par lots.
+
+    L'opération est idempotente : elle peut être relancée après une interruption.
+    Les propriétés supprimées sont retirées des caches fournis : le cache partagé par les
+    workers de l'hôte, et les listes par ville lorsque la consommation tourne dans un worker
+    (les listes des autres workers expirent après `CITY_CACHE_TTL`).
+
+    Paramètres:
+        - client (datastore.Client): Client Google Datastore.
+        - proprietaire (int): Identifiant du propriétaire.
+        - batch_size (int): Nombre de propriétés supprimées par lot (250 au plus).
+        - max_retries (int): Nombre de tentatives par lot en cas d'erreur transitoire.
+        - cache: Cache des propriétés par identifiant (facultatif, voir `common/cache.py`).
+        - listing_cache: Cache des listes par ville (facultatif).
+
+    Retourne:
+        - int: Nombre de propriétés supprimées lors de cet appel.
+    """
+    batch_size = min(batch_size, MAX_BATCH_SIZE)
+    progress_key = client.key('NettoyageProprietaire', proprietaire)
+    progress = datastore.Entity(key=progress_key)
+    progress.update({"proprietaire": proprietaire, "supprimees": 0, "termine": False})
+    deleted = 0
+
+    while True:
+        # Projection sur les champs des compteurs : les entités complètes ne sont pas lues
+        query = client.query(kind='Property', projection=['ville', 'type_de_bien'])
+        query.add_filter('proprietaire', '=', proprietaire)
+
+        with track("datastore", "query"):
+            entities = _with_retry(lambda: list(query.fetch(limit=batch_size)), max_retries=max_retries)
+        keys = [entity.key for entity in entities]
+        if not keys:
+            break
+
+        with track("datastore", "delete_multi"):
+            _with_retry(_delete_batch, client, keys, max_retries=max_retries)
+        notify_changes()
+        deleted += len(keys)
+
+        deltas = {}
+        for entity in entities:
+            pair = facet_of(entity)
+            deltas[pair] = deltas.get(pair, 0) - 1
+            if cache is not None:
+                cache.delete(f"property:{entity.key.id}")
+        increment_facets(client, deltas)
+        if listing_cache is not None:
+            for ville, _ in deltas:
+                listing_cache.delete(f"city:{ville}")
+
+        # Suivi de la progression (consultable pendant le nettoyage)
+        progress.update({"supprimees": deleted, "mis_a_jour_le": datetime.datetime.now(datetime.timezone.utc)})
+        with track("datastore", "put"):
+            client.put(progress)
+
+        if len(keys) < batch_size:
+            break
+
+    progress.update({"supprimees": deleted, "termine": True,
+                     "mis_a_jour_le": datetime.datetime.now(datetime.timezone.utc)})
+    with track("datastore", "put"):
+        client.put(progress)
+
+    return deleted
+
+
+def process_pending_events(app, limit=100):
+    """Traite un lot d'événements en attente dans la file du user_service.
+
+    Les événements ne sont acquittés qu'après leur traitement complet (livraison au
+    moins une fois : un événement peut être rejoué après une panne).
+
+    Paramètres:
+        - app (Flask): Application (configuration et client Datastore).
+        - limit (int): Nombre maximal d'événements à traiter.
+
+    Retourne:
+        - int: Nombre d'événements traités.
+    """
+    base_url = app.config['USER_SERVICE_URL']
+    headers = {"X-Service-Token": app.config.get('SERVICE_TOKEN') or ""}
+
+    with track("user_service", "events"):
+        response = requests.get(f"{base_url}/events", params={"limit": limit}, headers=headers, timeout=10)
+    response.raise_for_status()
+    events = response.json()["events"]
+    if not events:
+        return 0
+
+    client = get_client(app)
+    for event in events:
+        if event["type"] == "utilisateur_supprime":
+            proprietaire = event["payload"]["utilisateur_id"]
+            # Avant la suppression : aucun jeton en cache ne doit pouvoir recréer de propriété
+            revoke_user_validations(app, proprietaire)
+            deleted = delete_properties_of_owner(
+                client, proprietaire,
+                batch_size=app.config.get('CASCADE_BATCH_SIZE', MAX_BATCH_SIZE),
+                max_retries=app.config.get('CASCADE_MAX_RETRIES', 5),
+                cache=get_cache(app),
+                listing_cache=app.extensions.get('listing_cache'),
+            )
+            logger.info("Propriétés de l'utilisateur %s supprimées : %d", proprietaire, deleted)
+
+    with track("user_service", "events_ack"):
+        requests.post(f"{base_url}/events/ack", json={"jusqu_a": events[-1]["id"]}, headers=headers, timeout=10).raise_for_status()
+
+    return len(events)
+
+
+def run_worker(app, stop_event=None):
+    """Consomme la file d'événements jusqu'à ce que `stop_event` soit levé.
+
+    Paramètres:
+        - app (Flask): Application Flask.
+        - stop_event (threading.Event): Signal d'arrêt (facultatif).
+    """
+    stop_event = stop_event or threading.Event()
+    interval = app.config.get('CASCADE_POLL_INTERVAL', 5)
+
+    while not stop_event.is_set():
+        try:
+            processed = process_pending_events(app)
+        except Exception:
+            logger.exception("Échec du traitement des événements utilisateur.")
+            processed = 0
+        # On enchaîne directement tant que la file n'est pas vide
+        if not processed:
+            stop_event.wait(interval)
+
+
+def start_cascade_worker(app):
+    """Démarre la consommation de la file d'événements dans un thread du processus courant.
+
+    Paramètres:
+        - app (Flask): Application Flask.
+
+    Retourne:
+        - threading.Event: Signal permettant d'arrêter le thread.
+    """
+    stop_event = threading.Event()
+    threading.Thread(target=run_worker, args=(app, stop_event), name="cascade-worker", daemon=True).start()
+    return stop_event
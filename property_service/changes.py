@@ -0,0 +1,227 @@
+"""
+Journal des modifications des propriétés (change feed).
+
+Chaque création, mise à jour ou suppression de propriété ajoute un enregistrement
+`PropertyChange` (identifiant de l'entité, opération, champs modifiés, horodatage).
+Les consommateurs (index de recherche, analytique, caches distants...) lisent ce journal
+de manière incrémentale grâce à un curseur opaque, au lieu de parcourir tout Datastore.
+
+Contenu:
+- `build_change` : construit l'enregistrement d'une modification.
+- `notify_changes` : réveille les lecteurs en attente dans le processus courant.
+- `fetch_changes` : lit les modifications postérieures à un curseur.
+- `wait_for_changes` : lecture en long-poll.
+- `prune_changes` : purge des enregistrements anciens.
+
+Ordre et curseur :
+Les enregistrements sont ordonnés par horodatage. L'horodatage est pris par le worker avant
+l'écriture : une modification peut donc être validée après d'autres, plus récentes, déjà
+servies. Le curseur retient une date `mark`, avant laquelle tout a été servi, et les
+identifiants des modifications servies depuis ; chaque lecture relit à partir de `mark` et
+ignore ces identifiants. `mark` ne suit la date courante qu'avec `readback` secondes de
+retard : une modification validée moins de `readback` secondes après son horodatage n'est
+jamais perdue. Le curseur retient au plus `MAX_CURSOR_IDS` identifiants ; au-delà (plus de
+modifications que cela dans la fenêtre), `mark` avance jusqu'au plus ancien conservé.
+Seules les modifications plus anciennes que `lag` secondes sont servies, ce qui limite les
+relectures.
+"""
+
+import datetime
+import threading
+
+from google.cloud import datastore
+
+from common.metrics import track
+
+
+KIND = 'PropertyChange'
+
+# Identifiants de modifications déjà servies retenus par un curseur
+MAX_CURSOR_IDS = 1000
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+# Réveille les requêtes en long-poll lorsqu'une modification est écrite par ce processus
+_changes_available = threading.Condition()
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def build_change(client, entity_id, op, champs):
+    """Construit l'enregistrement d'une modification (non encore écrit).
+
+    Paramètres:
+        - client (datastore.Client): Client Google Datastore.
+        - entity_id (int): Identifiant de la propriété modifiée.
+        - op (str): Opération ("create", "update" ou "delete").
+        - champs (list): Noms des champs modifiés.
+
+    Retourne:
+        - datastore.Entity: Enregistrement à écrire dans Datastore.
+    """
+    change = datastore.Entity(key=client.key(KIND), exclude_from_indexes=('champs',))
+    change.update({"entity_id": entity_id, "op": op, "champs": sorted(champs), "horodatage": _now()})
+    return change
+
+
+def notify_changes():
+    """Signale aux lecteurs en attente qu'une modification vient d'être écrite."""
+    with _changes_available:
+        _changes_available.notify_all()
+
+
+def _micros(horodatage):
+    return (horodatage - _EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def _position(text):
+    micros, _, change_id = text.partition("-")
+    return _EPOCH + datetime.timedelta(microseconds=int(micros)), int(change_id)
+
+
+def encode_cursor(horodatage, change_id):
+    """Encode la position (horodatage, identifiant) d'une modification : la lecture reprend
+    à cet horodatage, en ignorant cette modification."""
+    return f"{_micros(horodatage)}-{change_id}"
+
+
+def _encode_state(mark, seen):
+    return ".".join([str(_micros(mark))] + [f"{_micros(horodatage)}-{change_id}" for horodatage, change_id in sorted(seen)])
+
+
+def decode_cursor(cursor):
+    """Décode un curseur produit par `encode_cursor` ou par `fetch_changes`.
+
+    Retourne:
+        - tuple(datetime, set): Date `mark` et modifications déjà servies depuis, en couples
+          (horodatage, identifiant).
+
+    Lève:
+        - ValueError: Si le curseur est invalide.
+    """
+    head, *seen = cursor.split(".")
+    if "-" in head:
+        horodatage, change_id = _position(head)
+        return horodatage, {(horodatage, change_id)}
+    return _EPOCH + datetime.timedelta(microseconds=int(head)), {_position(item) for item in seen}
+
+
+def _to_dict(change):
+    return {
+        "cursor": encode_cursor(change["horodatage"], change.key.id),
+        "entity_id": change["entity_id"],
+        "op": change["op"],
+        "champs": change.get("champs") or [],
+        "horodatage": change["horodatage"],
+    }
+
+
+def fetch_changes(client, since=None, limit=100, lag=1.0, readback=30.0):
+    """Lit les modifications non encore servies au curseur.
+
+    Paramètres:
+        - client (datastore.Client): Client Google Datastore.
+        - since (str): Curseur de départ (None pour lire depuis le début).
+        - limit (int): Nombre maximal de modifications retournées.
+        - lag (float): Âge minimal (en secondes) des modifications servies.
+        - readback (float): Retard maximal (en secondes) entre l'horodatage d'une
+          modification et sa validation pour qu'elle soit servie.
+
+    Retourne:
+        - tuple(list, str): Les modifications et le curseur à utiliser pour la suite.
+
+    Lève:
+        - ValueError: Si le curseur est invalide.
+    """
+    horizon = _now() - datetime.timedelta(seconds=lag)
+    mark, seen = decode_cursor(since) if since else (None, set())
+    seen_ids = {change_id for _, change_id in seen}
+
+    query = client.query(kind=KIND)
+    query.add_filter('horodatage', '<=', horizon)
+    if mark is not None:
+        query.add_filter('horodatage', '>=', mark)
+    query.order = ['horodatage']
+
+    # Les modifications déjà servies sont relues puis ignorées : on en lit d'autant plus
+    fetch_limit = limit + len(seen_ids)
+    with track("datastore", "query"):
+        entities = list(query.fetch(limit=fetch_limit))
+
+    served = []
+    for entity in entities:
+        if entity.key.id in seen_ids:
+            continue
+        if len(served) == limit:
+            break
+        served.append(entity)
+
+    # `mark` avance jusqu'à la fenêtre de relecture, sans dépasser une modification non lue
+    new_mark = horizon - datetime.timedelta(seconds=readback)
+    if len(entities) == fetch_limit and served:
+        new_mark = min(new_mark, served[-1]["horodatage"])
+    if mark is not None:
+        new_mark = max(new_mark, mark)
+    positions = sorted(position for position in seen | {(entity["horodatage"], entity.key.id) for entity in served}
+                       if position[0] >= new_mark)
+    if len(positions) > MAX_CURSOR_IDS:
+        positions = positions[-MAX_CURSOR_IDS:]
+        new_mark = positions[0][0]
+
+    return [_to_dict(entity) for entity in served], _encode_state(new_mark, positions)
+
+
+def wait_for_changes(client, since=None, limit=100, timeout=0, lag=1.0, poll_interval=1.0, readback=30.0):
+    """Lit les modifications postérieures à un curseur, en attendant au plus `timeout` secondes.
+
+    L'attente est interrompue dès qu'une modification écrite par ce processus est signalée,
+    et Datastore est réinterrogé toutes les `poll_interval` secondes pour les écritures des
+    autres workers.
+
+    Paramètres:
+        - client (datastore.Client): Client Google Datastore.
+        - since (str): Curseur de départ.
+        - limit (int): Nombre maximal de modifications retournées.
+        - timeout (float): Durée maximale d'attente, en secondes.
+        - lag (float): Âge minimal (en secondes) des modifications servies.
+        - poll_interval (float): Intervalle de réinterrogation, en secondes.
+        - readback (float): Fenêtre de relecture (voir `fetch_changes`).
+
+    Retourne:
+        - tuple(list, str): Les modifications et le curseur à utiliser pour la suite.
+    """
+    deadline = _now() + datetime.timedelta(seconds=timeout)
+    while True:
+        changes, cursor = fetch_changes(client, since, limit, lag, readback)
+        remaining = (deadline - _now()).total_seconds()
+        if changes or remaining <= 0:
+            return changes, cursor
+        with _changes_available:
+            _changes_available.wait(min(remaining, poll_interval))
+
+
+def prune_changes(client, older_than, batch_size=500):
+    """Supprime les modifications plus anciennes qu'une date.
+
+    Paramètres:
+        - client (datastore.Client): Client Google Datastore.
+        - older_than (datetime): Date limite.
+        - batch_size (int): Nombre de clés supprimées par appel.
+
+    Retourne:
+        - int: Nombre d'enregistrements supprimés.
+    """
+    deleted = 0
+    while True:
+        query = client.query(kind=KIND)
+        query.add_filter('horodatage', '<', older_than)
+        query.keys_only()
+        with track("datastore", "query"):
+            keys = [entity.key for entity in query.fetch(limit=batch_size)]
+        if not keys:
+            return deleted
+        with track("datastore", "delete_multi"):
+            client.delete_multi(keys)
+        deleted += len(keys)
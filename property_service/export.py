@@ -0,0 +1,374 @@
+"""
+Export complet des propriétés dans des fichiers Parquet, pour l'équipe d'analyse.
+
+Le type `Property` est découpé en partitions d'intervalles de clés : un parcours « clés
+seulement » (lectures peu coûteuses, sans charger les entités) relève une clé toutes les
+`partition_size` propriétés. Les partitions sont ensuite exportées en parallèle, chacune par
+un thread qui lit ses entités page par page (`__key__ >= début`, `__key__ < fin`, tri sur
+la clé) et écrit chaque page comme un groupe de lignes Parquet : la mémoire reste bornée
+à quelques pages par thread, quelle que soit la taille de l'export.
+
+Chaque partition produit deux fichiers :
+- `proprietes/part-NNNNN.parquet` : une ligne par propriété (champs scalaires) ;
+- `pieces/part-NNNNN.parquet` : une ligne par pièce, rattachée par `property_id` et
+  `position` (les pièces imbriquées sont aplaties dans cette table fille).
+
+Le fichier `manifest.json` du répertoire décrit les partitions et celles qui sont terminées.
+Relancer un export interrompu dans le même répertoire ne refait que les partitions
+inachevées ; un fichier n'apparaît sous son nom définitif qu'une fois complet. Un verrou
+(`fcntl`) empêche deux exports simultanés dans le même répertoire.
+
+Les valeurs d'entités antérieures au schéma (pièces libres, nombres enregistrés en chaînes...)
+sont converties vers le type de leur colonne ; une valeur inconvertible est exportée comme
+nulle et une pièce qui n'est pas un objet est ignorée, avec un avertissement dans le journal.
+
+L'export n'est pas un instantané transactionnel : chaque partition reflète l'état de
+Datastore au moment de sa lecture.
+
+Nécessite le paquet facultatif `pyarrow`.
+"""
+
+import datetime
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from common.metrics import Counter, track
+from property_service.models import get_client
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - dépend de l'environnement
+    pa = pq = None
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - dépend de la plateforme
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+
+# Exports lancés en arrière-plan par ce processus, par répertoire
+_running = set()
+_running_lock = threading.Lock()
+
+EXPORT_ROWS = Counter("export_rows_total", "Lignes écrites par l'export Parquet, par table.", ("table",))
+
+
+class ExportBusy(Exception):
+    """Levée lorsqu'un export est déjà en cours dans le même répertoire."""
+
+
+def _schemas():
+    timestamp = pa.timestamp("us", tz="UTC")
+    properties = pa.schema([
+        ("id", pa.int64()),
+        ("nom", pa.string()),
+        ("description", pa.string()),
+        ("type_de_bien", pa.string()),
+        ("ville", pa.string()),
+        ("proprietaire", pa.int64()),
+        ("latitude", pa.float64()),
+        ("longitude", pa.float64()),
+        ("geohash", pa.string()),
+        ("cree_le", timestamp),
+        ("modifie_le", timestamp),
+    ])
+    pieces = pa.schema([
+        ("property_id", pa.int64()),
+        ("position", pa.int32()),
+        ("nom", pa.string()),
+        ("surface", pa.float64()),
+        ("etage", pa.string()),
+        ("caracteristiques", pa.list_(pa.string())),
+    ])
+    return properties, pieces
+
+
+def _to_str(value):
+    if type(value) is str:
+        return value
+    if type(value) in (int, float):
+        return str(value)
+    raise TypeError(type(value).__name__)
+
+
+def _to_int(value):
+    if type(value) is int:
+        return value
+    if type(value) is float and value.is_integer():
+        return int(value)
+    if type(value) is str:
+        return int(value)
+    raise TypeError(type(value).__name__)
+
+
+def _to_float(value):
+    if type(value) in (int, float):
+        return float(value)
+    if type(value) is str:
+        return float(value)
+    raise TypeError(type(value).__name__)
+
+
+def _to_timestamp(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    raise TypeError(type(value).__name__)
+
+
+def _to_str_list(value):
+    if type(value) is str:
+        return [value]
+    if type(value) is list:
+        return [_to_str(item) for item in value]
+    raise TypeError(type(value).__name__)
+
+
+# Conversion des valeurs vers le type de leur colonne. Les entités antérieures au schéma
+# (pièces libres, nombres en chaînes...) sont ramenées au type attendu quand c'est possible
+_PROPERTY_CONVERTERS = {
+    "nom": _to_str, "description": _to_str, "type_de_bien": _to_str, "ville": _to_str,
+    "proprietaire": _to_int, "latitude": _to_float, "longitude": _to_float, "geohash": _to_str,
+    "cree_le": _to_timestamp, "modifie_le": _to_timestamp,
+}
+_PIECE_CONVERTERS = {"nom": _to_str, "surface": _to_float, "etage": _to_str, "caracteristiques": _to_str_list}
+
+
+def _conform(values, converters, property_id, path):
+    # Valeurs converties ; une valeur inconvertible est exportée comme nulle et journalisée
+    row = {}
+    for name, convert in converters.items():
+        value = values.get(name)
+        if value is not None:
+            try:
+                value = convert(value)
+            except (TypeError, ValueError):
+                logger.warning("Propriété %s : valeur non conforme pour %s%s (%r), exportée comme nulle.",
+                               property_id, path, name, value)
+                value = None
+        row[name] = value
+    return row
+
+
+def _rows(entities):
+    properties, pieces = [], []
+    for entity in entities:
+        property_id = entity.key.id
+        row = _conform(entity, _PROPERTY_CONVERTERS, property_id, "")
+        row["id"] = property_id
+        properties.append(row)
+
+        entity_pieces = entity.get("pieces") or []
+        if not isinstance(entity_pieces, list):
+            logger.warning("Propriété %s : pièces non conformes (%r), ignorées.", property_id, entity_pieces)
+            continue
+        for position, piece in enumerate(entity_pieces):
+            if not hasattr(piece, "get"):
+                logger.warning("Propriété %s : pièce %d non conforme (%r), ignorée.", property_id, position, piece)
+                continue
+            piece_row = _conform(piece, _PIECE_CONVERTERS, property_id, f"pieces[{position}].")
+            piece_row.update(property_id=property_id, position=position)
+            pieces.append(piece_row)
+    return properties, pieces
+
+
+def plan_partitions(client, partition_size):
+    """Découpe le type `Property` en intervalles de clés d'environ `partition_size` propriétés.
+
+    Paramètres:
+        - client (datastore.Client): Client Google Datastore.
+        - partition_size (int): Nombre de propriétés par partition.
+
+    Retourne:
+        - list: Partitions `{"index", "debut", "fin", "terminee"}` ; `debut` (inclus) et
+          `fin` (exclue) sont des identifiants, None pour un intervalle ouvert.
+    """
+    query = client.query(kind='Property')
+    query.keys_only()
+    query.order = ['__key__']
+    bounds = [None]
+    with track("datastore", "query"):
+        # Seules les bornes sont conservées : les clés sont parcourues page par page
+        for position, entity in enumerate(query.fetch()):
+            if position and position % partition_size == 0:
+                bounds.append(entity.key.id)
+    bounds.append(None)
+    return [{"index": index, "debut": start, "fin": end, "terminee": False}
+            for index, (start, end) in enumerate(zip(bounds, bounds[1:]))]
+
+
+def _scan(client, partition, page_size):
+    # Pages successives de la partition, reprises après la dernière clé lue
+    after = None
+    while True:
+        query = client.query(kind='Property')
+        if after is not None:
+            query.add_filter('__key__', '>', client.key('Property', after))
+        elif partition["debut"] is not None:
+            query.add_filter('__key__', '>=', client.key('Property', partition["debut"]))
+        if partition["fin"] is not None:
+            query.add_filter('__key__', '<', client.key('Property', partition["fin"]))
+        query.order = ['__key__']
+        with track("datastore", "query"):
+            entities = list(query.fetch(limit=page_size))
+        if entities:
+            yield entities
+        if len(entities) < page_size:
+            return
+        after = entities[-1].key.id
+
+
+def export_partition(client, output_dir, partition, page_size=500):
+    """Exporte une partition dans ses deux fichiers Parquet.
+
+    Paramètres:
+        - client (datastore.Client): Client Google Datastore.
+        - output_dir (str): Répertoire de l'export.
+        - partition (dict): Partition produite par `plan_partitions`.
+        - page_size (int): Nombre d'entités lues (et de lignes écrites) à la fois.
+
+    Retourne:
+        - tuple: Nombre de propriétés et nombre de pièces exportées.
+    """
+    property_schema, piece_schema = _schemas()
+    name = f"part-{partition['index']:05d}.parquet"
+    paths = {table: os.path.join(output_dir, table, name) for table in ("proprietes", "pieces")}
+    counts = {"proprietes": 0, "pieces": 0}
+
+    with pq.ParquetWriter(paths["proprietes"] + ".tmp", property_schema) as property_writer, \
+         pq.ParquetWriter(paths["pieces"] + ".tmp", piece_schema) as piece_writer:
+        for entities in _scan(client, partition, page_size):
+            properties, pieces = _rows(entities)
+            property_writer.write_table(pa.Table.from_pylist(properties, schema=property_schema))
+            counts["proprietes"] += len(properties)
+            if pieces:
+                piece_writer.write_table(pa.Table.from_pylist(pieces, schema=piece_schema))
+                counts["pieces"] += len(pieces)
+
+    for table, path in paths.items():
+        os.replace(path + ".tmp", path)
+        EXPORT_ROWS.inc(table, amount=counts[table])
+    return counts["proprietes"], counts["pieces"]
+
+
+def _write_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST)
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def read_manifest(output_dir):
+    """Retourne le manifeste d'un export, ou None s'il n'a pas encore été planifié.
+
+    Paramètres:
+        - output_dir (str): Répertoire de l'export.
+    """
+    try:
+        with open(os.path.join(output_dir, MANIFEST), encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def export_properties(client, output_dir, partition_size=50000, page_size=500, max_workers=4):
+    """Exporte toutes les propriétés, ou reprend un export interrompu dans le même répertoire.
+
+    Paramètres:
+        - client (datastore.Client): Client Google Datastore.
+        - output_dir (str): Répertoire de l'export (créé au besoin).
+        - partition_size (int): Nombre de propriétés par partition (nouvel export seulement).
+        - page_size (int): Nombre d'entités lues à la fois (500 au plus).
+        - max_workers (int): Nombre de partitions exportées simultanément.
+
+    Retourne:
+        - dict: Manifeste de l'export terminé.
+
+    Lève:
+        - RuntimeError: Si `pyarrow` n'est pas installé.
+        - ExportBusy: Si un export est déjà en cours dans ce répertoire.
+    """
+    if pa is None:
+        raise RuntimeError("L'export Parquet nécessite le paquet pyarrow.")
+    for table in ("proprietes", "pieces"):
+        os.makedirs(os.path.join(output_dir, table), exist_ok=True)
+
+    with open(os.path.join(output_dir, ".verrou"), "w") as lock_file:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError as error:
+                raise ExportBusy(output_dir) from error
+
+        manifest = read_manifest(output_dir)
+        if manifest is None:
+            manifest = {
+                "debute_le": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "termine_le": None,
+                "partitions": plan_partitions(client, partition_size),
+            }
+            _write_manifest(output_dir, manifest)
+
+        lock = threading.Lock()
+
+        def run(partition):
+            properties, pieces = export_partition(client, output_dir, partition, min(page_size, 500))
+            with lock:
+                partition.update(terminee=True, proprietes=properties, pieces=pieces)
+                _write_manifest(output_dir, manifest)
+
+        pending = [partition for partition in manifest["partitions"] if not partition["terminee"]]
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="export") as executor:
+            # Une partition en échec reste à refaire ; les autres sont conservées
+            for future in [executor.submit(run, partition) for partition in pending]:
+                future.result()
+
+        manifest["termine_le"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        _write_manifest(output_dir, manifest)
+        return manifest
+
+
+def start_export(app, output_dir):
+    """Lance (ou reprend) un export dans un thread du processus courant.
+
+    Paramètres:
+        - app (Flask): Application Flask (configuration `EXPORT_*`).
+        - output_dir (str): Répertoire de l'export.
+
+    Retourne:
+        - bool: False si cet export est déjà en cours dans le processus.
+
+    Lève:
+        - RuntimeError: Si `pyarrow` n'est pas installé.
+    """
+    if pa is None:
+        raise RuntimeError("L'export Parquet nécessite le paquet pyarrow.")
+    with _running_lock:
+        if output_dir in _running:
+            return False
+        _running.add(output_dir)
+
+    def run():
+        try:
+            export_properties(get_client(app), output_dir,
+                              partition_size=app.config.get('EXPORT_PARTITION_SIZE', 50000),
+                              page_size=app.config.get('EXPORT_PAGE_SIZE', 500),
+                              max_workers=app.config.get('EXPORT_WORKERS', 4))
+            logger.info("Export terminé : %s", output_dir)
+        except ExportBusy:
+            logger.info("Export déjà en cours dans un autre processus : %s", output_dir)
+        except Exception:
+            logger.exception("Échec de l'export %s (relancer pour reprendre).", output_dir)
+        finally:
+            with _running_lock:
+                _running.discard(output_dir)
+
+    threading.Thread(target=run, name="export", daemon=True).start()
+    return True
@@ -0,0 +1,151 @@
+"""
+Recherche de propriétés sur plusieurs villes et plusieurs types de bien.
+
+Datastore ne sait pas combiner efficacement des filtres d'égalité sur plusieurs valeurs
+d'un même champ. Une recherche sur N villes et M types est donc découpée en une requête
+par couple (ville, type_de_bien), exécutées en parallèle sur un pool de threads borné,
+puis fusionnées (fusion k-voies, `heapq.merge`) dans l'ordre des clés.
+
+Chaque sous-requête combine des filtres d'égalité et un tri sur la clé, servis par les
+index intégrés de Datastore : aucun index composite n'est nécessaire et les propriétés
+antérieures à l'horodatage sont incluses.
+
+Pagination : le curseur composite contient la dernière clé renvoyée, les sous-requêtes
+épuisées et une empreinte des critères. La page suivante reprend chaque sous-requête
+après cette clé (`__key__ >`) et n'interroge plus celles qui sont épuisées ; le résultat
+reste stable même si des propriétés sont ajoutées entre deux pages.
+"""
+
+import base64
+import hashlib
+import heapq
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from common.metrics import track
+
+
+# Protège la création du pool entre threads d'un même processus
+_executor_lock = threading.Lock()
+_executor = None
+
+
+def _get_executor(max_workers):
+    # Pool propre au processus : ses threads ne survivent pas au fork des workers
+    global _executor
+    if _executor is None or _executor[0] != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor[0] != os.getpid():
+                _executor = (os.getpid(), ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fanout"))
+    return _executor[1]
+
+
+def _fingerprint(streams):
+    return hashlib.sha256(json.dumps(streams, ensure_ascii=False).encode()).hexdigest()[:16]
+
+
+def encode_search_cursor(streams, last_id, finished):
+    """Encode la position d'une recherche multi-valeurs.
+
+    Paramètres:
+        - streams (list): Couples (ville, type_de_bien) de la recherche.
+        - last_id (int): Identifiant de la dernière propriété renvoyée.
+        - finished (iterable): Indices des sous-requêtes épuisées.
+
+    Retourne:
+        - str: Curseur opaque.
+    """
+    state = {"apres": last_id, "finies": sorted(finished), "requete": _fingerprint(streams)}
+    return base64.urlsafe_b64encode(json.dumps(state).encode()).decode().rstrip("=")
+
+
+def decode_search_cursor(streams, cursor):
+    """Décode un curseur produit par `encode_search_cursor` pour la même recherche.
+
+    Retourne:
+        - tuple: Identifiant de la dernière propriété renvoyée et indices des sous-requêtes épuisées.
+
+    Lève:
+        - ValueError: Si le curseur est invalide ou provient d'une autre recherche.
+    """
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        last_id, finished = int(state["apres"]), set(state["finies"])
+    except (ValueError, TypeError, KeyError) as error:
+        raise ValueError("Curseur invalide.") from error
+    if state.get("requete") != _fingerprint(streams):
+        raise ValueError("Curseur d'une autre recherche.")
+    return last_id, finished
+
+
+def _query_stream(client, ville, type_de_bien, after_id, limit):
+    query = client.query(kind='Property')
+    query.add_filter('ville', '=', ville)
+    if type_de_bien is not None:
+        query.add_filter('type_de_bien', '=', type_de_bien)
+    if after_id is not None:
+        query.add_filter('__key__', '>', client.key('Property', after_id))
+    query.order = ['__key__']
+    with track("datastore", "query"):
+        return list(query.fetch(limit=limit))
+
+
+def search_properties(client, villes, types=(), limit=None, cursor=None, load_city=None, max_workers=8):
+    """Recherche les propriétés de plusieurs villes et types de bien.
+
+    Paramètres:
+        - client (datastore.Client): Client Google Datastore.
+        - villes (list): Villes recherchées.
+        - types (list): Types de bien recherchés (tous si vide).
+        - limit (int): Taille de page (None : tous les résultats, sans curseur).
+        - cursor (str): Curseur renvoyé par la page précédente.
+        - load_city (callable): Fonction `load_city(ville)` retournant toutes les propriétés
+          d'une ville (ex. depuis un cache), utilisée sans pagination
+          ni filtre de type.
+        - max_workers (int): Taille du pool de threads du processus.
+
+    Retourne:
+        - tuple: Propriétés dans l'ordre des clés et curseur de la page suivante (None s'il
+          n'y en a pas).
+
+    Lève:
+        - ValueError: Si le curseur est invalide.
+    """
+    villes = sorted(set(villes))
+    types = sorted(set(types))
+    streams = [[ville, type_de_bien] for ville in villes for type_de_bien in (types or [None])]
+    after_id, finished = decode_search_cursor(streams, cursor) if cursor else (None, set())
+
+    executor = _get_executor(max_workers)
+    if limit is None and not types and load_city is not None:
+        futures = {index: executor.submit(load_city, ville) for index, (ville, _) in enumerate(streams)}
+    else:
+        futures = {index: executor.submit(_query_stream, client, ville, type_de_bien, after_id, limit)
+                   for index, (ville, type_de_bien) in enumerate(streams) if index not in finished}
+    results = {index: future.result() for index, future in futures.items()}
+    if limit is None and not types and load_city is not None:
+        # L'ordre des listes chargées n'est pas garanti ; `sorted` préserve les listes partagées du cache
+        results = {index: sorted(entities, key=lambda entity: entity.key.id) for index, entities in results.items()}
+
+    # Fusion k-voies des sous-requêtes, chacune triée par clé
+    tagged = [[(entity.key.id, index, entity) for entity in entities] for index, entities in results.items()]
+    merged = heapq.merge(*tagged)
+    if limit is None:
+        return [entity for _, _, entity in merged], None
+
+    page = []
+    for item in merged:
+        if len(page) == limit:
+            break
+        page.append(item)
+    if not page:
+        return [], None
+
+    last_id = page[-1][0]
+    # Une sous-requête est épuisée si elle a renvoyé moins que `limit` propriétés, toutes servies
+    finished |= {index for index, entities in results.items()
+                 if len(entities) < limit and (not entities or entities[-1].key.id <= last_id)}
+    next_cursor = None if len(finished) == len(streams) else encode_search_cursor(streams, last_id, finished)
+    return [entity for _, _, entity in page], next_cursor
@@ -0,0 +1,259 @@
+"""
+Recherche géographique des propriétés par geohash.
+
+Un geohash découpe récursivement le globe en cellules ; deux points proches partagent
+en général un même préfixe, et toutes les propriétés d'une cellule ont un geohash
+commençant par celui de la cellule. Chaque propriété localisée stocke donc un geohash
+de précision `PRECISION` dans un champ indexé, et une cellule de n'importe quelle
+précision se lit avec une requête d'intervalle sur ce seul champ.
+
+Contenu:
+- `encode` / `cell_bounds` : geohash d'un point et rectangle d'une cellule.
+- `distance` : distance orthodromique (formule de haversine), en mètres.
+- `covering_ranges` : intervalles de geohash couvrant un rectangle.
+- `search_bbox` / `search_radius` : requêtes Datastore par intervalle puis filtrage exact,
+  avec un nombre borné de résultats et d'entités lues.
+
+Seul le geohash de précision `PRECISION` est stocké : une cellule plus grossière se lit
+par un intervalle sur ce champ, sans préfixes supplémentaires à écrire.
+
+Limites : les rectangles et cercles traversant l'antiméridien (longitude ±180) ne sont pas
+pris en charge (`crosses_antimeridian`) ; les routes les refusent.
+"""
+
+import math
+
+from common.metrics import track
+
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_DECODE = {char: index for index, char in enumerate(BASE32)}
+
+# Précision du geohash stocké (cellules d'environ 5 m x 5 m)
+PRECISION = 9
+
+# Nombre maximal de cellules lues pour une recherche : compromis entre le nombre de
+# requêtes (les cellules consécutives sont fusionnées) et les entités lues puis écartées
+MAX_CELLS = 16
+
+EARTH_RADIUS_M = 6_371_008.8
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    """Calcule le geohash d'un point.
+
+    Paramètres:
+        - latitude (float): Latitude en degrés (-90 à 90).
+        - longitude (float): Longitude en degrés (-180 à 180).
+        - precision (int): Nombre de caractères du geohash.
+
+    Retourne:
+        - str: Le geohash.
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        # Les bits pairs découpent la longitude, les bits impairs la latitude
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        if coordinate >= middle:
+            value = value * 2 + 1
+            interval[0] = middle
+        else:
+            value = value * 2
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
+
+
+def cell_size(precision):
+    """Retourne la hauteur et la largeur (en degrés) d'une cellule d'une précision donnée."""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def cell_bounds(geohash):
+    """Retourne le rectangle (sud, ouest, nord, est) d'une cellule."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = _DECODE[char]
+        for shift in range(4, -1, -1):
+            interval = lon_range if even else lat_range
+            middle = (interval[0] + interval[1]) / 2
+            if value >> shift & 1:
+                interval[0] = middle
+            else:
+                interval[1] = middle
+            even = not even
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+
+def distance(lat1, lon1, lat2, lon2):
+    """Distance orthodromique entre deux points, en mètres (formule de haversine)."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_bbox(latitude, longitude, radius):
+    """Rectangle (sud, ouest, nord, est) englobant un cercle de `radius` mètres."""
+    dlat = math.degrees(radius / EARTH_RADIUS_M)
+    # Près des pôles, le cercle couvre toutes les longitudes
+    cos_lat = math.cos(math.radians(latitude))
+    dlon = 180.0 if cos_lat < 1e-6 else min(180.0, math.degrees(radius / (EARTH_RADIUS_M * cos_lat)))
+    return (max(-90.0, latitude - dlat), max(-180.0, longitude - dlon),
+            min(90.0, latitude + dlat), min(180.0, longitude + dlon))
+
+
+def crosses_antimeridian(latitude, longitude, radius):
+    """Indique si le rectangle englobant un cercle déborde de la longitude ±180."""
+    cos_lat = math.cos(math.radians(latitude))
+    if cos_lat < 1e-6:
+        return True
+    dlon = math.degrees(radius / (EARTH_RADIUS_M * cos_lat))
+    return longitude - dlon < -180.0 or longitude + dlon > 180.0
+
+
+def _covering_cells(south, west, north, east, precision):
+    height, width = cell_size(precision)
+    rows = range(int((south + 90) // height), int(min(north + 90, 180 - height / 2) // height) + 1)
+    cols = range(int((west + 180) // width), int(min(east + 180, 360 - width / 2) // width) + 1)
+    if len(rows) * len(cols) > MAX_CELLS:
+        return None
+    return [encode(-90 + (row + 0.5) * height, -180 + (col + 0.5) * width, precision) for row in rows for col in cols]
+
+
+def _to_int(geohash):
+    value = 0
+    for char in geohash:
+        value = value * 32 + _DECODE[char]
+    return value
+
+
+def covering_ranges(south, west, north, east, accept=None):
+    """Calcule les intervalles de geohash couvrant un rectangle.
+
+    La précision retenue est la plus fine pour laquelle le rectangle tient dans au plus
+    `MAX_CELLS` cellules ; les cellules consécutives dans l'ordre des geohash sont fusionnées
+    en un seul intervalle.
+
+    Paramètres:
+        - south, west, north, east (float): Rectangle en degrés.
+        - accept (callable): Filtre facultatif `accept(geohash)` écartant des cellules
+          (ex: celles qui n'intersectent pas un cercle).
+
+    Retourne:
+        - list(tuple(str, str)): Intervalles [début, fin) à interroger.
+    """
+    cells = None
+    for precision in range(PRECISION, 0, -1):
+        cells = _covering_cells(south, west, north, east, precision)
+        if cells is not None:
+            break
+    if cells is None:
+        # Rectangle plus grand que la précision 1 autorisée : tout le globe
+        return [("", "{")]
+
+    cells = sorted(cell for cell in set(cells) if accept is None or accept(cell))
+
+    ranges = []
+    for cell in cells:
+        if ranges and _to_int(cell) == _to_int(ranges[-1][1]) + 1:
+            ranges[-1][1] = cell
+        else:
+            ranges.append([cell, cell])
+    # "{" suit "z" : `fin + "{"` borne tous les geohash commençant par `fin`
+    return [(start, end + "{") for start, end in ranges]
+
+
+def _nearest_in_cell(latitude, longitude, geohash):
+    south, west, north, east = cell_bounds(geohash)
+    return min(max(latitude, south), north), min(max(longitude, west), east)
+
+
+def _fetch_ranges(client, ranges, max_scanned=None):
+    # Entités des intervalles, au plus `max_scanned` ; le second élément indique une lecture
+    # interrompue (d'autres entités peuvent correspondre)
+    entities = {}
+    for start, end in ranges:
+        remaining = None if max_scanned is None else max_scanned - len(entities)
+        if remaining == 0:
+            return list(entities.values()), True
+        query = client.query(kind='Property')
+        query.add_filter('geohash', '>=', start)
+        query.add_filter('geohash', '<', end)
+        with track("datastore", "query"):
+            fetched = list(query.fetch(limit=remaining))
+        for entity in fetched:
+            entities[entity.key.id] = entity
+        if remaining is not None and len(fetched) == remaining:
+            return list(entities.values()), True
+    return list(entities.values()), False
+
+
+def search_bbox(client, south, west, north, east, limit=None, max_scanned=None):
+    """Recherche les propriétés situées dans un rectangle.
+
+    Paramètres:
+        - client (datastore.Client): Client Google Datastore.
+        - south, west, north, east (float): Rectangle en degrés.
+        - limit (int): Nombre maximal de propriétés retournées (None : toutes).
+        - max_scanned (int): Nombre maximal d'entités lues dans Datastore (None : sans limite).
+
+    Retourne:
+        - tuple: Propriétés du rectangle, et booléen indiquant que la lecture a atteint
+          `max_scanned` (résultats incomplets).
+    """
+    entities, truncated = _fetch_ranges(client, covering_ranges(south, west, north, east), max_scanned)
+    results = [
+        entity for entity in entities
+        if south <= entity['latitude'] <= north and west <= entity['longitude'] <= east
+    ]
+    return results[:limit], truncated
+
+
+def search_radius(client, latitude, longitude, radius, limit=None, max_scanned=None):
+    """Recherche les propriétés situées à moins de `radius` mètres d'un point.
+
+    Chaque entité retournée porte sa distance au point (champ `distance`, en mètres) ;
+    les résultats sont triés du plus proche au plus éloigné.
+
+    Paramètres:
+        - client (datastore.Client): Client Google Datastore.
+        - latitude, longitude (float): Centre de la recherche, en degrés.
+        - radius (float): Rayon en mètres.
+        - limit (int): Nombre maximal de propriétés retournées, les plus proches (None : toutes).
+        - max_scanned (int): Nombre maximal d'entités lues dans Datastore (None : sans limite).
+
+    Retourne:
+        - tuple: Propriétés du cercle, et booléen indiquant que la lecture a atteint
+          `max_scanned` (résultats incomplets, pas forcément les plus proches).
+    """
+    def intersects(cell):
+        return distance(latitude, longitude, *_nearest_in_cell(latitude, longitude, cell)) <= radius
+
+    ranges = covering_ranges(*radius_bbox(latitude, longitude, radius), accept=intersects)
+    entities, truncated = _fetch_ranges(client, ranges, max_scanned)
+
+    results = []
+    for entity in entities:
+        entity_distance = distance(latitude, longitude, entity['latitude'], entity['longitude'])
+        if entity_distance <= radius:
+            entity['distance'] = round(entity_distance, 1)
+            results.append(entity)
+    results.sort(key=lambda entity: entity['distance'])
+    return results[:limit], truncated
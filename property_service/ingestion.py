@@ -0,0 +1,374 @@
+"""
+Ingestion différée (write-behind) des créations de propriétés.
+
+Pendant la synchronisation des flux partenaires, les créations arrivent par rafales plus
+vite que des appels `client.put` unitaires ne peuvent les absorber. Dans ce mode, une
+création est validée, reçoit un identifiant réservé à l'avance (`allocate_ids`) puis est
+placée dans une file bornée ; la requête répond aussitôt 202 avec cet identifiant. Un
+thread d'écriture vide la file par lots `put_multi`, dès que `flush_size` entités sont en
+attente ou au plus tard après `flush_interval` secondes.
+
+Points principaux :
+- Contre-pression : si la file est pleine, la création est refusée (503) plutôt que de
+  faire croître la mémoire.
+- Durabilité : à l'arrêt du processus, la file est vidée dans Datastore ; les entités qui
+  ne peuvent pas être écrites (Datastore indisponible) sont ajoutées à un fichier de
+  débordement local (`spill-<pid>.jsonl`), rejoué au démarrage suivant de chaque worker
+  (`start_spill_replay`, voir `run.py`), même si `WRITE_BEHIND` a été désactivé entre-temps,
+  ou à la demande avec `flask replay-spill`. Un fichier n'est lu ou écrit que sous verrou
+  `fcntl` : le verrou, libéré par le système à la mort du processus, désigne le seul
+  processus qui le rejoue (les identifiants de processus, réutilisés notamment dans les
+  conteneurs, ne sont pas utilisés pour cela).
+- Une propriété acceptée n'est lisible qu'après l'écriture de son lot.
+- Un arrêt brutal du processus (SIGKILL, panne) perd les entités encore en file.
+- Un lot rejoué après une panne survenue pendant son écriture peut compter deux fois
+  dans les compteurs de `stats.py` (corrigé par `flask reconcile-stats`).
+
+Configuration (via `app.config`) :
+- WRITE_BEHIND (bool): Active le mode (requêtes portant `Prefer: respond-async`). Défaut : False.
+- WRITE_BEHIND_MAX_SIZE (int): Capacité de la file. Défaut : 10000.
+- WRITE_BEHIND_FLUSH_SIZE (int): Taille maximale d'un lot (250 au plus). Défaut : 250.
+- WRITE_BEHIND_FLUSH_INTERVAL (float): Attente maximale avant l'écriture d'un lot, en secondes. Défaut : 1.
+- WRITE_BEHIND_ENQUEUE_TIMEOUT (float): Attente maximale d'une place dans la file, en secondes. Défaut : 0.5.
+- WRITE_BEHIND_SPILL_DIR (str): Répertoire des fichiers de débordement. Défaut : "spill".
+"""
+
+import atexit
+import datetime
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from google.cloud import datastore
+
+from common.metrics import Counter, Gauge, track
+from property_service.cascade import TRANSIENT_ERRORS
+from property_service.models import Property, build_property_entity, get_client, put_new_properties
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - dépend de la plateforme
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+# Avec leurs entrées du journal, 250 entités remplissent un appel put_multi (500 au plus)
+MAX_FLUSH_SIZE = 250
+
+QUEUE_DEPTH = Gauge("write_behind_queue_depth", "Entités en attente d'écriture différée.")
+WRITE_BEHIND_ENTITIES = Counter(
+    "write_behind_entities_total", "Entités traitées par l'écriture différée, par issue.", ("outcome",))
+
+
+class BufferFull(Exception):
+    """Levée lorsque la file d'écriture différée est pleine (ou en cours d'arrêt)."""
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {"$datetime": value.isoformat()}
+    raise TypeError(f"Valeur non sérialisable : {type(value).__name__}")
+
+
+def _decode_value(value):
+    if set(value) == {"$datetime"}:
+        return datetime.datetime.fromisoformat(value["$datetime"])
+    return value
+
+
+def _try_lock(spill_file):
+    # Verrou exclusif non bloquant sur un fichier ouvert ; toujours accordé sans fcntl (Windows)
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(spill_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def _same_file(spill_file, path):
+    # Le fichier ouvert est-il toujours celui du chemin (ni renommé ni supprimé entre-temps) ?
+    try:
+        return os.path.samestat(os.fstat(spill_file.fileno()), os.stat(path))
+    except FileNotFoundError:
+        return False
+
+
+class WriteBehindBuffer:
+    """File bornée de créations de propriétés, écrite par lots en arrière-plan.
+
+    Paramètres:
+        - client (datastore.Client): Client Google Datastore.
+        - max_size (int): Capacité de la file.
+        - flush_size (int): Taille maximale d'un lot.
+        - flush_interval (float): Attente maximale avant l'écriture d'un lot, en secondes.
+        - enqueue_timeout (float): Attente maximale d'une place dans la file, en secondes.
+        - spill_dir (str): Répertoire des fichiers de débordement.
+        - id_block (int): Nombre d'identifiants réservés par appel `allocate_ids`.
+        - max_retries (int): Nombre de tentatives d'écriture d'un lot.
+        - backoff (float): Attente initiale entre deux tentatives, en secondes.
+    """
+
+    def __init__(self, client, max_size=10000, flush_size=MAX_FLUSH_SIZE, flush_interval=1.0,
+                 enqueue_timeout=0.5, spill_dir="spill", id_block=100, max_retries=5, backoff=0.5):
+        self.client = client
+        self.flush_size = min(flush_size, MAX_FLUSH_SIZE)
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.spill_dir = spill_dir
+        self.id_block = id_block
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._queue = queue.Queue(maxsize=max_size)
+        self._ids = []
+        self._ids_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Démarre le thread d'écriture (qui rejoue d'abord les fichiers de débordement)."""
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def _reserve_key(self):
+        with self._ids_lock:
+            if not self._ids:
+                with track("datastore", "allocate_ids"):
+                    self._ids = self.client.allocate_ids(self.client.key('Property'), self.id_block)
+            return self._ids.pop()
+
+    def submit(self, property_data):
+        """Valide une propriété, lui réserve un identifiant et la place dans la file.
+
+        Paramètres:
+            - property_data (Property): Données de la propriété.
+
+        Retourne:
+            - int: Identifiant réservé de la propriété.
+
+        Lève:
+            - EntityValidationError: Si l'entité est invalide.
+            - BufferFull: Si la file est pleine ou en cours d'arrêt.
+        """
+        if self._stopping.is_set():
+            raise BufferFull("Arrêt en cours.")
+        entity = build_property_entity(self._reserve_key(), property_data)
+        try:
+            self._queue.put(entity, timeout=self.enqueue_timeout)
+        except queue.Full:
+            WRITE_BEHIND_ENTITIES.inc("rejected")
+            raise BufferFull("File d'écriture pleine.") from None
+        QUEUE_DEPTH.inc()
+        return entity.key.id
+
+    def _take_batch(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_size:
+            try:
+                # En cours d'arrêt, la file est vidée sans attendre
+                if self._stopping.is_set():
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+            if not self._stopping.is_set() and time.monotonic() >= deadline:
+                break
+        QUEUE_DEPTH.dec(amount=len(batch))
+        return batch
+
+    def _flush(self, batch):
+        for attempt in range(self.max_retries):
+            try:
+                put_new_properties(self.client, batch)
+                WRITE_BEHIND_ENTITIES.inc("written", amount=len(batch))
+                return
+            except TRANSIENT_ERRORS:
+                if attempt < self.max_retries - 1:
+                    time.sleep(self.backoff * 2 ** attempt)
+            except Exception:
+                logger.exception("Échec de l'écriture d'un lot de %d propriétés.", len(batch))
+                break
+        self._spill(batch)
+
+    def _spill(self, entities):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, f"spill-{os.getpid()}.jsonl")
+        while True:
+            spill_file = open(path, "a", encoding="utf-8")
+            if fcntl is not None:
+                fcntl.flock(spill_file.fileno(), fcntl.LOCK_EX)
+            # Un autre worker a pu réclamer le fichier avant le verrou : on en ouvre un nouveau
+            if _same_file(spill_file, path):
+                break
+            spill_file.close()
+        with spill_file:
+            for entity in entities:
+                spill_file.write(json.dumps({"id": entity.key.id, "values": dict(entity)}, default=_encode_value) + "\n")
+            spill_file.flush()
+            os.fsync(spill_file.fileno())
+        WRITE_BEHIND_ENTITIES.inc("spilled", amount=len(entities))
+        logger.warning("%d propriétés écrites dans le fichier de débordement %s.", len(entities), path)
+
+    def replay_spill_files(self):
+        """Écrit dans Datastore les entités des fichiers de débordement existants.
+
+        Un fichier est réclamé en prenant son verrou, puis renommé pour que son processus
+        d'origine n'y ajoute plus rien ; il est supprimé une fois rejoué. Un fichier verrouillé
+        (en cours d'écriture ou de rejeu) est ignoré ; celui d'un rejeu interrompu est repris,
+        son verrou ayant disparu avec le processus.
+
+        Retourne:
+            - int: Nombre d'entités rejouées.
+        """
+        replayed = 0
+        for path in sorted(glob.glob(os.path.join(self.spill_dir, "spill-*.jsonl*"))):
+            try:
+                spill_file = open(path, encoding="utf-8")
+            except FileNotFoundError:
+                continue
+            with spill_file:
+                if not _try_lock(spill_file) or not _same_file(spill_file, path):
+                    continue
+                claimed = path
+                if ".replay-" not in path:
+                    claimed = f"{path}.replay-{os.getpid()}-{time.time_ns()}"
+                    os.rename(path, claimed)
+
+                entities = []
+                for line in spill_file:
+                    record = json.loads(line, object_hook=_decode_value)
+                    entity = datastore.Entity(key=self.client.key('Property', record["id"]),
+                                              exclude_from_indexes=Property.INDEX_EXCLUDED)
+                    entity.update(record["values"])
+                    entities.append(entity)
+
+                for start in range(0, len(entities), self.flush_size):
+                    self._flush(entities[start:start + self.flush_size])
+                # Supprimé sous verrou : aucun autre processus ne peut le rejouer une seconde fois
+                os.remove(claimed)
+            replayed += len(entities)
+        return replayed
+
+    def _replay_in_background(self):
+        try:
+            replayed = self.replay_spill_files()
+            if replayed:
+                logger.info("%d propriétés rejouées depuis les fichiers de débordement.", replayed)
+        except Exception:
+            logger.exception("Échec du rejeu des fichiers de débordement.")
+
+    def _run(self):
+        self._replay_in_background()
+
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._take_batch()
+            if batch:
+                self._flush(batch)
+
+    def stop(self, timeout=30):
+        """Arrête l'écriture différée : la file est vidée dans Datastore, ou à défaut dans
+        le fichier de débordement.
+
+        Paramètres:
+            - timeout (float): Attente maximale du thread d'écriture, en secondes.
+        """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+        remaining = []
+        while True:
+            try:
+                remaining.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if remaining:
+            QUEUE_DEPTH.dec(amount=len(remaining))
+            self._spill(remaining)
+
+
+# Protège la création de la file entre threads d'un même processus
+_buffer_lock = threading.Lock()
+
+
+def _new_buffer(app):
+    return WriteBehindBuffer(
+        get_client(app),
+        max_size=app.config.get('WRITE_BEHIND_MAX_SIZE', 10000),
+        flush_size=app.config.get('WRITE_BEHIND_FLUSH_SIZE', MAX_FLUSH_SIZE),
+        flush_interval=app.config.get('WRITE_BEHIND_FLUSH_INTERVAL', 1.0),
+        enqueue_timeout=app.config.get('WRITE_BEHIND_ENQUEUE_TIMEOUT', 0.5),
+        spill_dir=app.config.get('WRITE_BEHIND_SPILL_DIR', "spill"),
+    )
+
+
+def has_spill_files(app):
+    """Indique si des fichiers de débordement attendent d'être rejoués.
+
+    Paramètres:
+        - app (Flask): Application Flask.
+    """
+    return bool(glob.glob(os.path.join(app.config.get('WRITE_BEHIND_SPILL_DIR', "spill"), "spill-*.jsonl*")))
+
+
+def replay_spill(app):
+    """Rejoue aussitôt les fichiers de débordement (commande `flask replay-spill`).
+
+    Paramètres:
+        - app (Flask): Application Flask.
+
+    Retourne:
+        - int: Nombre de propriétés rejouées.
+    """
+    return _new_buffer(app).replay_spill_files()
+
+
+def start_spill_replay(app):
+    """Rejoue dans un thread du worker courant les fichiers de débordement d'un arrêt précédent.
+
+    À appeler dans chaque worker après le fork (voir `run.py`) : les entités débordées sont
+    écrites même si aucune création différée n'est reçue, ou si `WRITE_BEHIND` est désactivé.
+    Sans effet s'il n'y a aucun fichier.
+
+    Paramètres:
+        - app (Flask): Application Flask.
+
+    Retourne:
+        - threading.Thread: Le thread de rejeu, ou None.
+    """
+    if not has_spill_files(app):
+        return None
+    thread = threading.Thread(target=_new_buffer(app)._replay_in_background, name="spill-replay", daemon=True)
+    thread.start()
+    return thread
+
+
+def get_buffer(app):
+    """Retourne la file d'écriture différée du processus courant (créée au premier appel).
+
+    Comme le client Datastore, la file et son thread sont créés après le fork des workers.
+
+    Paramètres:
+        - app (Flask): Application Flask.
+
+    Retourne:
+        - WriteBehindBuffer: La file démarrée.
+    """
+    state = app.extensions.get('write_behind')
+    if state is None or state[0] != os.getpid():
+        with _buffer_lock:
+            state = app.extensions.get('write_behind')
+            if state is None or state[0] != os.getpid():
+                buffer = _new_buffer(app)
+                buffer.start()
+                atexit.register(buffer.stop)
+                state = app.extensions['write_behind'] = (os.getpid(), buffer)
+    return state[1]
@@ -0,0 +1,216 @@
+"""
+Dernières propriétés publiées par ville, servies depuis la mémoire.
+
+Pour chaque ville consultée, le processus conserve les `size` propriétés les plus
+récentes (ordre décroissant de `cree_le`). La liste d'une ville est construite au premier
+accès par une requête triée (`ville = X ORDER BY cree_le DESC`, index composite déclaré
+dans `index.yaml`), puis tenue à jour de manière incrémentale :
+- immédiatement, pour les écritures effectuées par ce processus (`record` / `forget`) ;
+- en lisant le journal des modifications (voir `changes.py`) toutes les `sync_interval`
+  secondes, pour les écritures des autres workers. La lecture est faite par un thread du
+  worker (`start_latest_sync`, lancé après le fork par `run.py`) : les requêtes sont servies
+  depuis la mémoire sans attendre Datastore. Sans ce thread (tests, scripts), la requête
+  qui trouve la dernière lecture trop ancienne l'effectue elle-même.
+
+Le nombre de villes conservées est borné (les moins récemment consultées sont oubliées).
+Une ville dont la liste pleine perd un élément (suppression, changement de ville) est
+reconstruite à l'accès suivant, la propriété suivante n'étant pas connue.
+
+Les propriétés sans `cree_le` (créées avant l'horodatage) n'apparaissent pas.
+"""
+
+import datetime
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from common.metrics import track
+from property_service.changes import encode_cursor, fetch_changes
+from property_service.models import get_client
+
+
+logger = logging.getLogger(__name__)
+
+
+class LatestFeed:
+    """Listes en mémoire des propriétés les plus récentes par ville.
+
+    Paramètres:
+        - size (int): Nombre de propriétés conservées par ville.
+        - max_cities (int): Nombre maximal de villes conservées.
+        - sync_interval (float): Intervalle minimal entre deux lectures du journal, en secondes.
+        - lag (float): Âge minimal des modifications lues dans le journal (voir `fetch_changes`).
+        - readback (float): Fenêtre de relecture du journal (voir `fetch_changes`).
+    """
+
+    def __init__(self, size=50, max_cities=1000, sync_interval=1.0, lag=1.0, readback=30.0):
+        self.size = size
+        self.max_cities = max_cities
+        self.sync_interval = sync_interval
+        self.lag = lag
+        self.readback = readback
+        self._cities = OrderedDict()
+        self._lock = threading.Lock()
+        self._cursor = self._current_cursor()
+        self._last_sync = 0.0
+        # Processus dont le thread de lecture du journal est actif (il ne survit pas au fork)
+        self._sync_pid = None
+        self._stop = threading.Event()
+
+    def _current_cursor(self):
+        # Les modifications antérieures sont déjà visibles par les requêtes de reconstruction ;
+        # on recule de `readback` secondes pour ne pas manquer une écriture validée en retard
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return encode_cursor(now - datetime.timedelta(seconds=self.readback), 0)
+
+    def latest(self, client, ville, limit=None):
+        """Retourne les propriétés les plus récentes d'une ville.
+
+        Paramètres:
+            - client (datastore.Client): Client Google Datastore.
+            - ville (str): Ville.
+            - limit (int): Nombre de propriétés retournées (au plus `size`).
+
+        Retourne:
+            - List[datastore.Entity]: Propriétés par date de création décroissante.
+        """
+        if self._sync_pid != os.getpid():
+            self.sync(client)
+        with self._lock:
+            items = self._cities.get(ville)
+            if items is not None:
+                self._cities.move_to_end(ville)
+        if items is None:
+            items = self._rebuild(client, ville)
+        return items[:limit or self.size]
+
+    def _rebuild(self, client, ville):
+        query = client.query(kind='Property')
+        query.add_filter('ville', '=', ville)
+        query.order = ['-cree_le']
+        with track("datastore", "query"):
+            items = list(query.fetch(limit=self.size))
+        with self._lock:
+            self._cities[ville] = items
+            self._cities.move_to_end(ville)
+            while len(self._cities) > self.max_cities:
+                self._cities.popitem(last=False)
+        return items
+
+    def record(self, entity):
+        """Prend en compte une propriété créée ou modifiée.
+
+        Paramètres:
+            - entity (datastore.Entity): Propriété telle qu'écrite dans Datastore.
+        """
+        ville = entity.get('ville')
+        with self._lock:
+            self._remove(entity.key.id, keep=ville)
+            items = self._cities.get(ville)
+            if items is None or entity.get('cree_le') is None:
+                return
+            # Insertion à sa place : les listes sont courtes et presque toujours en tête
+            position = 0
+            while position < len(items) and items[position]['cree_le'] > entity['cree_le']:
+                position += 1
+            if position < self.size:
+                items.insert(position, entity)
+                del items[self.size:]
+
+    def forget(self, entity_id):
+        """Retire une propriété supprimée.
+
+        Paramètres:
+            - entity_id (int): Identifiant de la propriété.
+        """
+        with self._lock:
+            self._remove(entity_id)
+
+    def _remove(self, entity_id, keep=None):
+        # Retire une propriété de sa liste ; `keep` est la ville où elle va être réinsérée
+        for ville, items in list(self._cities.items()):
+            for position, item in enumerate(items):
+                if item.key.id == entity_id:
+                    del items[position]
+                    # Une liste pleine qui perd un élément ne connaît pas le suivant
+                    if ville != keep and len(items) == self.size - 1:
+                        del self._cities[ville]
+                    return
+
+    def sync(self, client):
+        """Applique les modifications du journal postérieures à la dernière lecture.
+
+        Sans effet si la dernière lecture date de moins de `sync_interval` secondes.
+
+        Paramètres:
+            - client (datastore.Client): Client Google Datastore.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_sync < self.sync_interval:
+                return
+            self._last_sync = now
+        self._pull(client)
+
+    def _pull(self, client):
+        with self._lock:
+            if not self._cities:
+                # Aucune liste à tenir à jour : inutile de lire le journal
+                self._cursor = self._current_cursor()
+                return
+            cursor = self._cursor
+
+        changes, cursor = fetch_changes(client, cursor, limit=500, lag=self.lag, readback=self.readback)
+        deleted = {change['entity_id'] for change in changes if change['op'] == 'delete'}
+        written = {change['entity_id'] for change in changes if change['op'] != 'delete'} - deleted
+        if written:
+            with track("datastore", "get_multi"):
+                entities = client.get_multi([client.key('Property', entity_id) for entity_id in written])
+            for entity in entities:
+                self.record(entity)
+        for entity_id in deleted:
+            self.forget(entity_id)
+
+        with self._lock:
+            self._cursor = cursor
+
+    def start_sync(self, get_client):
+        """Lit le journal toutes les `sync_interval` secondes dans un thread du processus courant.
+
+        Paramètres:
+            - get_client (callable): Fonction sans argument retournant le client Datastore.
+
+        Retourne:
+            - threading.Thread: Le thread de lecture.
+        """
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(self.sync_interval):
+                try:
+                    self._pull(get_client())
+                except Exception:
+                    logger.exception("Lecture du journal des modifications impossible.")
+
+        self._sync_pid = os.getpid()
+        thread = threading.Thread(target=run, name="latest-sync", daemon=True)
+        thread.start()
+        return thread
+
+    def stop_sync(self):
+        """Arrête le thread de lecture (les requêtes relisent alors le journal elles-mêmes)."""
+        self._sync_pid = None
+        self._stop.set()
+
+
+def start_latest_sync(app):
+    """Lance la lecture du journal des modifications dans un thread du worker courant.
+
+    À appeler dans chaque worker après le fork (voir `run.py`).
+
+    Paramètres:
+        - app (Flask): Application Flask.
+    """
+    return app.extensions['latest_feed'].start_sync(lambda: get_client(app))
@@ -3,19 +3,118 @@ Ce module gère les opérations CRUD (Créer, Lire, Mettre à jour, Supprimer)
 pour les propriétés à l'aide de Google Cloud Datastore.
 
 Contenu:
-- Définition du modèle `Property` avec dataclasses.
+- Définition des modèles `Property` et `Piece` (dataclasses à `__slots__`) et de la
+  politique d'indexation (le décodage des requêtes est dans `schema.py`).
+- Validation de la taille des entités et du nombre de pièces à l'écriture.
+- Calcul du geohash indexé des propriétés localisées (voir `geo.py`).
+- Horodatage des créations (`cree_le`, indexé) et des mises à jour (`modifie_le`).
+- Accès au client Datastore, créé paresseusement dans chaque processus.
 - Fonctions utilitaires pour interagir avec Google Datastore, y compris :
-  - Création de propriétés.
+  - Création de propriétés (unitaire, ou par lots pour l'ingestion différée de `ingestion.py`).
   - Liste des propriétés avec filtres.
   - Récupération d'une propriété par son identifiant.
-  - Mise à jour et suppression des propriétés.
+  - Mise à jour (complète ou par JSON merge patch) et suppression des propriétés.
+  Les mises à jour sans effet ne déclenchent aucune écriture.
+- Chaque écriture ajoute un enregistrement au journal des modifications (voir `changes.py`)
+  et met à jour les compteurs par ville et type de bien (voir `stats.py`).
+
+Chaque appel RPC vers Datastore est chronométré (métrique `downstream_call_duration_seconds`).
 """
 
 
 from google.cloud import datastore
-from dataclasses import dataclass, asdict
+from google.cloud.datastore import helpers
+from dataclasses import dataclass, field
+from typing import ClassVar
+from flask import current_app
+from common.metrics import track
+from property_service.changes import build_change, notify_changes
+from property_service import geo
+from property_service.stats import facet_deltas, facet_of, increment_facets
+import datetime
+import os
+import threading
+
+
+# Taille maximale d'une entité acceptée à l'écriture (limite Datastore : 1 048 572 octets)
+MAX_ENTITY_BYTES = 1_000_000
+
+# Nombre maximal de pièces par propriété
+MAX_PIECES = 50
+
+
+class EntityValidationError(ValueError):
+    """Levée lorsqu'une entité dépasse les limites acceptées à l'écriture."""
+
 
-@dataclass
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+# Protège la création du client Datastore entre threads d'un même processus
+_client_lock = threading.Lock()
+
+
+def get_client(app=None):
+    """Retourne le client Datastore de l'application.
+
+    Un client injecté via `DATASTORE_CLIENT` est utilisé tel quel. Sinon, le client est
+    créé au premier appel dans chaque processus : un client gRPC ne doit pas être
+    partagé à travers un `fork`, il est donc recréé si le PID a changé.
+
+    Paramètres:
+        - app (Flask): Application (par défaut, l'application courante).
+
+    Retourne:
+        - datastore.Client: Client Google Datastore.
+    """
+    app = app or current_app
+    client = app.config.get('DATASTORE_CLIENT')
+    if client is not None:
+        return client
+
+    state = app.extensions.get('datastore')
+    if state is None or state[0] != os.getpid():
+        with _client_lock:
+            state = app.extensions.get('datastore')
+            if state is None or state[0] != os.getpid():
+                if app.config.get('DATASTORE_EMULATOR_HOST'):
+                    client = datastore.Client(project=app.config['DATASTORE_PROJECT_ID'])
+                else:
+                    client = datastore.Client.from_service_account_json(app.config['DATASTORE_CREDENTIALS'])
+                state = app.extensions['datastore'] = (os.getpid(), client)
+    return state[1]
+
+
+@dataclass(slots=True)
+class Piece:
+    """Pièce d'une propriété.
+
+    Les pièces étaient auparavant des objets libres : les champs décrits ici sont vérifiés,
+    les autres sont conservés tels quels (`extras`).
+
+    Attributs:
+        - nom (str): Nom de la pièce (facultatif).
+        - surface (float): Surface en m² (facultatif).
+        - etage (str): Étage (facultatif ; un entier est converti en chaîne).
+        - caracteristiques (list): Caractéristiques de la pièce (facultatif).
+        - extras (dict): Autres champs fournis par le client (facultatif).
+    """
+    nom : str = None
+    surface : float = None
+    etage : str = field(default=None, metadata={"coerce": True})
+    caracteristiques : list[str] = None
+    extras : dict = field(default=None, metadata={"extras": True})
+
+    def to_dict(self):
+        """Retourne les champs renseignés de la pièce (entité imbriquée Datastore)."""
+        values = dict(self.extras) if self.extras else {}
+        values.update((name, value) for name in self.__slots__
+                      if name != 'extras' and (value := getattr(self, name)) is not None)
+        return values
+
+
+@dataclass(slots=True)
 class Property:
     """Représentation d'une propriété immobilière.
 
@@ -25,14 +124,120 @@ class Property:
         - type_de_bien (str): Type de bien .
         - ville (str): Ville où se trouve la propriété.
         - proprietaire (int): Identifiant du propriétaire.
-        - pieces (list): Liste des pièces et leurs caractéristiques (facultatif).
+        - pieces (list): Liste des pièces (`Piece`, ou dictionnaires déjà validés) (facultatif).
+        - latitude (float): Latitude en degrés (facultatif, avec `longitude`).
+        - longitude (float): Longitude en degrés (facultatif, avec `latitude`).
+
+    Champs modifiables:
+        - MUTABLE_FIELDS: Champs acceptés par une mise à jour.
+        - OPTIONAL_FIELDS: Champs pouvant être supprimés (valeur `null` dans un patch).
+
+    Politique d'indexation:
+        - INDEX_EXCLUDED: Champs jamais utilisés dans une requête, exclus des index
+          intégrés de Datastore pour réduire la latence, le coût des écritures et le stockage.
+          Les recherches géographiques passent par le champ indexé `geohash`, calculé à
+          partir de `latitude` et `longitude`. Seul `cree_le` est indexé parmi les horodatages.
     """
+    INDEX_EXCLUDED : ClassVar[tuple] = ('description', 'pieces', 'latitude', 'longitude', 'modifie_le')
+
+    # Champs modifiables après la création, et parmi eux ceux qui peuvent être supprimés
+    MUTABLE_FIELDS : ClassVar[tuple] = ('nom', 'description', 'type_de_bien', 'ville', 'pieces', 'latitude', 'longitude')
+    OPTIONAL_FIELDS : ClassVar[tuple] = ('pieces', 'latitude', 'longitude')
+
     nom : str
     description : str
     type_de_bien : str
     ville : str 
     proprietaire : int
-    pieces : list = None
+    pieces : list[Piece] = field(default_factory=list)
+    latitude : float = None
+    longitude : float = None
+
+    def to_dict(self):
+        """Retourne les champs renseignés de la propriété, sans copie profonde (contrairement à `asdict`)."""
+        values = {name: value for name in self.__slots__ if (value := getattr(self, name)) is not None}
+        if self.pieces:
+            values['pieces'] = [piece.to_dict() if isinstance(piece, Piece) else piece for piece in self.pieces]
+        return values
+
+
+def apply_index_policy(entity):
+    """Applique la politique d'indexation de `Property` à une entité.
+
+    Paramètres:
+        - entity (datastore.Entity): Entité de type "Property".
+    """
+    entity.exclude_from_indexes.update(Property.INDEX_EXCLUDED)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def apply_location(entity):
+    """Met à jour le champ indexé `geohash` d'une entité à partir de ses coordonnées.
+
+    Une entité sans coordonnées n'a pas de geohash (et n'apparaît pas dans les recherches
+    géographiques).
+
+    Paramètres:
+        - entity (datastore.Entity): Entité de type "Property".
+
+    Lève:
+        - EntityValidationError: Coordonnées incomplètes ou hors limites.
+    """
+    latitude, longitude = entity.get('latitude'), entity.get('longitude')
+    if latitude is None and longitude is None:
+        for field in ('latitude', 'longitude', 'geohash'):
+            entity.pop(field, None)
+        return
+
+    if not (_is_number(latitude) and _is_number(longitude)):
+        raise EntityValidationError("La latitude et la longitude doivent être renseignées ensemble, sous forme de nombres.")
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise EntityValidationError("Coordonnées hors limites (latitude de -90 à 90, longitude de -180 à 180).")
+
+    entity['geohash'] = geo.encode(latitude, longitude)
+
+
+def validate_entity(entity):
+    """Vérifie qu'une entité respecte les limites d'écriture.
+
+    Paramètres:
+        - entity (datastore.Entity): Entité à écrire.
+
+    Lève:
+        - EntityValidationError: Trop de pièces ou entité trop volumineuse.
+    """
+    pieces = entity.get('pieces') or []
+    if len(pieces) > MAX_PIECES:
+        raise EntityValidationError(f"Une propriété ne peut pas contenir plus de {MAX_PIECES} pièces.")
+
+    size = helpers.entity_to_protobuf(entity)._pb.ByteSize()
+    if size > MAX_ENTITY_BYTES:
+        raise EntityValidationError(f"La propriété est trop volumineuse ({size} octets, maximum {MAX_ENTITY_BYTES}).")
+
+
+def build_property_entity(key, property_data):
+    """Construit et valide l'entité d'une nouvelle propriété, sans l'écrire.
+
+    Paramètres:
+        - key (datastore.Key): Clé de l'entité (partielle, ou complète si l'identifiant est réservé).
+        - property_data (Property): Données de la propriété.
+
+    Retourne:
+        - datastore.Entity: Entité prête à être écrite.
+
+    Lève:
+        - EntityValidationError: Si l'entité dépasse les limites d'écriture ou si ses
+          coordonnées sont invalides.
+    """
+    entity = datastore.Entity(key=key, exclude_from_indexes=Property.INDEX_EXCLUDED)
+    entity.update(property_data.to_dict())
+    entity['cree_le'] = entity['modifie_le'] = _now()
+    apply_location(entity)
+    validate_entity(entity)
+    return entity
 
 
 def create_property(client,property_data):
@@ -44,20 +249,45 @@ def create_property(client,property_data):
 
     Retourne:
         - entity (datastore.Entity): Entité nouvellement créée dans Datastore.
-    """
 
-    # Génère une clé pour une nouvelle entité de type "Property"
-    key = client.key('Property')
-    entity = datastore.Entity(key=key)
-    entity.update(asdict(property_data))
+    Lève:
+        - EntityValidationError: Si l'entité dépasse les limites d'écriture ou si ses
+          coordonnées sont invalides.
+    """
 
-    # Enregistre l'entité dans Datastore
-    client.put(entity)
+    # L'identifiant est réservé d'abord : l'entité et son entrée du journal sont écrites ensemble
+    with track("datastore", "allocate_ids"):
+        key = client.allocate_ids(client.key('Property'), 1)[0]
+    entity = build_property_entity(key, property_data)
+    put_new_properties(client, [entity])
 
     return entity
 
 
 
+def put_new_properties(client, entities):
+    """Écrit en un seul appel des propriétés nouvelles dont l'identifiant est déjà réservé.
+
+    Les entrées du journal des modifications sont écrites dans le même appel `put_multi`.
+
+    Paramètres:
+        - client (datastore.Client): Client Google Datastore.
+        - entities (list): Entités construites par `build_property_entity` avec une clé complète
+          (250 au plus : avec leurs entrées de journal, un appel est limité à 500 entités).
+    """
+    changes = [build_change(client, entity.key.id, "create", entity.keys()) for entity in entities]
+    with track("datastore", "put_multi"):
+        client.put_multi(list(entities) + changes)
+    notify_changes()
+
+    deltas = {}
+    for entity in entities:
+        pair = facet_of(entity)
+        deltas[pair] = deltas.get(pair, 0) + 1
+    increment_facets(client, deltas)
+
+
+
 def list_properties(client, filters=None):
     """Récupère la liste des propriétés avec des filtres facultatifs.
 
@@ -75,7 +305,8 @@ def list_properties(client, filters=None):
         for field, value in filters.items():
             query.add_filter(field, '=', value) # Ajoute des filtres à la requête
 
-    return list(query.fetch())
+    with track("datastore", "query"):
+        return list(query.fetch())
 
 
 
@@ -91,7 +322,8 @@ def get_property(client, property_id):
     """
     key= client.key('Property',property_id)
 
-    return client.get(key)
+    with track("datastore", "get"):
+        return client.get(key)
 
 
 
@@ -101,35 +333,173 @@ def update_property(client, property_id, updates):
     Paramètres:
         - client (datastore.Client): Client Google Datastore.
         - property_id (int): Identifiant unique de la propriété à mettre à jour.
-        - updates (dict): Dictionnaire contenant les champs à mettre à jour.
+        - updates (dict): Dictionnaire contenant les champs à mettre à jour (`None` supprime le champ).
 
     Retourne:
         - entity (datastore.Entity) ou None: L'entité mise à jour si trouvée, sinon None.
+
+    Lève:
+        - EntityValidationError: Si l'entité mise à jour dépasse les limites d'écriture.
     """
 
     key = client.key('Property', property_id)
-    entity = client.get(key)
+    with track("datastore", "get"):
+        entity = client.get(key)
     
     # Propriété non trouvée
     if not entity:
         return None  
     
-    entity.update(updates) # Met à jour les champs avec les nouvelles données
-    client.put(entity) # Enregistre les modifications dans Datastore
+    # Seuls les champs dont la valeur change sont écrits
+    changed = [field for field, value in updates.items() if entity.get(field) != value]
+    if not changed:
+        return entity
+
+    previous = facet_of(entity)
+    # Met à jour les champs avec les nouvelles données
+    for field in changed:
+        if updates[field] is None:
+            del entity[field]
+        else:
+            entity[field] = updates[field]
+    _save_update(client, entity, changed, previous)
 
     return entity
 
 
 
-def delete_property(client, property_id):
+def merge_patch(target, patch):
+    """Applique un JSON merge patch (RFC 7386) à une valeur.
+
+    Paramètres:
+        - target: Valeur d'origine.
+        - patch: Patch à appliquer (`None` supprime une clé d'objet).
+
+    Retourne:
+        - La nouvelle valeur (l'originale n'est pas modifiée).
+    """
+    if not isinstance(patch, dict):
+        return patch
+
+    result = dict(target) if isinstance(target, dict) else {}
+    for field, value in patch.items():
+        if value is None:
+            result.pop(field, None)
+        else:
+            result[field] = merge_patch(result.get(field), value)
+    return result
+
+
+
+def patch_property(client, entity, patch):
+    """Applique un JSON merge patch à une propriété déjà lue.
+
+    Le patch est comparé à l'entité stockée : si aucun champ ne change, rien n'est écrit
+    (ni l'entité, ni le journal des modifications).
+
+    Paramètres:
+        - client (datastore.Client): Client Google Datastore.
+        - entity (datastore.Entity): Propriété lue depuis Datastore.
+        - patch (dict): Patch limité aux champs de `Property.MUTABLE_FIELDS`.
+
+    Retourne:
+        - list: Noms des champs effectivement modifiés.
+
+    Lève:
+        - EntityValidationError: Si la propriété modifiée dépasse les limites d'écriture.
+    """
+    previous = facet_of(entity)
+    changed = []
+    for field, value in patch.items():
+        if value is None:
+            if field in entity:
+                del entity[field]
+                changed.append(field)
+            continue
+
+        new_value = merge_patch(entity.get(field), value)
+        if field not in entity or entity[field] != new_value:
+            entity[field] = new_value
+            changed.append(field)
+
+    if changed:
+        _save_update(client, entity, changed, previous)
+
+    return changed
+
+
+
+def _save_update(client, entity, changed, previous):
+    entity['modifie_le'] = _now()
+    apply_index_policy(entity)
+    apply_location(entity)
+    validate_entity(entity)
+    with track("datastore", "put_multi"):
+        # Enregistre les modifications et l'entrée du journal en un seul appel
+        client.put_multi([entity, build_change(client, entity.key.id, "update", changed)])
+    notify_changes()
+    increment_facets(client, facet_deltas(previous, facet_of(entity)))
+
+
+
+def delete_property(client, property_id, entity=None):
     """Supprime une propriété existante par son identifiant.
 
     Paramètres:
         - client (datastore.Client): Client Google Datastore.
         - property_id (int): Identifiant unique de la propriété à supprimer.
+        - entity (datastore.Entity): Propriété déjà lue (facultatif : relue sinon, pour
+          mettre à jour les compteurs).
 
     Retourne:
         - None
     """
     key = client.key('Property', property_id)
-    client.delete(key)
\ No newline at end of file
+    if entity is None:
+        with track("datastore", "get"):
+            entity = client.get(key)
+        if entity is None:
+            return
+    with track("datastore", "delete"):
+        # Suppression et entrée du journal validées en un seul appel
+        with client.batch() as batch:
+            batch.delete(key)
+            batch.put(build_change(client, property_id, "delete", []))
+    notify_changes()
+    increment_facets(client, facet_deltas(before=facet_of(entity)))
+
+
+
+def backfill_index_policy(client, batch_size=500):
+    """Réécrit toutes les propriétés existantes selon la politique d'indexation actuelle.
+
+    Opération ponctuelle, idempotente : les entités sont parcourues page par page et
+    réécrites par lots avec `put_multi`, sans modifier leurs données.
+
+    Paramètres:
+        - client (datastore.Client): Client Google Datastore.
+        - batch_size (int): Nombre d'entités par page (500 au plus).
+
+    Retourne:
+        - int: Nombre d'entités réécrites.
+    """
+    page_size = min(batch_size, 500)
+    rewritten = 0
+    cursor = None
+    while True:
+        query = client.query(kind='Property')
+        with track("datastore", "query"):
+            iterator = query.fetch(limit=page_size, start_cursor=cursor)
+            entities = list(iterator)
+        if not entities:
+            return rewritten
+
+        for entity in entities:
+            apply_index_policy(entity)
+        with track("datastore", "put_multi"):
+            client.put_multi(entities)
+        rewritten += len(entities)
+
+        cursor = iterator.next_page_token
+        if cursor is None or len(entities) < page_size:
+            return rewritten
@@ -6,14 +6,41 @@ sur les propriétés. Il utilise Google Cloud Datastore comme base de données e
 les utilisateurs via des appels au service utilisateur (user_service).
 
 Les routes incluent :
-- Création de propriétés
-- Liste des propriétés filtrées par ville
+- Création de propriétés (idempotente avec l'en-tête `Idempotency-Key`)
+- Liste des propriétés filtrées par ville(s) et type(s) de bien, avec pagination
+- Recherche géographique (cercle autour d'un point ou rectangle)
+- Statistiques par ville et type de bien
+- Dernières propriétés publiées dans une ville (servies depuis la mémoire)
 - Récupération d'une propriété par ID
-- Mise à jour et suppression de propriétés (avec validation de l'utilisateur)
+- Mise à jour (PUT ou PATCH en JSON merge patch) et suppression de propriétés (avec validation de l'utilisateur)
+- Lecture incrémentale du journal des modifications
+- Export Parquet de toutes les propriétés (réservé aux services internes)
+
+Les validations de jetons et les propriétés lues par identifiant sont conservées dans le
+cache de l'application (voir `common/cache.py`), partagé par les workers de l'hôte.
 """
 
 from flask import Blueprint, request, jsonify, current_app
-from property_service.models import Property, create_property, list_properties,get_property, update_property ,delete_property
+from property_service.models import EntityValidationError, get_client, create_property, list_properties,get_property, update_property, patch_property ,delete_property
+from property_service.changes import wait_for_changes
+from property_service.schema import decode_property, decode_updates
+from property_service.ingestion import BufferFull, get_buffer
+from property_service.cascade import revoked_key
+from property_service.geo import crosses_antimeridian, search_radius, search_bbox
+from property_service.stats import facet_stats
+from property_service.fanout import search_properties
+from property_service.export import read_manifest, start_export
+from common.metrics import track
+from common.idempotency import idempotent
+from common.cache import get_cache, get_or_load
+import base64
+import datetime
+import hashlib
+import hmac
+import json
+import os
+import re
+import time
 import requests
 
 
@@ -21,82 +48,449 @@ import requests
 property_blueprint = Blueprint('property', __name__)
 
 
+class UserServiceUnavailable(Exception):
+    """Le user_service n'a pas pu valider le jeton (délestage ou panne) : la requête est
+    refusée avec 503, et non 401, pour que le client la réessaie.
+
+    Paramètres:
+        - retry_after (str): Valeur de l'en-tête `Retry-After` à transmettre.
+    """
+
+    def __init__(self, retry_after="1"):
+        super().__init__("user_service indisponible")
+        self.retry_after = retry_after
+
+
+@property_blueprint.errorhandler(UserServiceUnavailable)
+def user_service_unavailable(error):
+    return jsonify({"error": "Service saturé, réessayez plus tard."}), 503, {"Retry-After": error.retry_after}
+
+
+def validate_user_token(jwt_token):
+    """Valide un jeton JWT auprès du user_service.
+
+    Paramètres:
+        - jwt_token (str): Valeur de l'en-tête `Authorization` reçu.
+
+    Retourne:
+        - requests.Response: Réponse de l'endpoint `/users/validate`.
+    """
+    user_service_url = current_app.config['USER_SERVICE_URL']
+
+    with track("user_service", "validate"):
+        return requests.get(f"{user_service_url}/users/validate",headers={"Authorization": jwt_token})
+
+
+def _token_expiry(jwt_token):
+    # Expiration (`exp`) lue dans la charge utile du JWT, sans vérifier la signature : elle
+    # ne sert qu'à borner la mise en cache, la validation reste celle du user_service
+    try:
+        payload = jwt_token.split()[-1].split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def authenticated_user(jwt_token):
+    """Retourne l'utilisateur authentifié par un jeton JWT.
+
+    Les validations réussies sont conservées dans le cache, sous l'empreinte SHA-256 du
+    jeton, `VALIDATION_CACHE_TTL` secondes au plus et jamais au-delà de l'expiration du jeton :
+    les requêtes suivantes portant le même jeton n'appellent plus le user_service. Les jetons
+    d'un utilisateur supprimé (voir `cascade.revoke_user_validations`) sont revalidés.
+
+    Paramètres:
+        - jwt_token (str): Valeur de l'en-tête `Authorization` reçu.
+
+    Retourne:
+        - dict ou None: Utilisateur (`id`, `nom`, `prenom`...), ou None si le jeton est refusé.
+
+    Lève:
+        - UserServiceUnavailable: Si le user_service répond par une erreur 5xx (503 au client).
+    """
+    def validate():
+        response = validate_user_token(jwt_token)
+        if response.status_code >= 500:
+            raise UserServiceUnavailable(response.headers.get("Retry-After") or "1")
+        if response.status_code != 200 or not response.json().get("valid"):
+            return None
+        return response.json()["user"]
+
+    if not jwt_token:
+        return validate()
+    ttl = current_app.config['VALIDATION_CACHE_TTL']
+    expiry = _token_expiry(jwt_token)
+    if expiry is not None:
+        ttl = min(ttl, expiry - time.time())
+        if ttl <= 0:
+            return validate()
+
+    cache = get_cache(current_app)
+    key = "token:" + hashlib.sha256(jwt_token.encode()).hexdigest()
+    user = get_or_load(cache, key, validate, ttl=ttl)
+    if user is not None and cache.get(revoked_key(user["id"])) is not None:
+        # Utilisateur supprimé depuis la mise en cache : le user_service tranche
+        cache.delete(key)
+        return validate()
+    return user
+
+
+def _forget_property(property_id, *villes):
+    # Les autres workers de l'hôte partagent le cache : l'entrée est retirée pour tous.
+    # Les listes par ville sont propres au worker (les autres expirent après CITY_CACHE_TTL).
+    get_cache(current_app).delete(f"property:{property_id}")
+    for ville in villes:
+        current_app.extensions['listing_cache'].delete(f"city:{ville}")
+
+
+def authenticated_user_id():
+    """Identifiant de l'utilisateur authentifié par l'en-tête `Authorization`, ou None.
+
+    Délimite les clés d'idempotence (voir `common/idempotency.py`) ; la validation est
+    servie par le cache lors du second appel, dans la vue.
+    """
+    user = authenticated_user(request.headers.get('Authorization'))
+    return None if user is None else user["id"]
+
+
 @property_blueprint.route('/properties',methods=['POST'])
+@idempotent(scope=authenticated_user_id)
 def add_property():
     """ Crée une nouvelle propriété dans Datastore après validation de l'utilisateur.
     
     Étapes :
-        1. Valider l'utilisateur via user_service.
-        2. Vérifier que tous les champs obligatoires sont présents.
+        1. Valider le corps de la requête (champs obligatoires et types, voir `schema.py`).
+        2. Valider l'utilisateur via user_service.
         3. Enregistrer la propriété dans Datastore.
 
+    Une relance portant le même en-tête `Idempotency-Key` rejoue la réponse d'origine.
+
+    Si l'ingestion différée est activée (`WRITE_BEHIND`), une requête portant l'en-tête
+    `Prefer: respond-async` est acceptée dès sa mise en file (voir `ingestion.py`).
+
     Retourne:
         - 201: Propriété créée avec succès.
-        - 400: Champs requis manquants.
+        - 202: Propriété acceptée, écrite de manière différée (mode asynchrone).
+        - 400: Corps invalide (champ requis manquant, type incorrect), coordonnées invalides,
+          trop de pièces ou propriété trop volumineuse.
         - 401: Utilisateur non autorisé.
+        - 503: File d'écriture différée pleine (mode asynchrone).
     """
 
-    client = current_app.config['DATASTORE_CLIENT']
-    data = request.json
+    client = get_client()
+
+    # Un corps invalide est refusé avant l'appel au user_service
+    try:
+        property_data = decode_property(request.get_json(force=True, silent=True))
+    except EntityValidationError as error:
+        return jsonify({"error": str(error)}), 400
 
     # Transférer l'en-tête d'autorisation au user_service
     jwt_token = request.headers.get('Authorization')
-    user_service_url = current_app.config['USER_SERVICE_URL']
 
-    response = requests.get(f"{user_service_url}/users/validate",headers={"Authorization": jwt_token})
-    if response.status_code != 200 or not response.json().get("valid"):
+    user = authenticated_user(jwt_token)
+    if user is None:
         return jsonify({"error": "Non autorisé."}), 401
     
-    # Récupérer l'ID de l'utilisateur validé
-    proprietaire = response.json()["user"]["id"]
-
-
-    required_fields = ['nom','description','type_de_bien','ville']
-
-    for field in required_fields :
-        if field not in data :
-            return jsonify({"error": f"Champ requis manquant : {field}"}),400
-    
-    # Ajouter le propriétaire à la propriété
-    data['proprietaire'] = proprietaire
-
-    # Créer un objet Propriété
-    property_data = Property(
-        nom=data['nom'],
-        description=data['description'],
-        type_de_bien=data['type_de_bien'],
-        ville=data['ville'],
-        proprietaire=data['proprietaire'],
-        pieces=data.get('pieces', [])
-    )
+    # Ajouter le propriétaire validé à la propriété
+    property_data.proprietaire = user["id"]
+
+    # Mode asynchrone : identifiant réservé, écriture par lots en arrière-plan
+    if current_app.config['WRITE_BEHIND'] and 'respond-async' in request.headers.get('Prefer', ''):
+        try:
+            property_id = get_buffer(current_app).submit(property_data)
+        except EntityValidationError as error:
+            return jsonify({"error": str(error)}), 400
+        except BufferFull:
+            return jsonify({"error": "Service saturé, réessayez plus tard."}), 503, {"Retry-After": "1"}
+        return (jsonify({"id": property_id, "message": "Propriété acceptée, enregistrement en cours."}), 202,
+                {"Preference-Applied": "respond-async"})
 
     # Enregistrer dans Datastore
-    entity = create_property(client, property_data)
+    try:
+        entity = create_property(client, property_data)
+    except EntityValidationError as error:
+        return jsonify({"error": str(error)}), 400
+    _forget_property(entity.id, entity.get('ville'))
+    current_app.extensions['latest_feed'].record(entity)
     return jsonify({"id": entity.id, "message": "Propriété créée avec succès."}), 201
 
 
+def _multi_args(name):
+    # Valeurs d'un paramètre répété (?city=A&city=B) ou séparées par des virgules (?city=A,B)
+    values = []
+    for raw in request.args.getlist(name):
+        values.extend(value.strip() for value in raw.split(",") if value.strip())
+    return list(dict.fromkeys(values))
+
+
 @property_blueprint.route('/properties', methods=['GET'])
 def list_all_properties():
-    """Liste toutes les propriétés dans une ville spécifique.
+    """Liste les propriétés d'une ou plusieurs villes, éventuellement filtrées par type de bien.
 
-    Paramètre de requête:
-        - city: Nom de la ville pour filtrer les propriétés.
+    Une recherche sur plusieurs valeurs est exécutée en parallèle, une requête par couple
+    (ville, type de bien), et fusionnée dans l'ordre des identifiants (voir `fanout.py`).
+
+    Paramètres de requête:
+        - city: Ville(s) (paramètre répété ou valeurs séparées par des virgules).
+        - type_de_bien: Type(s) de bien (facultatif).
+        - limit: Taille de page (facultatif : toutes les propriétés, au plus 1000).
+        - cursor: Curseur de la page suivante, renvoyé dans l'en-tête `X-Next-Cursor`.
 
     Retourne:
         - 200: Liste des propriétés.
-        - 400: Si le paramètre de ville est manquant.
+        - 400: Si le paramètre de ville est manquant, si la recherche combine trop de
+          valeurs ou si le curseur est invalide.
     """
 
-    client = current_app.config['DATASTORE_CLIENT']
+    client = get_client()
+    villes = _multi_args('city')
+    types = _multi_args('type_de_bien')
+
+    if not villes:
+        return jsonify({"error": "Vous devez spécifier une ville pour filtrer les propriétés."}),400
+
+    max_streams = current_app.config['SEARCH_MAX_STREAMS']
+    if len(villes) * max(len(types), 1) > max_streams:
+        return jsonify({"error": f"Trop de combinaisons ville / type de bien (au plus {max_streams})."}), 400
+
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = min(max(limit, 1), 1000)
+    cursor = request.args.get('cursor')
+
+    listing_cache = current_app.extensions['listing_cache']
+    city_ttl = current_app.config['CITY_CACHE_TTL']
+
+    def load_city(ville):
+        # Les listes des villes consultées sont conservées CITY_CACHE_TTL secondes (voir warmup.py)
+        return get_or_load(listing_cache, f"city:{ville}", lambda: list_properties(client, {'ville': ville}), ttl=city_ttl)
+
+    for ville in villes:
+        current_app.extensions['access_stats'].record(client, "ville", ville)
+
+    # Cas courant : une seule ville, sans pagination
+    if len(villes) == 1 and not types and limit is None and cursor is None:
+        return jsonify(load_city(villes[0])), 200
+
+    try:
+        properties, next_cursor = search_properties(
+            client, villes, types, limit=limit, cursor=cursor, load_city=load_city,
+            max_workers=current_app.config['SEARCH_WORKERS'])
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+
+    # Les entités sont sérialisées directement (avec leur id) par le fournisseur JSON
+    return jsonify(properties), 200, ({"X-Next-Cursor": next_cursor} if next_cursor else {})
+
+
+@property_blueprint.route('/properties/stats', methods=['GET'])
+def get_property_stats():
+    """Retourne le nombre de propriétés par ville et par type de bien.
+
+    Les chiffres sont conservés `STATS_CACHE_TTL` secondes dans le cache : les fragments des
+    compteurs ne sont pas relus à chaque requête.
+
+    Paramètre de requête:
+        - city: Ville (facultatif : toutes les villes).
+
+    Retourne:
+        - 200: Total et nombre par type de bien, pour la ville ou pour chaque ville.
+    """
     ville = request.args.get('city')
+    client = get_client()
+    key = "stats:*" if ville is None else f"stats:ville={ville}"
+    stats = get_or_load(get_cache(current_app), key, lambda: facet_stats(client, ville),
+                        ttl=current_app.config['STATS_CACHE_TTL'])
+    return jsonify(stats), 200
+
+
+@property_blueprint.route('/properties/latest', methods=['GET'])
+def list_latest_properties():
+    """Liste les dernières propriétés publiées dans une ville (voir `latest.py`).
 
+    Paramètres de requête:
+        - city: Nom de la ville.
+        - limit: Nombre de propriétés (au plus `LATEST_FEED_SIZE`, valeur par défaut).
+
+    Retourne:
+        - 200: Propriétés par date de création décroissante.
+        - 400: Si le paramètre de ville est manquant.
+    """
+    ville = request.args.get('city')
     if not ville:
-        return jsonify({"error": "Vous devez spécifier une ville pour filtrer les propriétés."}),400
-    
-    filters = {'ville': ville}
+        return jsonify({"error": "Vous devez spécifier une ville."}), 400
+
+    limit = max(request.args.get('limit', 0, type=int), 0)
+    return jsonify(current_app.extensions['latest_feed'].latest(get_client(), ville, limit)), 200
+
+
+def _float_args(*names):
+    # Retourne les paramètres de requête convertis en float, ou None si l'un manque ou est invalide
+    values = [request.args.get(name, type=float) for name in names]
+    return None if None in values else values
+
+
+def _geo_limit():
+    # Nombre de résultats d'une recherche géographique, entre 1 et GEO_MAX_RESULTS
+    max_results = current_app.config['GEO_MAX_RESULTS']
+    return min(max(request.args.get('limit', max_results, type=int), 1), max_results)
+
+
+def _truncation_headers(truncated):
+    return {"X-Results-Truncated": "true"} if truncated else {}
 
-    properties = list_properties(client, filters)
-    return jsonify([{**dict(property), "id": property.key.id} for property in properties]), 200
+
+@property_blueprint.route('/properties/near', methods=['GET'])
+def list_properties_near():
+    """Liste les propriétés situées à moins d'une distance donnée d'un point.
+
+    Paramètres de requête:
+        - lat, lon: Coordonnées du point, en degrés.
+        - radius: Rayon en mètres (au plus `GEO_MAX_RADIUS_M`).
+        - limit: Nombre maximal de propriétés (`GEO_MAX_RESULTS` par défaut et au plus).
+
+    Retourne:
+        - 200: Propriétés triées par distance croissante (champ `distance`, en mètres) ; en-tête
+          `X-Results-Truncated: true` si la lecture a atteint `GEO_MAX_SCANNED` entités.
+        - 400: Paramètres manquants ou invalides.
+    """
+    values = _float_args('lat', 'lon', 'radius')
+    if values is None:
+        return jsonify({"error": "Les paramètres lat, lon et radius sont obligatoires."}), 400
+
+    latitude, longitude, radius = values
+    max_radius = current_app.config['GEO_MAX_RADIUS_M']
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180) or not 0 < radius <= max_radius:
+        return jsonify({"error": f"Coordonnées hors limites ou rayon non compris entre 0 et {max_radius:g} mètres."}), 400
+    if crosses_antimeridian(latitude, longitude, radius):
+        return jsonify({"error": "Les cercles qui traversent l'antiméridien (longitude ±180) ne sont pas pris en charge."}), 400
+
+    results, truncated = search_radius(get_client(), latitude, longitude, radius, limit=_geo_limit(),
+                                       max_scanned=current_app.config['GEO_MAX_SCANNED'])
+    return jsonify(results), 200, _truncation_headers(truncated)
+
+
+@property_blueprint.route('/properties/within', methods=['GET'])
+def list_properties_within():
+    """Liste les propriétés situées dans un rectangle.
+
+    Paramètres de requête:
+        - south, west, north, east: Limites du rectangle, en degrés.
+        - limit: Nombre maximal de propriétés (`GEO_MAX_RESULTS` par défaut et au plus).
+
+    Retourne:
+        - 200: Propriétés du rectangle ; en-tête `X-Results-Truncated: true` si la lecture a
+          atteint `GEO_MAX_SCANNED` entités.
+        - 400: Paramètres manquants ou invalides.
+    """
+    values = _float_args('south', 'west', 'north', 'east')
+    if values is None:
+        return jsonify({"error": "Les paramètres south, west, north et east sont obligatoires."}), 400
+
+    south, west, north, east = values
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+        return jsonify({"error": "Rectangle invalide."}), 400
+    if west > east:
+        return jsonify({"error": "Les rectangles qui traversent l'antiméridien (west > east) ne sont pas pris en "
+                                 "charge : découpez-les en deux requêtes."}), 400
+
+    results, truncated = search_bbox(get_client(), south, west, north, east, limit=_geo_limit(),
+                                     max_scanned=current_app.config['GEO_MAX_SCANNED'])
+    return jsonify(results), 200, _truncation_headers(truncated)
+
+
+@property_blueprint.route('/properties/changes', methods=['GET'])
+def list_property_changes():
+    """Liste les modifications de propriétés postérieures à un curseur.
+
+    Paramètres de requête:
+        - since: Curseur retourné par l'appel précédent (facultatif : depuis le début).
+        - limit: Nombre maximal de modifications (100 par défaut, entre 1 et 1000).
+        - wait: Durée maximale d'attente en secondes si aucune modification n'est disponible (long-poll).
+
+    Retourne:
+        - 200: Modifications et curseur suivant.
+        - 400: Si le curseur est invalide.
+    """
+    client = get_client()
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    wait = min(max(request.args.get('wait', 0, type=float), 0), current_app.config['CHANGE_FEED_MAX_WAIT'])
+
+    try:
+        changes, cursor = wait_for_changes(
+            client, request.args.get('since'), limit, timeout=wait, lag=current_app.config['CHANGE_FEED_LAG'],
+            readback=current_app.config['CHANGE_FEED_READBACK'])
+    except ValueError:
+        return jsonify({"error": "Curseur invalide."}), 400
+
+    return jsonify({"changes": changes, "cursor": cursor}), 200
+
+
+def _service_authorized():
+    """Vérifie le jeton de service de la requête (refusé si `SERVICE_TOKEN` n'est pas défini)."""
+    expected = current_app.config.get('SERVICE_TOKEN')
+    provided = request.headers.get('X-Service-Token')
+    return bool(expected and provided and hmac.compare_digest(provided, expected))
+
+
+# Nom d'un export : sous-répertoire de EXPORT_DIR (ex. "2024-06-01")
+_EXPORT_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+
+@property_blueprint.route('/properties/exports', methods=['POST'])
+def create_export():
+    """Lance, ou reprend s'il a été interrompu, un export Parquet de toutes les propriétés.
+
+    Requires:
+        En-tête `X-Service-Token`.
+
+    Corps JSON (facultatif):
+        - nom: Nom de l'export (date du jour par défaut).
+
+    Retourne:
+        - 202: Export lancé ou déjà en cours, et état de ses partitions.
+        - 400: Si le nom est invalide.
+        - 403: Jeton de service absent ou invalide.
+        - 501: Si `pyarrow` n'est pas installé.
+    """
+    if not _service_authorized():
+        return jsonify({"error": "Accès refusé."}), 403
+
+    body = request.get_json(silent=True) or {}
+    name = body.get('nom') or datetime.date.today().isoformat()
+    if not isinstance(name, str) or not _EXPORT_NAME.match(name):
+        return jsonify({"error": "Nom d'export invalide."}), 400
+
+    output_dir = os.path.join(current_app.config['EXPORT_DIR'], name)
+    try:
+        start_export(current_app._get_current_object(), output_dir)
+    except RuntimeError as error:
+        return jsonify({"error": str(error)}), 501
+    # Le manifeste est absent tant que les partitions ne sont pas planifiées
+    return jsonify({"nom": name, "manifeste": read_manifest(output_dir)}), 202
+
+
+@property_blueprint.route('/properties/exports/<name>', methods=['GET'])
+def get_export(name):
+    """Retourne l'état d'un export (partitions terminées, nombre de lignes).
+
+    Requires:
+        En-tête `X-Service-Token`.
+
+    Retourne:
+        - 200: Manifeste de l'export.
+        - 403: Jeton de service absent ou invalide.
+        - 404: Export inconnu ou pas encore planifié.
+    """
+    if not _service_authorized():
+        return jsonify({"error": "Accès refusé."}), 403
+
+    manifest = read_manifest(os.path.join(current_app.config['EXPORT_DIR'], name)) if _EXPORT_NAME.match(name) else None
+    if manifest is None:
+        return jsonify({"error": "Export introuvable."}), 404
+    return jsonify({"nom": name, "manifeste": manifest}), 200
 
 
 @property_blueprint.route('/properties/<int:property_id>', methods =['GET'])
@@ -110,16 +504,17 @@ def get_property_by_id(property_id):
         - 200: Détails de la propriété.
         - 404: Si la propriété n'existe pas.
     """
-    client = current_app.config['DATASTORE_CLIENT']
-    property_entity = get_property(client, property_id)
+    client = get_client()
+    property_entity = get_or_load(get_cache(current_app), f"property:{property_id}",
+                                  lambda: get_property(client, property_id),
+                                  ttl=current_app.config['PROPERTY_CACHE_TTL'])
 
     if not property_entity:
         return jsonify({"error": "Propriété non trouvée."}), 404
+    current_app.extensions['access_stats'].record(client, "propriete", property_id)
 
-    # Ajouter l'ID de la propriété au résultat
-    property_data = dict(property_entity)
-    property_data["id"] = property_entity.key.id
-    return jsonify(property_data), 200
+    # L'ID de la propriété est ajouté au résultat par le fournisseur JSON
+    return jsonify(property_entity), 200
 
 
 @property_blueprint.route('/properties/<int:property_id>', methods=['PUT'])
@@ -131,18 +526,23 @@ def update_property_details(property_id):
 
     Retourne:
         - 200: Propriété mise à jour.
+        - 400: Corps invalide, champ non modifiable, trop de pièces ou propriété trop volumineuse.
         - 403: Si l'utilisateur n'est pas le propriétaire.
         - 404: Si la propriété n'existe pas.
     """
-    client = current_app.config['DATASTORE_CLIENT']
-    data = request.json
+    client = get_client()
+
+    # Un corps invalide est refusé avant l'appel au user_service
+    try:
+        data = decode_updates(request.get_json(force=True, silent=True))
+    except EntityValidationError as error:
+        return jsonify({"error": str(error)}), 400
 
     # Transférer l'en-tête d'autorisation au user_service
     jwt_token = request.headers.get('Authorization')
-    user_service_url = current_app.config['USER_SERVICE_URL']
 
-    response = requests.get(f"{user_service_url}/users/validate",headers={"Authorization": jwt_token})
-    if response.status_code != 200 or not response.json().get("valid"):
+    user = authenticated_user(jwt_token)
+    if user is None:
         return jsonify({"error": "Non autorisé."}), 401
   
 
@@ -150,19 +550,80 @@ def update_property_details(property_id):
     if not property_entity:
         return jsonify({"error": "Propriété non trouvée."}), 404
     
-    proprietaire = response.json()["user"]["id"]
+    proprietaire = user["id"]
 
     # Valider la propriété
     if property_entity.get('proprietaire') != proprietaire:
         return jsonify({"error": "Vous n'êtes pas autorisé à mettre à jour cette propriété."}), 403
 
 
-    update_property(client, property_id, data)
+    ville_avant = property_entity.get('ville')
+    try:
+        property_entity = update_property(client, property_id, data)
+    except EntityValidationError as error:
+        return jsonify({"error": str(error)}), 400
+    if not property_entity:
+        return jsonify({"error": "Propriété non trouvée."}), 404
+    _forget_property(property_id, ville_avant, property_entity.get('ville'))
+    current_app.extensions['latest_feed'].record(property_entity)
 
 
     return jsonify({"message": "Propriété mise à jour avec succès."}), 200
 
 
+@property_blueprint.route('/properties/<int:property_id>', methods=['PATCH'])
+def patch_property_details(property_id):
+    """Modifie partiellement une propriété (JSON merge patch, RFC 7386) après validation de l'utilisateur.
+
+    Seuls les champs de `Property.MUTABLE_FIELDS` sont acceptés ; une valeur `null` supprime
+    un champ facultatif. Si le patch ne change rien, aucune écriture n'a lieu.
+
+    Paramètres:
+        - property_id: Identifiant de la propriété.
+
+    Retourne:
+        - 200: Propriété mise à jour, avec la liste des champs effectivement modifiés.
+        - 400: Patch invalide, champ non modifiable ou limites d'écriture dépassées.
+        - 401: Utilisateur non autorisé.
+        - 403: Si l'utilisateur n'est pas le propriétaire.
+        - 404: Si la propriété n'existe pas.
+    """
+    client = get_client()
+
+    # Champs modifiables, types et suppressions autorisées (voir schema.py)
+    try:
+        patch = decode_updates(request.get_json(force=True, silent=True))
+    except EntityValidationError as error:
+        return jsonify({"error": str(error)}), 400
+
+    # Transférer l'en-tête d'autorisation au user_service
+    jwt_token = request.headers.get('Authorization')
+
+    user = authenticated_user(jwt_token)
+    if user is None:
+        return jsonify({"error": "Non autorisé."}), 401
+
+    property_entity = get_property(client, property_id)
+    if not property_entity:
+        return jsonify({"error": "Propriété non trouvée."}), 404
+
+    # Valider la propriété
+    if property_entity.get('proprietaire') != user["id"]:
+        return jsonify({"error": "Vous n'êtes pas autorisé à mettre à jour cette propriété."}), 403
+
+    ville_avant = property_entity.get('ville')
+    try:
+        champs_modifies = patch_property(client, property_entity, patch)
+    except EntityValidationError as error:
+        return jsonify({"error": str(error)}), 400
+    if champs_modifies:
+        _forget_property(property_id, ville_avant, property_entity.get('ville'))
+        current_app.extensions['latest_feed'].record(property_entity)
+
+    message = "Propriété mise à jour avec succès." if champs_modifies else "Aucune modification."
+    return jsonify({"message": message, "champs_modifies": champs_modifies}), 200
+
+
 @property_blueprint.route('/properties/<int:property_id>', methods=['DELETE'])
 def delete_property_details(property_id):
     """Supprime une propriété après validation de l'utilisateur.
@@ -175,14 +636,13 @@ def delete_property_details(property_id):
         - 403: Si l'utilisateur n'est pas le propriétaire.
         - 404: Si la propriété n'existe pas.
     """
-    client = current_app.config['DATASTORE_CLIENT']
+    client = get_client()
 
     # Transférer l'en-tête d'autorisation au user_service
     jwt_token = request.headers.get('Authorization')
-    user_service_url = current_app.config['USER_SERVICE_URL']
 
-    response = requests.get(f"{user_service_url}/users/validate",headers={"Authorization": jwt_token})
-    if response.status_code != 200 or not response.json().get("valid"):
+    user = authenticated_user(jwt_token)
+    if user is None:
         return jsonify({"error": "Non autorisé."}), 401
   
 
@@ -190,12 +650,14 @@ def delete_property_details(property_id):
     if not property_entity:
         return jsonify({"error": "Propriété non trouvée."}), 404
     
-    proprietaire = response.json()["user"]["id"]
+    proprietaire = user["id"]
 
     # Valider la propriété
     if property_entity.get('proprietaire') != proprietaire:
         return jsonify({"error": "Vous n'êtes pas autorisé à supprimer cette propriété."}), 403
 
-    delete_property(client, property_id)
+    delete_property(client, property_id, property_entity)
+    _forget_property(property_id, property_entity.get('ville'))
+    current_app.extensions['latest_feed'].forget(property_id)
 
     return jsonify({"message": "Propriété supprimée avec succès."}), 200
@@ -1,5 +1,41 @@
-from property_service.app import app
+import argparse
+import os
+
+from property_service.app import create_app
+from property_service.cascade import start_cascade_worker
+from property_service.ingestion import start_spill_replay
+from property_service.latest import start_latest_sync
+from property_service.warmup import start_warmup
+from common.server import add_server_arguments, serve_production
+
+
+def start_worker(app):
+    """Tâches de démarrage d'un worker : rejeu des débordements, lecture du journal des
+    modifications et préchauffage des caches."""
+    start_spill_replay(app)
+    start_latest_sync(app)
+    start_warmup(app)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Service propriété.")
+    add_server_arguments(parser, default_port=5001)
+    args = parser.parse_args(argv)
+
+    app = create_app()
+    if args.production:
+        # Le client Datastore est créé paresseusement dans chaque worker (voir models.get_client).
+        # La file d'événements est consommée par un processus dédié : flask cascade-worker
+        # Chaque worker rejoue les débordements, suit le journal et préchauffe ses caches après le fork
+        serve_production(app, args.host, args.port, args.workers, args.threads, post_fork=start_worker)
+    else:
+        # Avec le rechargeur de Werkzeug, seul le processus enfant sert l'application
+        if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+            start_worker(app)
+            if app.config['CASCADE_WORKER']:
+                start_cascade_worker(app)
+        app.run(debug=True, host=args.host, port=args.port)
 
 
 if __name__ == "__main__":
-    app.run(debug=True,port=app.config['PORT'])
+    main()
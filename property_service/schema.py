@@ -0,0 +1,170 @@
+"""
+Validation et décodage des corps de requête des propriétés.
+
+Les décodeurs sont construits une seule fois, à l'import, à partir des annotations des
+dataclasses `Property` et `Piece` : chaque champ reçoit une fonction de vérification
+spécialisée pour son type, et le décodage d'une requête se limite à parcourir cette
+table puis à instancier la dataclass. Un corps invalide est refusé avant tout appel au
+user_service ou à Datastore.
+
+Contenu:
+- `decode_property` : corps de `POST /properties` vers un objet `Property`.
+- `decode_updates` : corps de `PUT` / `PATCH /properties/<id>`, limité aux champs modifiables.
+
+Règles :
+- Les chaînes, nombres (entiers ou flottants, booléens exclus) et listes sont vérifiés
+  sans conversion implicite, sauf pour les champs marqués `coerce` (ex. `Piece.etage`, qui
+  accepte aussi un entier, converti en chaîne).
+- Les champs inconnus d'une propriété sont ignorés à la création ; ceux d'une pièce sont
+  conservés (`Piece.extras`), comme lorsque les pièces n'étaient pas décrites.
+"""
+
+import dataclasses
+import types
+import typing
+
+from property_service.models import Property, Piece, EntityValidationError
+
+
+class SchemaError(EntityValidationError):
+    """Levée lorsqu'un corps de requête ne respecte pas le schéma attendu."""
+
+
+_MISSING = object()
+
+
+def _check_str(value, path):
+    if type(value) is not str:
+        raise SchemaError(f"Type invalide pour {path} : chaîne attendue.")
+    return value
+
+
+def _coerce_str(value, path):
+    if type(value) is int:
+        return str(value)
+    return _check_str(value, path)
+
+
+def _check_number(value, path):
+    if type(value) is not int and type(value) is not float:
+        raise SchemaError(f"Type invalide pour {path} : nombre attendu.")
+    return value
+
+
+def _check_int(value, path):
+    if type(value) is not int:
+        raise SchemaError(f"Type invalide pour {path} : entier attendu.")
+    return value
+
+
+def _list_checker(item_check):
+    def check(value, path):
+        if type(value) is not list:
+            raise SchemaError(f"Type invalide pour {path} : liste attendue.")
+        return [item_check(item, f"{path}[{index}]") for index, item in enumerate(value)]
+    return check
+
+
+def _checker(annotation):
+    # Fonction de vérification d'une annotation (les annotations `X | None` se réduisent à X)
+    if isinstance(annotation, types.UnionType) or typing.get_origin(annotation) is typing.Union:
+        annotation = next(arg for arg in typing.get_args(annotation) if arg is not type(None))
+    if typing.get_origin(annotation) is list:
+        return _list_checker(_checker(typing.get_args(annotation)[0]))
+    if dataclasses.is_dataclass(annotation):
+        return _compile(annotation)
+    return {str: _check_str, float: _check_number, int: _check_int}[annotation]
+
+
+def _compile(cls, exclude=()):
+    """Construit le décodeur d'une dataclass à partir de ses annotations.
+
+    Les champs inconnus sont ignorés, ou rangés dans le champ marqué `extras` s'il existe.
+    """
+    hints = typing.get_type_hints(cls)
+    fields = [spec for spec in dataclasses.fields(cls) if spec.name not in exclude]
+    extras_field = next((spec.name for spec in fields if spec.metadata.get("extras")), None)
+    specs = tuple(
+        (spec.name, _coerce_str if spec.metadata.get("coerce") else _checker(hints[spec.name]),
+         spec.default is dataclasses.MISSING and spec.default_factory is dataclasses.MISSING)
+        for spec in fields if spec.name != extras_field
+    )
+    known = frozenset(name for name, _, _ in specs)
+
+    def decode(data, path=None, **extra):
+        if type(data) is not dict:
+            raise SchemaError(f"Type invalide pour {path} : objet attendu." if path else "Le corps de la requête doit être un objet JSON.")
+        values = extra
+        if extras_field is not None and not known.issuperset(data):
+            values[extras_field] = {name: value for name, value in data.items() if name not in known}
+        for name, check, required in specs:
+            value = data.get(name, _MISSING)
+            field_path = f"{path}.{name}" if path else name
+            if value is _MISSING or value is None:
+                if required:
+                    raise SchemaError(f"Champ requis manquant : {field_path}")
+                continue
+            values[name] = check(value, field_path)
+        return cls(**values)
+
+    return decode
+
+
+# Décodeurs construits à l'import ; le propriétaire provient du jeton, jamais du corps
+_decode_property = _compile(Property, exclude=('proprietaire',))
+_FIELD_CHECKS = {
+    name: _checker(hint) for name, hint in typing.get_type_hints(Property).items() if name in Property.MUTABLE_FIELDS
+}
+
+
+def decode_property(data, proprietaire=None):
+    """Valide le corps d'une création et construit l'objet `Property`.
+
+    Paramètres:
+        - data (dict): Corps JSON de la requête.
+        - proprietaire (int): Identifiant du propriétaire authentifié (peut être renseigné
+          plus tard, après validation du jeton).
+
+    Retourne:
+        - Property: La propriété à créer.
+
+    Lève:
+        - SchemaError: Corps invalide (champ requis manquant, type incorrect...).
+    """
+    return _decode_property(data, proprietaire=proprietaire)
+
+
+def decode_updates(data):
+    """Valide le corps d'une mise à jour (PUT ou PATCH).
+
+    Seuls les champs de `Property.MUTABLE_FIELDS` sont acceptés ; la valeur `null` n'est
+    acceptée que pour les champs de `Property.OPTIONAL_FIELDS` (suppression du champ).
+
+    Paramètres:
+        - data (dict): Corps JSON de la requête.
+
+    Retourne:
+        - dict: Champs à mettre à jour, les pièces étant converties en dictionnaires.
+
+    Lève:
+        - SchemaError: Corps invalide, champ non modifiable ou suppression d'un champ obligatoire.
+    """
+    if type(data) is not dict:
+        raise SchemaError("Le corps de la requête doit être un objet JSON.")
+
+    non_modifiables = sorted(set(data) - _FIELD_CHECKS.keys())
+    if non_modifiables:
+        raise SchemaError(f"Champs non modifiables : {', '.join(non_modifiables)}")
+
+    updates = {}
+    for name, value in data.items():
+        if value is None:
+            if name not in Property.OPTIONAL_FIELDS:
+                raise SchemaError(f"Champs obligatoires ne pouvant être supprimés : {name}")
+            updates[name] = None
+            continue
+        updates[name] = _FIELD_CHECKS[name](value, name)
+
+    if updates.get('pieces'):
+        updates['pieces'] = [piece.to_dict() for piece in updates['pieces']]
+    return updates
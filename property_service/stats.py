@@ -0,0 +1,261 @@
+"""
+Compteurs de propriétés par ville et par type de bien (facettes de recherche).
+
+Le nombre de propriétés de chaque couple (ville, type_de_bien) est maintenu dans des
+entités `CompteurFacette`. Chaque couple est réparti sur `SHARDS` fragments : une écriture
+incrémente un fragment tiré au hasard, ce qui évite la contention sur une même entité
+lorsque de nombreuses propriétés d'une même ville sont créées en même temps. La lecture
+additionne les fragments.
+
+Contenu:
+- `facet_deltas` : variations de compteurs entraînées par une écriture.
+- `increment_facets` : applique des variations dans une transaction.
+- `facet_stats` : statistiques d'une ville ou de toutes les villes, avec repli sur des
+  requêtes d'agrégation (count) tant qu'aucune réconciliation n'a eu lieu.
+- `reconcile_stats` : recalcule les compteurs à partir des propriétés, corrige les écarts et
+  enregistre la référence à partir de laquelle les compteurs font foi.
+
+Les propriétés antérieures aux compteurs n'y figurent pas : leur suppression ferait passer
+un compteur sous zéro. Les compteurs ne sont donc lus qu'une fois la référence enregistrée
+par `reconcile_stats`, et un total négatif (écart transitoire) est ramené à zéro.
+
+Les compteurs sont mis à jour après l'écriture de la propriété, hors de sa transaction :
+un échec (conflits répétés ou erreur Datastore) est journalisé et compté par la métrique
+`facet_counter_failures_total{reason}` sans faire échouer la requête. L'écart est corrigé
+par `reconcile_stats` (commande `flask reconcile-stats`), à planifier (cron, ex. chaque
+nuit) et à lancer dès que la métrique augmente.
+
+Les requêtes de projection utilisées ici nécessitent les index composites déclarés dans
+`property_service/index.yaml`.
+"""
+
+import datetime
+import json
+import logging
+import random
+
+from google.api_core import exceptions as api_exceptions
+from google.cloud import datastore
+
+from common.metrics import Counter, track
+
+
+logger = logging.getLogger(__name__)
+
+KIND = 'CompteurFacette'
+
+# Entité unique enregistrée par `reconcile_stats` : les compteurs font foi à partir de là
+BASELINE_KIND = 'CompteurFacetteReference'
+BASELINE_NAME = 'reference'
+
+# Nombre de fragments par couple (ville, type_de_bien)
+SHARDS = 20
+
+_CONFLICTS = (api_exceptions.Aborted, api_exceptions.Conflict)
+
+FACET_COUNTER_FAILURES = Counter(
+    "facet_counter_failures_total",
+    "Mises à jour des compteurs de facettes abandonnées (écart à corriger par reconcile-stats).", ("reason",))
+
+
+def facet_deltas(before=None, after=None):
+    """Calcule les variations de compteurs entraînées par une écriture.
+
+    Paramètres:
+        - before (tuple): Couple (ville, type_de_bien) avant l'écriture (None pour une création).
+        - after (tuple): Couple après l'écriture (None pour une suppression).
+
+    Retourne:
+        - dict: Variation par couple (vide si le couple ne change pas).
+    """
+    if before == after:
+        return {}
+    deltas = {}
+    if before is not None:
+        deltas[before] = -1
+    if after is not None:
+        deltas[after] = 1
+    return deltas
+
+
+def facet_of(entity):
+    """Retourne le couple (ville, type_de_bien) d'une propriété."""
+    return entity.get('ville'), entity.get('type_de_bien')
+
+
+def _shard_key(client, ville, type_de_bien, shard):
+    return client.key(KIND, json.dumps([ville, type_de_bien, shard], ensure_ascii=False))
+
+
+def increment_facets(client, deltas, max_retries=3):
+    """Applique des variations aux compteurs, chacune sur un fragment tiré au hasard.
+
+    Un échec est journalisé et compté (`facet_counter_failures_total`) sans être propagé :
+    l'écart est corrigé par `reconcile_stats`.
+
+    Paramètres:
+        - client (datastore.Client): Client Google Datastore.
+        - deltas (dict): Variation par couple (ville, type_de_bien).
+        - max_retries (int): Nombre de tentatives en cas de conflit de transaction.
+    """
+    deltas = {pair: delta for pair, delta in deltas.items() if delta and pair[0] is not None}
+    if not deltas:
+        return
+
+    for attempt in range(max_retries):
+        keys = {pair: _shard_key(client, *pair, random.randrange(SHARDS)) for pair in deltas}
+        try:
+            with track("datastore", "transaction"):
+                with client.transaction():
+                    existing = {entity.key.name: entity for entity in client.get_multi(list(keys.values()))}
+                    shards = []
+                    for (ville, type_de_bien), key in keys.items():
+                        shard = existing.get(key.name)
+                        if shard is None:
+                            shard = datastore.Entity(key=key, exclude_from_indexes=('type_de_bien', 'total'))
+                            shard.update({"ville": ville, "type_de_bien": type_de_bien, "total": 0})
+                        shard["total"] += deltas[(ville, type_de_bien)]
+                        shards.append(shard)
+                    client.put_multi(shards)
+            return
+        except _CONFLICTS:
+            if attempt == max_retries - 1:
+                FACET_COUNTER_FAILURES.inc("conflict")
+                logger.exception("Compteurs de facettes non mis à jour après %d conflits (lancer "
+                                 "flask reconcile-stats) : %s", max_retries, deltas)
+        except Exception:
+            FACET_COUNTER_FAILURES.inc("error")
+            logger.exception("Compteurs de facettes non mis à jour (lancer flask reconcile-stats) : %s", deltas)
+            return
+
+
+def read_counters(client, ville=None):
+    """Additionne les fragments des compteurs.
+
+    Paramètres:
+        - client (datastore.Client): Client Google Datastore.
+        - ville (str): Ville (None pour toutes les villes).
+
+    Retourne:
+        - dict: Nombre de propriétés par couple (ville, type_de_bien).
+    """
+    query = client.query(kind=KIND)
+    if ville is not None:
+        query.add_filter('ville', '=', ville)
+
+    counts = {}
+    with track("datastore", "query"):
+        for shard in query.fetch():
+            pair = (shard['ville'], shard['type_de_bien'])
+            counts[pair] = counts.get(pair, 0) + shard['total']
+    return counts
+
+
+def _aggregate_count(client, filters):
+    query = client.query(kind='Property')
+    for field, value in filters.items():
+        query.add_filter(field, '=', value)
+    with track("datastore", "aggregation"):
+        return sum(result.value for batch in client.aggregation_query(query).count(alias="total").fetch() for result in batch)
+
+
+def count_facets(client, ville=None):
+    """Compte les propriétés par couple (ville, type_de_bien) directement dans Datastore.
+
+    Les couples existants sont listés par une requête de projection `distinct_on`, puis
+    chaque couple est compté par une requête d'agrégation (sans lire les entités).
+
+    Paramètres:
+        - client (datastore.Client): Client Google Datastore.
+        - ville (str): Ville (None pour toutes les villes).
+
+    Retourne:
+        - dict: Nombre de propriétés par couple (ville, type_de_bien).
+    """
+    fields = ['ville', 'type_de_bien']
+    query = client.query(kind='Property', projection=fields, distinct_on=fields)
+    if ville is not None:
+        query.add_filter('ville', '=', ville)
+    with track("datastore", "query"):
+        pairs = [facet_of(entity) for entity in query.fetch()]
+
+    return {
+        (pair_ville, type_de_bien): _aggregate_count(client, {"ville": pair_ville, "type_de_bien": type_de_bien})
+        for pair_ville, type_de_bien in pairs
+    }
+
+
+def _summarize(counts):
+    summary = {"total": 0, "types": {}}
+    for (_, type_de_bien), total in counts.items():
+        if total > 0:
+            summary["total"] += total
+            summary["types"][type_de_bien] = total
+    return summary
+
+
+def facet_stats(client, ville=None):
+    """Retourne les statistiques de propriétés d'une ville ou de toutes les villes.
+
+    Les compteurs maintenus sont utilisés une fois la référence enregistrée par
+    `reconcile_stats` ; avant cela (données antérieures aux compteurs), ou s'il n'en existe
+    aucun, les propriétés sont comptées par des requêtes d'agrégation.
+
+    Paramètres:
+        - client (datastore.Client): Client Google Datastore.
+        - ville (str): Ville (None pour toutes les villes).
+
+    Retourne:
+        - dict: Total et nombre par type de bien (par ville si `ville` est None), et
+          source des chiffres ("compteurs" ou "agregation").
+    """
+    with track("datastore", "get"):
+        baseline = client.get(client.key(BASELINE_KIND, BASELINE_NAME))
+    counts = read_counters(client, ville) if baseline is not None else {}
+    source = "compteurs"
+    if not counts:
+        counts = count_facets(client, ville)
+        source = "agregation"
+
+    if ville is not None:
+        return {"ville": ville, **_summarize(counts), "source": source}
+
+    by_city = {}
+    for (pair_ville, type_de_bien), total in counts.items():
+        by_city.setdefault(pair_ville, {})[(pair_ville, type_de_bien)] = total
+    villes = {name: _summarize(city_counts) for name, city_counts in sorted(by_city.items())}
+    return {
+        "total": sum(summary["total"] for summary in villes.values()),
+        "villes": {name: summary for name, summary in villes.items() if summary["total"]},
+        "source": source,
+    }
+
+
+def reconcile_stats(client):
+    """Recalcule les compteurs à partir des propriétés et corrige les écarts.
+
+    Enregistre ensuite la référence qui autorise `facet_stats` à lire les compteurs. Les
+    écritures concurrentes pendant la réconciliation peuvent laisser un écart
+    transitoire, corrigé au passage suivant.
+
+    Paramètres:
+        - client (datastore.Client): Client Google Datastore.
+
+    Retourne:
+        - dict: Corrections appliquées par couple (ville, type_de_bien).
+    """
+    actual = count_facets(client)
+    stored = read_counters(client)
+    corrections = {
+        pair: actual.get(pair, 0) - stored.get(pair, 0)
+        for pair in set(actual) | set(stored)
+        if actual.get(pair, 0) != stored.get(pair, 0)
+    }
+    for pair, delta in corrections.items():
+        increment_facets(client, {pair: delta})
+
+    baseline = datastore.Entity(key=client.key(BASELINE_KIND, BASELINE_NAME))
+    baseline["reconcilie_le"] = datetime.datetime.now(datetime.timezone.utc)
+    with track("datastore", "put"):
+        client.put(baseline)
+    return corrections
@@ -0,0 +1,252 @@
+"""
+Préchauffage des caches de lecture au démarrage de chaque worker.
+
+Après un déploiement, les caches sont vides et les premières requêtes interrogent toutes
+Datastore. Chaque worker charge donc, avant de se déclarer en bonne santé, les listes des
+villes les plus consultées et les propriétés les plus lues :
+- villes configurées (`WARMUP_CITIES`) et `WARMUP_TOP_CITIES` villes apprises ;
+- `WARMUP_TOP_PROPERTIES` propriétés apprises, lues par lots `get_multi`.
+Les lectures sont parallèles, avec au plus `WARMUP_CONCURRENCY` requêtes simultanées.
+Les propriétés préchauffées sont conservées `WARMUP_CACHE_TTL` secondes, plus longtemps
+que celles chargées à la demande (`PROPERTY_CACHE_TTL`) : elles doivent encore être
+présentes quand le répartiteur de charge envoie le trafic, et une propriété modifiée est
+retirée du cache partagé par tous les workers. Les listes par ville, propres au worker et
+que les écritures des autres workers n'invalident pas, gardent `CITY_CACHE_TTL`.
+Pendant le préchauffage, la route de santé `/` répond 503 `{"status": "warming"}` ; au-delà
+de `WARMUP_TIMEOUT` secondes, le worker se déclare prêt même si le préchauffage continue.
+
+Les ensembles appris proviennent des statistiques d'accès enregistrées par
+`GET /properties?city=` et `GET /properties/<id>` : chaque worker compte les accès en
+mémoire et les ajoute toutes les `ACCESS_STATS_FLUSH_INTERVAL` secondes aux entités
+`StatistiqueAcces`. Le score d'un élément décroît de moitié toutes les
+`ACCESS_STATS_HALF_LIFE` secondes ; il est stocké sous forme logarithmique « à décroissance
+avant » (`priorite` = log2 du score ramené à l'origine des temps), ce qui permet de classer
+les éléments par une simple requête triée (index composite dans `index.yaml`) sans
+réécrire ceux qui ne sont plus consultés. Les mises à jour concurrentes de deux workers
+peuvent perdre quelques accès : les statistiques sont approximatives.
+"""
+
+import collections
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from google.cloud import datastore
+
+from common.cache import get_cache
+from common.metrics import Gauge, track
+from property_service.models import get_client, list_properties
+
+
+logger = logging.getLogger(__name__)
+
+KIND = 'StatistiqueAcces'
+
+# Nombre maximal d'éléments distincts écrits à chaque vidage (les plus consultés)
+MAX_TRACKED = 1000
+
+# Limite Datastore du nombre d'entités par appel put_multi
+_BATCH_SIZE = 500
+
+WARMUP_IN_PROGRESS = Gauge("cache_warmup_in_progress", "1 pendant le préchauffage des caches du worker.")
+
+
+def _log2_add(a, b):
+    # log2(2**a + 2**b) sans dépassement de capacité
+    if a is None:
+        return b
+    high, low = max(a, b), min(a, b)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+class AccessStats:
+    """Compteurs d'accès du processus, ajoutés périodiquement aux statistiques Datastore.
+
+    Paramètres:
+        - half_life (float): Demi-vie des scores, en secondes.
+        - flush_interval (float): Intervalle entre deux vidages, en secondes.
+    """
+
+    def __init__(self, half_life=86400.0, flush_interval=60.0):
+        self.half_life = half_life
+        self.flush_interval = flush_interval
+        self._counts = collections.Counter()
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._flushing = False
+
+    def record(self, client, kind, value):
+        """Compte un accès et lance un vidage en arrière-plan si l'intervalle est écoulé.
+
+        Paramètres:
+            - client (datastore.Client): Client Google Datastore.
+            - kind (str): Type d'élément ("ville" ou "propriete").
+            - value: Ville ou identifiant de propriété.
+        """
+        with self._lock:
+            self._counts[(kind, value)] += 1
+            if self._flushing or time.monotonic() - self._last_flush < self.flush_interval:
+                return
+            self._flushing = True
+        threading.Thread(target=self._flush_in_background, args=(client,), name="access-stats", daemon=True).start()
+
+    def _flush_in_background(self, client):
+        try:
+            self.flush(client)
+        except Exception:
+            logger.exception("Échec de l'enregistrement des statistiques d'accès.")
+        finally:
+            with self._lock:
+                self._flushing = False
+
+    def flush(self, client):
+        """Ajoute les accès comptés depuis le dernier vidage aux statistiques Datastore.
+
+        Paramètres:
+            - client (datastore.Client): Client Google Datastore.
+
+        Retourne:
+            - int: Nombre d'éléments mis à jour.
+        """
+        with self._lock:
+            counts, self._counts = self._counts, collections.Counter()
+            self._last_flush = time.monotonic()
+        items = counts.most_common(MAX_TRACKED)
+        # Score ramené à l'origine des temps : 2 ** (t / demi-vie) par accès
+        offset = time.time() / self.half_life
+
+        for start in range(0, len(items), _BATCH_SIZE):
+            batch = items[start:start + _BATCH_SIZE]
+            keys = [client.key(KIND, f"{kind}:{value}") for (kind, value), _ in batch]
+            with track("datastore", "get_multi"):
+                existing = {entity.key.name: entity for entity in client.get_multi(keys)}
+            entities = []
+            for key, ((kind, value), count) in zip(keys, batch):
+                entity = existing.get(key.name)
+                if entity is None:
+                    entity = datastore.Entity(key=key, exclude_from_indexes=('valeur',))
+                    entity.update({"type": kind, "valeur": value, "priorite": None})
+                entity["priorite"] = _log2_add(entity["priorite"], math.log2(count) + offset)
+                entities.append(entity)
+            with track("datastore", "put_multi"):
+                client.put_multi(entities)
+        return len(items)
+
+
+def hot_items(client, kind, limit):
+    """Retourne les éléments les plus consultés d'un type.
+
+    Paramètres:
+        - client (datastore.Client): Client Google Datastore.
+        - kind (str): Type d'élément ("ville" ou "propriete").
+        - limit (int): Nombre d'éléments.
+
+    Retourne:
+        - list: Villes ou identifiants, du plus consulté au moins consulté.
+    """
+    if limit <= 0:
+        return []
+    query = client.query(kind=KIND)
+    query.add_filter('type', '=', kind)
+    query.order = ['-priorite']
+    with track("datastore", "query"):
+        return [entity['valeur'] for entity in query.fetch(limit=limit)]
+
+
+def warm_caches(app):
+    """Charge dans les caches les villes et les propriétés les plus consultées.
+
+    Paramètres:
+        - app (Flask): Application Flask.
+
+    Retourne:
+        - tuple: Nombre de villes et nombre de propriétés chargées.
+    """
+    client = get_client(app)
+    cities = [city.strip() for city in (app.config.get('WARMUP_CITIES') or "").split(",") if city.strip()]
+    for city in hot_items(client, "ville", app.config.get('WARMUP_TOP_CITIES', 20)):
+        if city not in cities:
+            cities.append(city)
+    property_ids = hot_items(client, "propriete", app.config.get('WARMUP_TOP_PROPERTIES', 500))
+
+    listing_cache = app.extensions['listing_cache']
+    cache = get_cache(app)
+    ttl = app.config.get('WARMUP_CACHE_TTL', 120.0)
+    city_ttl = app.config.get('CITY_CACHE_TTL', 10.0)
+
+    def load_city(city):
+        listing_cache.set(f"city:{city}", list_properties(client, {'ville': city}), city_ttl)
+
+    def load_properties(ids):
+        with track("datastore", "get_multi"):
+            entities = client.get_multi([client.key('Property', property_id) for property_id in ids])
+        for entity in entities:
+            cache.set(f"property:{entity.key.id}", entity, ttl)
+        return len(entities)
+
+    batches = [property_ids[start:start + 100] for start in range(0, len(property_ids), 100)]
+    with ThreadPoolExecutor(max_workers=app.config.get('WARMUP_CONCURRENCY', 4)) as executor:
+        city_results = [executor.submit(load_city, city) for city in cities]
+        property_results = [executor.submit(load_properties, batch) for batch in batches]
+        for future in city_results:
+            future.result()
+        loaded = sum(future.result() for future in property_results)
+    return len(cities), loaded
+
+
+class _WarmUp:
+    """État du préchauffage d'un worker."""
+
+    __slots__ = ("pid", "done", "deadline")
+
+    def __init__(self, timeout):
+        self.pid = os.getpid()
+        self.done = threading.Event()
+        self.deadline = time.monotonic() + timeout
+
+
+def start_warmup(app):
+    """Lance le préchauffage des caches dans un thread du worker courant.
+
+    À appeler dans chaque worker après le fork (voir `run.py`). Sans effet si
+    `WARMUP_ENABLED` est faux.
+
+    Paramètres:
+        - app (Flask): Application Flask.
+    """
+    if not app.config.get('WARMUP_ENABLED', True):
+        return
+    state = app.extensions['warmup'] = _WarmUp(app.config.get('WARMUP_TIMEOUT', 30.0))
+
+    def run():
+        WARMUP_IN_PROGRESS.inc()
+        start = time.perf_counter()
+        try:
+            cities, properties = warm_caches(app)
+            logger.info("Caches préchauffés en %.1f s : %d villes, %d propriétés.",
+                        time.perf_counter() - start, cities, properties)
+        except Exception:
+            logger.exception("Échec du préchauffage des caches.")
+        finally:
+            state.done.set()
+            WARMUP_IN_PROGRESS.dec()
+
+    threading.Thread(target=run, name="cache-warmup", daemon=True).start()
+
+
+def is_warming(app):
+    """Indique si le worker courant préchauffe encore ses caches.
+
+    Paramètres:
+        - app (Flask): Application Flask.
+
+    Retourne:
+        - bool: True tant que le préchauffage n'est ni terminé ni arrivé à échéance.
+    """
+    state = app.extensions.get('warmup')
+    if state is None or state.pid != os.getpid():
+        return False
+    return not state.done.is_set() and time.monotonic() < state.deadline
@@ -0,0 +1,5 @@
+import os
+
+# Les applications de test partagent des jetons et des identifiants simulés d'un test à
+# l'autre : le cache est désactivé, sauf dans les tests qui le configurent explicitement.
+os.environ.setdefault("CACHE_BACKEND", "none")
@@ -1,9 +1,11 @@
 import pytest
-from property_service.app import app
-from unittest.mock import patch
+from property_service.app import create_app
+from unittest.mock import MagicMock, patch
 from flask_jwt_extended import create_access_token
 from unittest.mock import patch
 
+app = create_app({'DATASTORE_CLIENT': MagicMock()})
+
 class MockKey:
     def __init__(self, id):
         self.id = id
@@ -42,7 +44,7 @@ def test_create_property(mock_get,client):
     # Simuler la fonction `create_property` utilisée dans la route
     with patch('property_service.routes.create_property') as mock_create_property :
         # Simuler la valeur de retour de `create_property`
-        mock_create_property.return_value = mock_entity = type('MockEntity', (), {'id': 123456789})
+        mock_create_property.return_value = mock_entity = MagicMock(id=123456789)
     
         # En-tête d'autorisation
         headers = {'Authorization' : f'Bearer test.jwt.token'}
@@ -75,6 +77,18 @@ def test_create_property(mock_get,client):
         # Vérifiez que la fonction simulée `create_property` a été appelée avec les arguments corrects
         mock_create_property.assert_called_once()
         
+
+@patch('requests.get')
+def test_create_property_when_user_service_sheds(mock_get, client):
+    # Un délestage du user_service n'est pas un refus du jeton : 503, à réessayer
+    mock_get.return_value.status_code = 503
+    mock_get.return_value.headers = {"Retry-After": "3"}
+    payload = {"nom": "Villa", "description": "", "type_de_bien": "Maison", "ville": "Nice"}
+    response = client.post('/properties', headers={'Authorization': 'Bearer test.jwt.token'}, json=payload)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '3'
+
+
 def test_get_property(client):
     with patch('property_service.routes.get_property') as mock_get_property:
         mock_get_property.return_value = MockProperty(
@@ -225,3 +239,970 @@ def test_create_property_unauthorized(mock_get, client):
     assert response.status_code == 401
     assert response.json['error'] == "Non autorisé."
     mock_get.assert_called_once()
+
+
+def test_list_properties_serializes_ids_and_compresses(client):
+    with patch('property_service.routes.list_properties') as mock_list_properties:
+        mock_list_properties.return_value = [
+            MockProperty(
+                {
+                    "nom": f"Appartement {i}",
+                    "description": "Appartement moderne avec balcon et vue sur la mer.",
+                    "type_de_bien": "Appartement",
+                    "ville": "Nice",
+                    "proprietaire": 3,
+                },
+                id=i
+            )
+            for i in range(1, 51)
+        ]
+
+        response = client.get('/properties?city=Nice', headers={'Accept-Encoding': 'gzip'})
+
+        assert response.status_code == 200
+        assert response.headers['Content-Encoding'] == 'gzip'
+
+        import gzip, json
+        data = json.loads(gzip.decompress(response.data))
+        assert [item['id'] for item in data] == list(range(1, 51))
+        assert data[0]['nom'] == "Appartement 1"
+
+    # Un champ `id` stocké dans l'entité est remplacé par l'identifiant de la clé, sans
+    # clé JSON en double ; les dates gardent le format par défaut de Flask
+    import datetime
+    entity = MockProperty({"id": "ancien", "nom": "Villa", "cree_le": datetime.datetime(2024, 6, 1, 8, 30)}, id=7)
+    with app.app_context():
+        body = app.json.dumps(entity)
+    assert body.count('"id"') == 1
+    assert json.loads(body) == {"id": 7, "nom": "Villa", "cree_le": "Sat, 01 Jun 2024 08:30:00 GMT"}
+
+
+@patch('requests.get')
+def test_metrics_records_user_service_calls(mock_get, client):
+    mock_get.return_value.status_code = 401
+
+    client.post('/properties', headers={'Authorization': 'Bearer invalid_token'}, json={})
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert 'downstream_call_duration_seconds_count{system="user_service",operation="validate"}' in body
+    assert 'http_request_duration_seconds_count{method="POST",route="/properties"}' in body
+
+
+def test_metrics_are_aggregated_across_workers(tmp_path):
+    import json
+    import os
+    from common.metrics import HTTP_IN_FLIGHT, HTTP_REQUESTS, REGISTRY, clear_multiprocess_dir
+
+    metrics_dir = tmp_path / "metrics"
+    metrics_dir.mkdir()
+    (metrics_dir / "metrics-1.json").write_text("{}")
+    # Un worker relancé ne retire pas les fichiers des autres : seul le maître de Gunicorn
+    # vide le répertoire, au démarrage du service
+    metrics_app = create_app({'DATASTORE_CLIENT': MagicMock(), 'METRICS_MULTIPROC_DIR': str(metrics_dir)})
+    assert (metrics_dir / "metrics-1.json").exists()
+    clear_multiprocess_dir(str(metrics_dir))
+    assert not (metrics_dir / "metrics-1.json").exists()
+
+    # Fichier d'un worker disparu dont ce processus a repris le PID
+    (metrics_dir / f"metrics-{os.getpid()}.json").write_text(
+        json.dumps({"http_requests_total": [[["GET", "/multiprocess", "200"], 4]]}))
+
+    # Un autre worker écrit son registre ; un troisième s'arrête et verse ses compteurs au
+    # fichier agrégé
+    pid = os.fork()
+    if pid == 0:
+        HTTP_REQUESTS.inc("GET", "/multiprocess", "200", amount=2)
+        HTTP_IN_FLIGHT.inc(amount=5)
+        REGISTRY.dump(str(metrics_dir))
+        os._exit(0)
+    os.waitpid(pid, 0)
+    retired = os.fork()
+    if retired == 0:
+        HTTP_REQUESTS.inc("GET", "/multiprocess", "200", amount=8)
+        HTTP_IN_FLIGHT.inc(amount=7)
+        REGISTRY.dump(str(metrics_dir))
+        REGISTRY.retire(str(metrics_dir))
+        os._exit(0)
+    os.waitpid(retired, 0)
+    assert not (metrics_dir / f"metrics-{retired}.json").exists()
+    HTTP_REQUESTS.inc("GET", "/multiprocess", "200")
+
+    with metrics_app.test_client() as metrics_client:
+        # La requête /metrics elle-même est en cours
+        in_flight = HTTP_IN_FLIGHT.value() + 1
+        body = metrics_client.get('/metrics').get_data(as_text=True)
+        assert 'http_requests_total{method="GET",route="/multiprocess",status="200"} 15' in body
+        assert f"http_requests_in_flight {in_flight + 5}" in body
+
+        # Les jauges d'un worker arrêté (fichier ancien) sont ignorées, pas ses compteurs
+        os.utime(metrics_dir / f"metrics-{pid}.json", (0, 0))
+        body = metrics_client.get('/metrics').get_data(as_text=True)
+        assert 'http_requests_total{method="GET",route="/multiprocess",status="200"} 15' in body
+        assert f"http_requests_in_flight {in_flight}" in body
+
+
+def test_profiling_header_and_slow_request_log(client, tmp_path, caplog):
+    app.config.update(PROFILE_TOKEN='secret', PROFILE_DIR=str(tmp_path), SLOW_REQUEST_THRESHOLD_MS=0.001)
+    try:
+        with patch('property_service.routes.get_property') as mock_get_property:
+            mock_get_property.return_value = None
+
+            response = client.get('/properties/1', headers={'X-Profile': 'secret'})
+
+            assert response.status_code == 404
+            profile_id = response.headers['X-Profile-Id']
+            assert (tmp_path / f"{profile_id}.prof").exists()
+            assert any("Requête lente" in record.getMessage() and "serialization=" in record.getMessage()
+                       for record in caplog.records)
+
+            # Un jeton invalide ne déclenche pas le profilage
+            response = client.get('/properties/1', headers={'X-Profile': 'wrong'})
+            assert 'X-Profile-Id' not in response.headers
+    finally:
+        app.config.update(PROFILE_TOKEN=None, PROFILE_DIR='profiles', SLOW_REQUEST_THRESHOLD_MS=1000)
+
+
+def test_create_app_requires_datastore_configuration(monkeypatch):
+    monkeypatch.delenv('DATASTORE_CREDENTIALS', raising=False)
+    monkeypatch.delenv('DATASTORE_EMULATOR_HOST', raising=False)
+
+    with pytest.raises(ValueError):
+        create_app()
+
+
+def test_datastore_client_is_created_lazily_per_process(monkeypatch):
+    from property_service import models
+
+    lazy_app = create_app({'DATASTORE_CREDENTIALS': 'credentials.json'})
+    assert 'datastore' not in lazy_app.extensions
+
+    with patch('property_service.models.datastore.Client.from_service_account_json') as mock_factory:
+        mock_factory.side_effect = lambda path: MagicMock()
+
+        first = models.get_client(lazy_app)
+        assert models.get_client(lazy_app) is first
+
+        # Après un fork, le worker crée son propre client
+        monkeypatch.setattr(models.os, 'getpid', lambda: -1)
+        assert models.get_client(lazy_app) is not first
+        assert mock_factory.call_count == 2
+
+
+def test_delete_properties_of_owner_in_batches():
+    from google.api_core.exceptions import ServiceUnavailable
+    from property_service.cascade import delete_properties_of_owner
+
+    pages = [[MockProperty({}, i) for i in range(2)], [MockProperty({}, i) for i in range(2, 4)], [MockProperty({}, 4)]]
+    datastore_client = MagicMock()
+    datastore_client.key.side_effect = lambda *path: MockKey(path[-1])
+    datastore_client.query.return_value.fetch.side_effect = lambda limit: pages.pop(0)
+    # Une erreur transitoire à la validation du premier lot est retentée
+    batch = datastore_client.batch.return_value
+    batch.__exit__.side_effect = [ServiceUnavailable("indisponible"), False, False, False]
+
+    with patch('property_service.cascade.time.sleep'):
+        deleted = delete_properties_of_owner(datastore_client, 7, batch_size=2)
+
+    assert deleted == 5
+    datastore_client.query.return_value.add_filter.assert_called_with('proprietaire', '=', 7)
+    assert batch.__exit__.call_count == 4
+    deletes = batch.__enter__.return_value.delete.call_args_list
+    assert [call.args[0].id for call in deletes] == [0, 1, 0, 1, 2, 3, 4]
+    # Chaque suppression est accompagnée de son entrée dans le journal des modifications
+    changes = [call.args[0] for call in batch.__enter__.return_value.put.call_args_list]
+    assert [(change['entity_id'], change['op']) for change in changes] == [(key, 'delete') for key in [0, 1, 0, 1, 2, 3, 4]]
+    progress = datastore_client.put.call_args.args[0]
+    assert progress['supprimees'] == 5 and progress['termine'] is True
+
+
+def test_cascade_delete_evicts_caches_and_feeds_changes():
+    from benchmarks.fake_datastore import InMemoryDatastore
+    from common.cache import MemoryCache
+    from property_service.cascade import delete_properties_of_owner
+    from property_service.changes import fetch_changes
+    from property_service.models import Property, create_property
+
+    datastore_client = InMemoryDatastore()
+    entities = [create_property(datastore_client, Property(
+        nom=str(i), description="", type_de_bien="Maison", ville="Nice", proprietaire=7)) for i in range(3)]
+    cache, listing_cache = MemoryCache(), MemoryCache()
+    for entity in entities:
+        cache.set(f"property:{entity.key.id}", entity)
+    listing_cache.set("city:Nice", entities)
+
+    assert delete_properties_of_owner(datastore_client, 7, batch_size=2, cache=cache, listing_cache=listing_cache) == 3
+    assert all(cache.get(f"property:{entity.key.id}") is None for entity in entities)
+    assert listing_cache.get("city:Nice") is None
+    changes, _ = fetch_changes(datastore_client, None, 100, lag=0)
+    assert sorted(change['entity_id'] for change in changes if change['op'] == 'delete') == sorted(entity.key.id for entity in entities)
+
+
+def test_change_feed_records_writes_in_order():
+    from benchmarks.fake_datastore import InMemoryDatastore
+    from property_service.models import Property, create_property, update_property, delete_property
+
+    datastore_client = InMemoryDatastore()
+    # La propriété et son entrée « create » sont écrites en un seul appel
+    with patch.object(datastore_client, 'put_multi', wraps=datastore_client.put_multi) as spy_put_multi:
+        entity = create_property(datastore_client, Property(
+            nom="Villa", description="Villa", type_de_bien="Maison", ville="Nice", proprietaire=2))
+    written = spy_put_multi.call_args_list[0].args[0]
+    assert [item.key.kind for item in written] == ['Property', 'PropertyChange']
+    assert written[1]['entity_id'] == entity.key.id
+    update_property(datastore_client, entity.key.id, {"nom": "Villa Paradis"})
+
+    feed_app = create_app({'DATASTORE_CLIENT': datastore_client, 'CHANGE_FEED_LAG': 0})
+    with feed_app.test_client() as feed_client:
+        response = feed_client.get('/properties/changes?limit=1')
+        assert response.status_code == 200
+        assert [change['op'] for change in response.json['changes']] == ['create']
+        for limit in (0, -5):
+            response = feed_client.get(f'/properties/changes?limit={limit}&wait=-1')
+            assert [change['op'] for change in response.json['changes']] == ['create']
+
+        cursor = response.json['cursor']
+        response = feed_client.get(f'/properties/changes?since={cursor}')
+        assert [(change['op'], change['champs']) for change in response.json['changes']] == [('update', ['nom'])]
+
+        delete_property(datastore_client, entity.key.id)
+        response = feed_client.get(f"/properties/changes?since={response.json['cursor']}&wait=1")
+        assert [change['op'] for change in response.json['changes']] == ['delete']
+        assert response.json['changes'][0]['entity_id'] == entity.key.id
+
+        assert feed_client.get('/properties/changes?since=invalide').status_code == 400
+
+    # Une entrée validée en retard, horodatée avant des entrées déjà servies, est servie une fois
+    import datetime
+    from property_service.changes import build_change, fetch_changes
+    _, cursor = fetch_changes(datastore_client, None, 100, lag=0)
+    late = build_change(datastore_client, 99, "update", ["nom"])
+    late["horodatage"] -= datetime.timedelta(seconds=5)
+    datastore_client.put(late)
+    changes, cursor = fetch_changes(datastore_client, cursor, 100, lag=0)
+    assert [change['entity_id'] for change in changes] == [99]
+    assert fetch_changes(datastore_client, cursor, 100, lag=0)[0] == []
+
+
+def test_index_policy_and_write_limits():
+    from benchmarks.fake_datastore import InMemoryDatastore
+    from property_service.models import (Property, MAX_PIECES, EntityValidationError,
+                                         create_property, backfill_index_policy)
+    from google.cloud import datastore
+
+    datastore_client = InMemoryDatastore()
+    entity = create_property(datastore_client, Property(
+        nom="Villa", description="Villa", type_de_bien="Maison", ville="Nice", proprietaire=2,
+        pieces=[{"nom": "Salon", "surface": 35}]))
+    assert {'description', 'pieces'} <= set(datastore_client.get(entity.key).exclude_from_indexes)
+
+    with pytest.raises(EntityValidationError):
+        create_property(datastore_client, Property(
+            nom="Villa", description="Villa", type_de_bien="Maison", ville="Nice", proprietaire=2,
+            pieces=[{"nom": "Chambre"}] * (MAX_PIECES + 1)))
+    with pytest.raises(EntityValidationError):
+        create_property(datastore_client, Property(
+            nom="Villa", description="x" * 1_100_000, type_de_bien="Maison", ville="Nice", proprietaire=2))
+
+    # Une entité écrite avant la politique d'indexation est réécrite par le backfill
+    legacy = datastore.Entity(key=datastore_client.key('Property'))
+    legacy.update({"nom": "Ancienne", "description": "Texte", "ville": "Nice"})
+    datastore_client.put(legacy)
+    assert backfill_index_policy(datastore_client) == 2
+    assert 'description' in datastore_client.get(legacy.key).exclude_from_indexes
+
+
+@patch('requests.get')
+def test_patch_property_reports_and_skips_unchanged_fields(mock_get):
+    from benchmarks.fake_datastore import InMemoryDatastore
+    from property_service.models import Property, create_property
+
+    mock_get.return_value.status_code = 200
+    mock_get.return_value.json.return_value = {"valid": True, "user": {"id": 2}}
+
+    datastore_client = InMemoryDatastore()
+    entity = create_property(datastore_client, Property(
+        nom="Villa", description="Villa", type_de_bien="Maison", ville="Nice", proprietaire=2,
+        pieces=[{"nom": "Salon", "surface": 35}]))
+    patch_app = create_app({'DATASTORE_CLIENT': datastore_client})
+    headers = {'Authorization': 'Bearer test.jwt.token'}
+
+    with patch_app.test_client() as patch_client, \
+         patch.object(datastore_client, 'put_multi', wraps=datastore_client.put_multi) as spy_put_multi:
+        response = patch_client.patch(f'/properties/{entity.key.id}', headers=headers,
+                                      json={"nom": "Villa Paradis", "ville": "Nice", "pieces": None})
+        assert response.status_code == 200
+        assert response.json['champs_modifies'] == ['nom', 'pieces']
+        assert 'pieces' not in datastore_client.get(entity.key)
+
+        # Un patch identique n'écrit rien
+        response = patch_client.patch(f'/properties/{entity.key.id}', headers=headers, json={"nom": "Villa Paradis"})
+        assert response.json == {"message": "Aucune modification.", "champs_modifies": []}
+        assert spy_put_multi.call_count == 1
+
+        response = patch_client.patch(f'/properties/{entity.key.id}', headers=headers, json={"proprietaire": 3})
+        assert response.status_code == 400
+        response = patch_client.patch(f'/properties/{entity.key.id}', headers=headers, json={"nom": None})
+        assert response.status_code == 400
+
+
+@patch('requests.get')
+def test_create_property_idempotent_retry_is_coalesced(mock_get, client):
+    import threading
+    from common.idempotency import IdempotencyStore
+
+    mock_get.return_value.status_code = 200
+    mock_get.return_value.json.return_value = {"valid": True, "user": {"id": 2}}
+    headers = {'Authorization': 'Bearer test.jwt.token', 'Idempotency-Key': 'creation-villa'}
+    payload = {"nom": "Villa", "description": "Villa", "type_de_bien": "Maison", "ville": "Nice"}
+
+    with patch('property_service.routes.create_property') as mock_create_property:
+        mock_create_property.return_value = MagicMock(id=42)
+        responses = [client.post('/properties', json=payload, headers=headers) for _ in range(2)]
+        mismatch = client.post('/properties', json=dict(payload, ville="Paris"), headers=headers)
+
+    assert mock_create_property.call_count == 1
+    assert [response.status_code for response in responses] == [201, 201]
+    assert responses[1].json == {"id": 42, "message": "Propriété créée avec succès."}
+    assert mismatch.status_code == 422
+
+    # La clé appartient à l'utilisateur, pas au jeton ; un refus d'authentification ou une
+    # requête invalide n'est pas conservé
+    renewed = dict(headers, Authorization='Bearer renewed.jwt.token')
+    assert client.post('/properties', json=payload, headers=renewed).headers['Idempotent-Replayed'] == "true"
+    retry_headers = dict(headers, **{'Idempotency-Key': 'apres-refus'})
+    assert client.post('/properties', json={"nom": "Villa"}, headers=retry_headers).status_code == 400
+    mock_get.return_value.status_code = 401
+    assert client.post('/properties', json=payload, headers=retry_headers).status_code == 401
+    mock_get.return_value.status_code = 200
+    with patch('property_service.routes.create_property') as mock_create_property:
+        mock_create_property.return_value = MagicMock(id=43)
+        assert client.post('/properties', json=payload, headers=retry_headers).status_code == 201
+
+    # Une requête concurrente attend la fin de l'exécution en cours
+    store = IdempotencyStore(max_entries=1)
+    assert store.begin("cle", "empreinte")[0] == "owner"
+    state, pending = store.begin("cle", "empreinte")
+    assert state == "pending"
+    threading.Timer(0.05, store.complete, ("cle", "empreinte", 201, b"{}", "application/json")).start()
+    assert pending.done.wait(1)
+    assert store.begin("cle", "empreinte")[0] == "stored"
+
+    # Le magasin est borné
+    store.begin("autre", "empreinte")
+    store.complete("autre", "empreinte", 201, b"{}", "application/json")
+    assert len(store) == 1 and store.begin("cle", "empreinte")[0] == "owner"
+
+
+@patch('requests.get')
+def test_idempotent_retry_is_recognized_by_another_worker(mock_get, tmp_path):
+    import threading
+    from benchmarks.fake_datastore import InMemoryDatastore
+
+    mock_get.return_value.status_code = 200
+    mock_get.return_value.json.return_value = {"valid": True, "user": {"id": 2}}
+    datastore_client = InMemoryDatastore()
+    # Deux workers de l'hôte : deux applications sur le même cache partagé
+    config = {'DATASTORE_CLIENT': datastore_client, 'CACHE_BACKEND': 'shared', 'CACHE_SHM_PATH': str(tmp_path / "cache")}
+    first_worker, second_worker = create_app(config).test_client(), create_app(config).test_client()
+    headers = {'Authorization': 'Bearer test.jwt.token', 'Idempotency-Key': 'creation-villa'}
+    payload = {"nom": "Villa", "description": "Villa", "type_de_bien": "Maison", "ville": "Nice"}
+
+    first = first_worker.post('/properties', json=payload, headers=headers)
+    retry = second_worker.post('/properties', json=payload, headers=headers)
+    assert (first.status_code, retry.status_code) == (201, 201)
+    assert retry.json == first.json
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert len(list(datastore_client.query(kind='Property').fetch())) == 1
+    assert second_worker.post('/properties', json=dict(payload, ville="Paris"), headers=headers).status_code == 422
+
+    # Une relance reçue pendant l'exécution attend la réponse de l'autre worker
+    first_store = first_worker.application.extensions['idempotency']
+    second_store = second_worker.application.extensions['idempotency']
+    assert first_store.begin("cle", "empreinte")[0] == "owner"
+    state, pending = second_store.begin("cle", "empreinte")
+    assert state == "pending" and not pending.wait(0.01)
+    threading.Timer(0.05, first_store.complete, ("cle", "empreinte", 201, b"{}", "application/json")).start()
+    assert pending.wait(2)
+    state, stored = second_store.begin("cle", "empreinte")
+    assert (state, stored.status, stored.body) == ("stored", 201, b"{}")
+
+    # Une exécution en erreur libère la clé pour tous les workers
+    assert first_store.begin("echec", "empreinte")[0] == "owner"
+    first_store.complete("echec", "empreinte")
+    assert second_store.begin("echec", "empreinte")[0] == "owner"
+
+
+def test_geohash_radius_and_bbox_search():
+    from benchmarks.fake_datastore import InMemoryDatastore
+    from property_service import geo
+    from property_service.models import Property, EntityValidationError, create_property
+
+    # Valeur de référence : geohash de la place Masséna à Nice
+    assert geo.encode(43.6971, 7.2706, 5) == "spv0t"
+
+    datastore_client = InMemoryDatastore()
+    places = {"Masséna": (43.6971, 7.2706), "Port": (43.6961, 7.2850), "Cimiez": (43.7196, 7.2757),
+              "Antibes": (43.5808, 7.1239)}
+    for nom, (latitude, longitude) in places.items():
+        create_property(datastore_client, Property(nom=nom, description="", type_de_bien="Appartement",
+                                                   ville="Nice", proprietaire=1, latitude=latitude, longitude=longitude))
+    create_property(datastore_client, Property(nom="Sans position", description="", type_de_bien="Maison",
+                                               ville="Nice", proprietaire=1))
+    with pytest.raises(EntityValidationError):
+        create_property(datastore_client, Property(nom="Incomplète", description="", type_de_bien="Maison",
+                                                   ville="Nice", proprietaire=1, latitude=43.7))
+
+    geo_app = create_app({'DATASTORE_CLIENT': datastore_client})
+    with geo_app.test_client() as geo_client:
+        response = geo_client.get('/properties/near?lat=43.6971&lon=7.2706&radius=3000')
+        assert response.status_code == 200
+        assert [entity["nom"] for entity in response.json] == ["Masséna", "Port", "Cimiez"]
+        assert response.json[0]["distance"] == 0
+
+        response = geo_client.get('/properties/within?south=43.69&west=7.26&north=43.70&east=7.29')
+        assert sorted(entity["nom"] for entity in response.json) == ["Masséna", "Port"]
+
+        assert geo_client.get('/properties/near?lat=43.6971&lon=7.2706').status_code == 400
+        assert geo_client.get('/properties/near?lat=43.6971&lon=7.2706&radius=1000000').status_code == 400
+        # Zones traversant l'antiméridien : refusées plutôt que tronquées
+        response = geo_client.get('/properties/within?south=-18&west=179&north=-17&east=-179')
+        assert response.status_code == 400 and "antiméridien" in response.json['error']
+        assert geo_client.get('/properties/near?lat=-17.7&lon=179.99&radius=5000').status_code == 400
+
+        # Nombre de résultats et d'entités lues bornés
+        response = geo_client.get('/properties/near?lat=43.6971&lon=7.2706&radius=3000&limit=1')
+        assert [entity["nom"] for entity in response.json] == ["Masséna"]
+        assert 'X-Results-Truncated' not in response.headers
+
+    bounded_app = create_app({'DATASTORE_CLIENT': datastore_client, 'GEO_MAX_SCANNED': 2})
+    with bounded_app.test_client() as bounded_client:
+        response = bounded_client.get('/properties/near?lat=43.6971&lon=7.2706&radius=3000')
+        assert len(response.json) <= 2
+        assert response.headers['X-Results-Truncated'] == 'true'
+        response = bounded_client.get('/properties/within?south=43.69&west=7.26&north=43.70&east=7.29')
+        assert response.headers['X-Results-Truncated'] == 'true'
+
+
+def test_facet_counters_follow_writes_and_reconcile():
+    from google.cloud import datastore
+    from benchmarks.fake_datastore import InMemoryDatastore
+    from property_service.models import Property, create_property, patch_property, delete_property
+    from property_service.stats import facet_stats, increment_facets, reconcile_stats, read_counters
+
+    datastore_client = InMemoryDatastore()
+
+    entities = [create_property(datastore_client, Property(nom=str(i), description="", type_de_bien=type_de_bien,
+                                                           ville=ville, proprietaire=1))
+                for i, (ville, type_de_bien) in enumerate([("Nice", "Maison"), ("Nice", "Maison"),
+                                                           ("Nice", "Appartement"), ("Lyon", "Maison")])]
+    patch_property(datastore_client, entities[1], {"type_de_bien": "Appartement"})
+    delete_property(datastore_client, entities[3].key.id)
+
+    # Une propriété antérieure aux compteurs, puis supprimée, ne fait pas passer les totaux
+    # sous zéro : sans référence, les chiffres viennent des requêtes d'agrégation
+    legacy = datastore.Entity(key=datastore_client.key('Property', 999))
+    legacy.update({"nom": "Ancienne", "ville": "Lyon", "type_de_bien": "Studio", "proprietaire": 1})
+    datastore_client.put(legacy)
+    delete_property(datastore_client, 999)
+    assert read_counters(datastore_client, "Lyon")[("Lyon", "Studio")] == -1
+    assert facet_stats(datastore_client, "Lyon") == {"ville": "Lyon", "total": 0, "types": {},
+                                                    "source": "agregation"}
+    assert reconcile_stats(datastore_client) == {("Lyon", "Studio"): 1}
+
+    stats_app = create_app({'DATASTORE_CLIENT': datastore_client})
+    with stats_app.test_client() as stats_client:
+        response = stats_client.get('/properties/stats?city=Nice')
+        assert response.json == {"ville": "Nice", "total": 3, "types": {"Maison": 1, "Appartement": 2},
+                                 "source": "compteurs"}
+        assert stats_client.get('/properties/stats').json["villes"] == {
+            "Nice": {"total": 3, "types": {"Maison": 1, "Appartement": 2}}}
+
+    # Les chiffres sont servis depuis le cache sans relire les fragments
+    cached_app = create_app({'DATASTORE_CLIENT': datastore_client, 'CACHE_BACKEND': 'memory'})
+    with cached_app.test_client() as stats_client, \
+         patch('property_service.stats.read_counters', wraps=read_counters) as spy_counters:
+        assert stats_client.get('/properties/stats?city=Nice').json["total"] == 3
+        assert stats_client.get('/properties/stats?city=Nice').json["total"] == 3
+        assert stats_client.get('/properties/stats').json["total"] == 3
+        assert spy_counters.call_count == 2
+
+    # Des compteurs faussés (ou absents) sont corrigés par la réconciliation
+    for shard in datastore_client.query(kind='CompteurFacette').fetch():
+        datastore_client.delete(shard.key)
+    assert facet_stats(datastore_client, "Nice")["source"] == "agregation"
+    assert facet_stats(datastore_client, "Nice")["total"] == 3
+    assert reconcile_stats(datastore_client) == {("Nice", "Maison"): 1, ("Nice", "Appartement"): 2}
+    assert read_counters(datastore_client, "Nice") == {("Nice", "Maison"): 1, ("Nice", "Appartement"): 2}
+    assert reconcile_stats(datastore_client) == {}
+
+    # Un écart transitoire sous zéro n'est pas exposé
+    increment_facets(datastore_client, {("Lyon", "Studio"): -1})
+    assert facet_stats(datastore_client)["villes"] == {"Nice": {"total": 3, "types": {"Maison": 1, "Appartement": 2}}}
+
+    # Un échec est journalisé et compté, sans être propagé à l'écriture
+    from google.api_core import exceptions as api_exceptions
+    from property_service.stats import FACET_COUNTER_FAILURES
+    failures = FACET_COUNTER_FAILURES.value("conflict")
+    with patch.object(datastore_client, 'transaction', side_effect=api_exceptions.Aborted("conflit")):
+        increment_facets(datastore_client, {("Nice", "Maison"): 1})
+    assert FACET_COUNTER_FAILURES.value("conflict") == failures + 1
+
+
+@patch('requests.get')
+def test_property_payload_schema_is_checked_before_authentication(mock_get, client):
+    from property_service.models import Property, Piece
+    from property_service.schema import decode_property
+
+    headers = {'Authorization': 'Bearer test.jwt.token'}
+    payload = {"nom": "Villa", "description": "Villa", "type_de_bien": "Maison", "ville": "Nice",
+               "pieces": [{"nom": "Salon", "surface": "35 m²"}]}
+
+    response = client.post('/properties', headers=headers, json=payload)
+    assert response.status_code == 400
+    assert response.json == {"error": "Type invalide pour pieces[0].surface : nombre attendu."}
+
+    payload["pieces"] = [{"nom": "Salon", "etage": True}]
+    assert client.post('/properties', headers=headers, json=payload).status_code == 400
+    assert client.put('/properties/1', headers=headers, json={"proprietaire": 3}).status_code == 400
+    assert client.put('/properties/1', headers=headers, json={"ville": 75}).status_code == 400
+    mock_get.assert_not_called()
+
+    # Décodage vers des dataclasses à __slots__, sans copie profonde à la conversion
+    payload["pieces"] = [{"nom": "Salon", "surface": 35}]
+    property_data = decode_property(payload, proprietaire=2)
+    assert property_data.pieces == [Piece(nom="Salon", surface=35)]
+    assert not hasattr(property_data, '__dict__') and not hasattr(property_data.pieces[0], '__dict__')
+    assert property_data.to_dict() == {"nom": "Villa", "description": "Villa", "type_de_bien": "Maison", "ville": "Nice",
+                                       "proprietaire": 2, "pieces": [{"nom": "Salon", "surface": 35}]}
+    assert isinstance(property_data, Property)
+
+    # Pièces des clients antérieurs au schéma : champs inconnus conservés, étage numérique
+    # converti en chaîne, nom facultatif
+    payload["pieces"] = [{"nom": "Salon", "vue": "mer", "etage": 1}, {"surface": 9.5}]
+    assert [piece.to_dict() for piece in decode_property(payload).pieces] == [
+        {"vue": "mer", "nom": "Salon", "etage": "1"}, {"surface": 9.5}]
+
+
+@patch('requests.get')
+def test_write_behind_ingestion_batches_and_spills(mock_get, tmp_path):
+    from google.api_core.exceptions import ServiceUnavailable
+    from benchmarks.fake_datastore import InMemoryDatastore
+    from property_service.ingestion import WriteBehindBuffer, BufferFull, start_spill_replay
+    from property_service.models import Property
+
+    mock_get.return_value.status_code = 200
+    mock_get.return_value.json.return_value = {"valid": True, "user": {"id": 2}}
+    datastore_client = InMemoryDatastore()
+    ingestion_app = create_app({'DATASTORE_CLIENT': datastore_client, 'WRITE_BEHIND': True,
+                                'WRITE_BEHIND_FLUSH_INTERVAL': 0.05, 'WRITE_BEHIND_SPILL_DIR': str(tmp_path)})
+    headers = {'Authorization': 'Bearer test.jwt.token', 'Prefer': 'respond-async'}
+    payload = {"nom": "Villa", "description": "Villa", "type_de_bien": "Maison", "ville": "Nice"}
+
+    with ingestion_app.test_client() as ingestion_client, \
+         patch.object(datastore_client, 'put_multi', wraps=datastore_client.put_multi) as spy_put_multi:
+        responses = [ingestion_client.post('/properties', headers=headers, json=payload) for _ in range(3)]
+        assert [response.status_code for response in responses] == [202, 202, 202]
+        ingestion_app.extensions['write_behind'][1].stop()
+
+    # Les identifiants réservés sont ceux des entités écrites, par lots put_multi
+    for response in responses:
+        assert datastore_client.get(datastore_client.key('Property', response.json["id"]))["nom"] == "Villa"
+    assert spy_put_multi.call_count < 3
+
+    # Datastore indisponible : le lot part dans le fichier de débordement, rejoué au démarrage suivant
+    buffer = WriteBehindBuffer(datastore_client, max_size=1, enqueue_timeout=0, spill_dir=str(tmp_path),
+                               max_retries=2, backoff=0)
+    property_id = buffer.submit(Property(nom="Mas", description="", type_de_bien="Maison", ville="Arles", proprietaire=2))
+    with pytest.raises(BufferFull):
+        buffer.submit(Property(nom="Plein", description="", type_de_bien="Maison", ville="Arles", proprietaire=2))
+    with patch.object(datastore_client, 'put_multi', side_effect=ServiceUnavailable("indisponible")):
+        buffer.start()
+        buffer.stop()
+    assert datastore_client.get(datastore_client.key('Property', property_id)) is None
+    assert len(list(tmp_path.glob("spill-*.jsonl"))) == 1
+
+    # Au démarrage du worker, sans création différée ni WRITE_BEHIND
+    restarted_app = create_app({'DATASTORE_CLIENT': datastore_client, 'WRITE_BEHIND_SPILL_DIR': str(tmp_path)})
+    start_spill_replay(restarted_app).join(5)
+    assert datastore_client.get(datastore_client.key('Property', property_id))["nom"] == "Mas"
+    assert not list(tmp_path.iterdir())
+    assert 'write_behind' not in restarted_app.extensions
+    assert start_spill_replay(restarted_app) is None
+
+    # Un rejeu interrompu est repris même si son identifiant de processus a été réutilisé ;
+    # un fichier verrouillé (écriture ou rejeu en cours) est ignoré
+    import fcntl, json, os
+    abandoned = tmp_path / f"spill-1.jsonl.replay-{os.getpid()}"
+    abandoned.write_text(json.dumps({"id": 991, "values": {"nom": "Repris", "ville": "Arles", "type_de_bien": "Maison"}}) + "\n")
+    with open(abandoned) as held:
+        fcntl.flock(held.fileno(), fcntl.LOCK_EX)
+        assert WriteBehindBuffer(datastore_client, spill_dir=str(tmp_path)).replay_spill_files() == 0
+    assert WriteBehindBuffer(datastore_client, spill_dir=str(tmp_path)).replay_spill_files() == 1
+    assert datastore_client.get(datastore_client.key('Property', 991))["nom"] == "Repris"
+    assert not list(tmp_path.iterdir())
+
+
+def test_latest_feed_rebuilds_and_follows_writes():
+    import datetime
+    import time
+    from benchmarks.fake_datastore import InMemoryDatastore
+    from property_service.latest import LatestFeed
+    from property_service.models import Property, create_property, delete_property
+
+    datastore_client = InMemoryDatastore()
+    instants = (datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(minutes=i)
+                for i in range(10))
+
+    def publish(nom, ville="Nice"):
+        with patch('property_service.models._now', return_value=next(instants)):
+            return create_property(datastore_client, Property(
+                nom=nom, description="", type_de_bien="Maison", ville=ville, proprietaire=1))
+
+    first, second, third = publish("1"), publish("2"), publish("3")
+    publish("Lyon", ville="Lyon")
+
+    # Reconstruction par la requête triée, limitée à `size` propriétés
+    feed = LatestFeed(size=2, sync_interval=0, lag=0)
+    assert [entity['nom'] for entity in feed.latest(datastore_client, "Nice")] == ["3", "2"]
+    assert feed.latest(datastore_client, "Nice")[0]['cree_le'] > second['cree_le'] == feed.latest(datastore_client, "Nice")[1]['cree_le']
+
+    # Écriture d'un autre worker : prise en compte via le journal des modifications
+    fourth = publish("4")
+    assert [entity['nom'] for entity in feed.latest(datastore_client, "Nice")] == ["4", "3"]
+
+    # Une liste pleine qui perd un élément est reconstruite
+    delete_property(datastore_client, fourth.key.id)
+    feed.forget(fourth.key.id)
+    assert [entity['nom'] for entity in feed.latest(datastore_client, "Nice")] == ["3", "2"]
+    assert first['modifie_le'] == first['cree_le']
+
+    # Avec le thread de lecture du journal, les requêtes ne lisent plus Datastore elles-mêmes
+    feed.sync_interval = 0.01
+    feed.start_sync(lambda: datastore_client)
+    try:
+        with patch.object(feed, 'sync', wraps=feed.sync) as spy_sync:
+            fifth = publish("5")
+            deadline = time.monotonic() + 5
+            while feed.latest(datastore_client, "Nice")[0].key.id != fifth.key.id and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert [entity['nom'] for entity in feed.latest(datastore_client, "Nice")] == ["5", "3"]
+            spy_sync.assert_not_called()
+    finally:
+        feed.stop_sync()
+
+    latest_app = create_app({'DATASTORE_CLIENT': datastore_client, 'CHANGE_FEED_LAG': 0})
+    with latest_app.test_client() as latest_client:
+        response = latest_client.get('/properties/latest?city=Nice&limit=2')
+        assert response.status_code == 200
+        assert [(item['id'], item['nom']) for item in response.json] == [(fifth.key.id, "5"), (third.key.id, "3")]
+        assert latest_client.get('/properties/latest').status_code == 400
+
+
+@patch('requests.get')
+def test_shared_cache_serves_validation_and_lookups_across_workers(mock_get, tmp_path):
+    import os
+    from benchmarks.fake_datastore import InMemoryDatastore
+    from common.shm_cache import SharedMemoryCache, TieredSharedMemoryCache
+    from property_service.models import Piece, Property, create_property
+
+    # Une entrée écrite par un processus forké est lue par les autres
+    shared = SharedMemoryCache(str(tmp_path / "cache"), max_entries=16, entry_size=256)
+    pid = os.fork()
+    if pid == 0:
+        shared.set("property:1", {"nom": "Villa"})
+        os._exit(0)
+    os.waitpid(pid, 0)
+    assert shared.get("property:1") == {"nom": "Villa"}
+    assert os.stat(tmp_path / "cache").st_mode & 0o777 == 0o600
+    (tmp_path / "open-cache").touch(mode=0o644)
+    SharedMemoryCache(str(tmp_path / "open-cache"), max_entries=16, entry_size=256)
+    assert os.stat(tmp_path / "open-cache").st_mode & 0o777 == 0o600
+    assert not shared.set("property:2", "x" * 1000)
+    for index in range(40):
+        shared.set(f"property:{index}", index)
+    assert shared.get("property:39") == 39
+    shared.delete("property:39")
+    assert shared.get("property:39") is None
+
+    # Une valeur lue avant une modification concurrente (clé supprimée pendant le calcul)
+    # n'est pas réécrite dans le cache
+    from common.cache import MemoryCache, get_or_load
+    tiered = TieredSharedMemoryCache(str(tmp_path / "tiered"), max_entries=16, entry_size=256,
+                                     large_max_entries=8, large_entry_size=4096)
+    for cache in (MemoryCache(), shared, tiered):
+        def stale_read(cache=cache):
+            cache.delete("property:7")
+            return {"nom": "Ancien nom"}
+        assert get_or_load(cache, "property:7", stale_read) == {"nom": "Ancien nom"}
+        assert cache.get("property:7") is None
+        assert get_or_load(cache, "property:7", lambda: {"nom": "Villa"}) == {"nom": "Villa"}
+        assert cache.get("property:7") == {"nom": "Villa"}
+
+    # Un fichier d'une autre géométrie (déploiement précédent) est recréé
+    SharedMemoryCache(str(tmp_path / "app-cache.large"), max_entries=8, entry_size=128)
+    assert isinstance(create_app({'DATASTORE_CLIENT': InMemoryDatastore(), 'CACHE_BACKEND': 'shared',
+                                  'CACHE_SHM_PATH': str(tmp_path / "app-cache")}).extensions['cache'],
+                      TieredSharedMemoryCache)
+
+    mock_get.return_value.status_code = 200
+    mock_get.return_value.json.return_value = {"valid": True, "user": {"id": 2}}
+    datastore_client = InMemoryDatastore()
+    entity = create_property(datastore_client, Property(
+        nom="Villa", description="", type_de_bien="Maison", ville="Nice", proprietaire=2))
+    cache_app = create_app({'DATASTORE_CLIENT': datastore_client, 'CACHE_BACKEND': 'shared',
+                            'CACHE_SHM_PATH': str(tmp_path / "app-cache")})
+    headers = {'Authorization': 'Bearer test.jwt.token'}
+
+    with cache_app.test_client() as cache_client, \
+         patch.object(datastore_client, 'get', wraps=datastore_client.get) as spy_get:
+        assert cache_client.get(f'/properties/{entity.key.id}').json['nom'] == "Villa"
+        assert cache_client.get(f'/properties/{entity.key.id}').json['id'] == entity.key.id
+        assert spy_get.call_count == 1
+
+        # Le jeton n'est validé qu'une fois ; la modification retire la propriété du cache
+        cache_client.patch(f'/properties/{entity.key.id}', headers=headers, json={"nom": "Villa Paradis"})
+        cache_client.patch(f'/properties/{entity.key.id}', headers=headers, json={"ville": "Nice"})
+        assert mock_get.call_count == 1
+        assert cache_client.get(f'/properties/{entity.key.id}').json['nom'] == "Villa Paradis"
+
+    metrics = cache_client.get('/metrics').get_data(as_text=True)
+    assert 'cache_requests_total{prefix="token",outcome="hit"} ' in metrics
+
+    # Après la suppression de l'utilisateur, ses jetons en cache sont revalidés ; un jeton
+    # expiré n'est jamais mis en cache
+    import base64
+    import json
+    import time
+    from property_service.cascade import revoke_user_validations
+    revoke_user_validations(cache_app, 2)
+    mock_get.return_value.status_code = 401
+    mock_get.return_value.json.return_value = {"valid": False}
+    with cache_app.test_client() as cache_client:
+        assert cache_client.patch(f'/properties/{entity.key.id}', headers=headers, json={"nom": "Orpheline"}).status_code == 401
+        assert mock_get.call_count == 2
+
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.json.return_value = {"valid": True, "user": {"id": 3}}
+        payload = base64.urlsafe_b64encode(json.dumps({"exp": time.time() - 1}).encode()).decode().rstrip("=")
+        expired = {'Authorization': f'Bearer header.{payload}.signature'}
+        cache_client.patch(f'/properties/{entity.key.id}', headers=expired, json={"nom": "Villa"})
+        cache_client.patch(f'/properties/{entity.key.id}', headers=expired, json={"nom": "Villa"})
+        assert mock_get.call_count == 4
+
+    # Une propriété réaliste (longue description, plusieurs pièces) dépasse les petits
+    # emplacements : elle est servie depuis la grande table, y compris par un autre worker
+    large = create_property(datastore_client, Property(
+        nom="Mas provençal", description="Mas rénové avec vue dégagée sur les collines. " * 70,
+        type_de_bien="Maison", ville="Nice", proprietaire=2,
+        pieces=[Piece(nom=f"Chambre {i}", surface=12.5 + i, etage=str(i % 2), caracteristiques=["placard", "parquet"])
+                for i in range(8)]))
+    with cache_app.test_client() as cache_client, \
+         patch.object(datastore_client, 'get', wraps=datastore_client.get) as spy_get:
+        assert cache_client.get(f'/properties/{large.key.id}').status_code == 200
+        assert cache_client.get(f'/properties/{large.key.id}').json['pieces'][7]['nom'] == "Chambre 7"
+        assert spy_get.call_count == 1
+    other_worker = TieredSharedMemoryCache(str(tmp_path / "app-cache"))
+    assert other_worker.large.contains(f"property:{large.key.id}")
+    assert not other_worker.small.contains(f"property:{large.key.id}")
+    assert other_worker.get(f"property:{large.key.id}") is not None
+
+
+def test_warmup_loads_learned_hot_cities_and_properties():
+    import threading
+    from benchmarks.fake_datastore import InMemoryDatastore
+    from property_service.models import Property, create_property, list_properties
+    from property_service.warmup import AccessStats, hot_items, start_warmup
+
+    datastore_client = InMemoryDatastore()
+    entities = [create_property(datastore_client, Property(nom=str(i), description="", type_de_bien="Maison",
+                                                           ville=ville, proprietaire=1))
+                for i, ville in enumerate(["Nice", "Nice", "Lyon", "Paris"])]
+
+    # Statistiques apprises : Lyon (2 + 2 accès) puis Nice (3 accès), et la première propriété
+    stats = AccessStats(half_life=3600)
+    for ville in ["Nice", "Nice", "Nice", "Lyon", "Lyon", "Paris"]:
+        stats.record(datastore_client, "ville", ville)
+    stats.record(datastore_client, "propriete", entities[0].key.id)
+    assert stats.flush(datastore_client) == 4
+    stats.record(datastore_client, "ville", "Lyon")
+    stats.record(datastore_client, "ville", "Lyon")
+    stats.flush(datastore_client)
+    assert hot_items(datastore_client, "ville", 2) == ["Lyon", "Nice"]
+
+    warm_app = create_app({'DATASTORE_CLIENT': datastore_client, 'CACHE_BACKEND': 'memory',
+                           'WARMUP_CITIES': 'Bordeaux', 'WARMUP_TOP_CITIES': 2})
+    release = threading.Event()
+    with warm_app.test_client() as warm_client, \
+         patch('property_service.warmup.list_properties',
+               side_effect=lambda client, filters: release.wait(5) and list_properties(client, filters)):
+        start_warmup(warm_app)
+        response = warm_client.get('/')
+        assert response.status_code == 503
+        assert response.json == {"status": "warming"}
+        release.set()
+        warm_app.extensions['warmup'].done.wait(5)
+        assert warm_client.get('/').json == {"status": "healthy"}
+
+    assert sorted(key for key in warm_app.extensions['listing_cache']._entries) == ["city:Bordeaux", "city:Lyon", "city:Nice"]
+    assert len(warm_app.extensions['listing_cache'].get("city:Nice")) == 2
+    assert warm_app.extensions['cache'].get(f"property:{entities[0].key.id}")['nom'] == "0"
+    # Les propriétés préchauffées survivent au TTL des entrées chargées à la demande ; les
+    # listes par ville, que les autres workers n'invalident pas, gardent CITY_CACHE_TTL
+    import time
+    assert warm_app.extensions['cache']._entries[f"property:{entities[0].key.id}"][0] - time.monotonic() > \
+        warm_app.config['PROPERTY_CACHE_TTL']
+    assert warm_app.extensions['listing_cache']._entries["city:Nice"][0] - time.monotonic() <= warm_app.config['CITY_CACHE_TTL']
+
+    # La liste préchauffée est servie sans requête Datastore
+    with patch.object(datastore_client, 'query', wraps=datastore_client.query) as spy_query:
+        assert len(warm_app.test_client().get('/properties?city=Nice').json) == 2
+    spy_query.assert_not_called()
+
+
+def test_concurrent_identical_reads_share_one_fetch():
+    import threading
+    import time
+    from common.singleflight import SINGLEFLIGHT_REQUESTS
+
+    followers_before = SINGLEFLIGHT_REQUESTS.value("property", "follower")
+    calls = []
+
+    def slow_get_property(client, property_id):
+        calls.append(property_id)
+        # Le meneur attend que les autres requêtes se soient jointes à sa lecture
+        deadline = time.monotonic() + 5
+        while SINGLEFLIGHT_REQUESTS.value("property", "follower") < followers_before + 7 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        return MockProperty({"nom": "Villa"}, property_id)
+
+    responses = []
+    with patch('property_service.routes.get_property', side_effect=slow_get_property):
+        threads = [threading.Thread(target=lambda: responses.append(app.test_client().get('/properties/7')))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+    assert calls == [7]
+    assert [(response.status_code, response.json['id']) for response in responses] == [(200, 7)] * 8
+    assert 'singleflight_requests_total{prefix="property",role="follower"}' in app.test_client().get('/metrics').get_data(as_text=True)
+
+
+def test_multi_city_search_pages_through_merged_results():
+    from benchmarks.fake_datastore import InMemoryDatastore
+    from property_service.models import Property, create_property
+
+    datastore_client = InMemoryDatastore()
+
+    def publish(ville, type_de_bien):
+        return create_property(datastore_client, Property(
+            nom=f"{ville} {type_de_bien}", description="", type_de_bien=type_de_bien, ville=ville, proprietaire=1))
+
+    created = [publish(ville, type_de_bien)
+               for ville, type_de_bien in [("Nice", "Maison"), ("Lyon", "Appartement"), ("Paris", "Maison"),
+                                           ("Lyon", "Maison"), ("Nice", "Appartement"), ("Lyon", "Studio"),
+                                           ("Nice", "Maison")]]
+    in_cities = [entity.key.id for entity in created if entity['ville'] in ("Nice", "Lyon")]
+    expected = [entity.key.id for entity in created
+                if entity['ville'] in ("Nice", "Lyon") and entity['type_de_bien'] in ("Maison", "Appartement")]
+
+    search_app = create_app({'DATASTORE_CLIENT': datastore_client})
+    with search_app.test_client() as search_client:
+        # Sans pagination : toutes les propriétés des deux villes, dans l'ordre des identifiants
+        response = search_client.get('/properties?city=Nice,Lyon')
+        assert [item['id'] for item in response.json] == sorted(in_cities)
+
+        # Pagination par curseur, stable malgré une insertion entre deux pages
+        seen = []
+        url = '/properties?city=Nice&city=Lyon&type_de_bien=Maison,Appartement&limit=2'
+        response = search_client.get(url)
+        while True:
+            assert response.status_code == 200
+            seen.extend(item['id'] for item in response.json)
+            if len(seen) == 2:
+                publish("Lyon", "Maison")
+            cursor = response.headers.get('X-Next-Cursor')
+            if cursor is None:
+                break
+            response = search_client.get(f'{url}&cursor={cursor}')
+        assert seen[:len(expected)] == expected
+        assert len(seen) == len(set(seen)) == len(expected) + 1
+
+        assert search_client.get(f'/properties?city=Nice&limit=2&cursor={cursor or "abc"}').status_code == 400
+        other = search_client.get('/properties?city=Nice&type_de_bien=Maison&limit=1').headers['X-Next-Cursor']
+        assert search_client.get(f'/properties?city=Lyon&type_de_bien=Maison&limit=1&cursor={other}').status_code == 400
+        too_many = ",".join(f"V{i}" for i in range(21))
+        assert search_client.get(f'/properties?city={too_many}').status_code == 400
+
+
+def test_partitioned_export_writes_parquet_and_resumes(tmp_path):
+    import os
+    pq = pytest.importorskip("pyarrow.parquet")
+    from google.cloud import datastore
+    from benchmarks.fake_datastore import InMemoryDatastore
+    from property_service.export import export_partition, export_properties, read_manifest
+    from property_service.models import Piece, Property, create_property
+
+    datastore_client = InMemoryDatastore()
+    created = [create_property(datastore_client, Property(
+        nom=str(i), description="", type_de_bien="Maison", ville="Nice", proprietaire=i,
+        pieces=[Piece(nom="Salon", surface=20.5), Piece(nom="Cuisine", caracteristiques=["four"])] if i % 2 else []))
+        for i in range(7)]
+
+    # Une partition en échec reste à refaire ; les autres sont conservées
+    output_dir = str(tmp_path / "export")
+    failing = {"calls": 0}
+
+    def flaky_export(client, directory, partition, page_size):
+        failing["calls"] += 1
+        if partition["index"] == 1:
+            raise RuntimeError("Datastore indisponible")
+        return export_partition(client, directory, partition, page_size)
+
+    with patch('property_service.export.export_partition', side_effect=flaky_export), pytest.raises(RuntimeError):
+        export_properties(datastore_client, output_dir, partition_size=3, page_size=2, max_workers=2)
+    manifest = read_manifest(output_dir)
+    assert [partition["terminee"] for partition in manifest["partitions"]] == [True, False, True]
+    assert failing["calls"] == 3
+
+    with patch('property_service.export.export_partition', wraps=export_partition) as spy:
+        manifest = export_properties(datastore_client, output_dir, partition_size=3, page_size=2)
+    assert [call.args[2]["index"] for call in spy.call_args_list] == [1]
+    assert manifest["termine_le"] is not None
+
+    properties = pq.read_table(str(tmp_path / "export" / "proprietes")).to_pylist()
+    assert sorted(row["id"] for row in properties) == sorted(entity.key.id for entity in created)
+    assert {row["proprietaire"] for row in properties} == set(range(7))
+    assert properties[0]["cree_le"] is not None
+    pieces = pq.read_table(str(tmp_path / "export" / "pieces")).to_pylist()
+    assert len(pieces) == 6
+    assert {(row["position"], row["nom"], row["surface"], tuple(row["caracteristiques"] or ())) for row in pieces} == \
+        {(0, "Salon", 20.5, ()), (1, "Cuisine", None, ("four",))}
+
+    # Une entité antérieure au schéma est normalisée plutôt que de faire échouer sa partition
+    legacy = datastore.Entity(key=datastore_client.key('Property', 10 ** 9))
+    legacy.update({"nom": "Ancienne", "ville": "Nice", "proprietaire": "7", "latitude": "n/a",
+                   "pieces": [{"name": "Salon", "etage": 1, "surface": "12"}, "cuisine",
+                              {"nom": 5, "caracteristiques": "four"}]})
+    datastore_client.put(legacy)
+    legacy_dir = str(tmp_path / "legacy")
+    export_properties(datastore_client, legacy_dir, partition_size=100)
+    properties = {row["id"]: row for row in pq.read_table(os.path.join(legacy_dir, "proprietes")).to_pylist()}
+    assert (properties[10 ** 9]["proprietaire"], properties[10 ** 9]["latitude"]) == (7, None)
+    pieces = [row for row in pq.read_table(os.path.join(legacy_dir, "pieces")).to_pylist() if row["property_id"] == 10 ** 9]
+    assert sorted((row["position"], row["nom"], row["surface"], row["etage"], tuple(row["caracteristiques"] or ()))
+                  for row in pieces) == [(0, None, 12.0, "1", ()), (2, "5", None, None, ("four",))]
+
+    export_app = create_app({'DATASTORE_CLIENT': datastore_client, 'SERVICE_TOKEN': 'secret',
+                             'EXPORT_DIR': str(tmp_path)})
+    with export_app.test_client() as export_client:
+        assert export_client.post('/properties/exports', json={"nom": "export"}).status_code == 403
+        headers = {'X-Service-Token': 'secret'}
+        assert export_client.post('/properties/exports', headers=headers, json={"nom": "../x"}).status_code == 400
+        response = export_client.get('/properties/exports/export', headers=headers)
+        assert response.status_code == 200
+        assert len(response.json["manifeste"]["partitions"]) == 3
+        assert export_client.get('/properties/exports/inconnu', headers=headers).status_code == 404
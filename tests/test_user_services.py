@@ -1,5 +1,10 @@
 import pytest
-from user_service.app import app,db
+from unittest.mock import patch
+from user_service.app import create_app
+from user_service.config import TestConfig
+from user_service.models import db
+
+app = create_app(TestConfig)
 
 @pytest.fixture
 def client():
@@ -168,4 +173,183 @@ def test_unauthorized_user(client):
     response = client.delete('/users/2', headers=headers)
     assert response.status_code == 403
     data = response.get_json()
-    assert data['error'] == 'Accès refusé.'
\ No newline at end of file
+    assert data['error'] == 'Accès refusé.'
+
+def test_metrics_endpoint(client):
+    client.post('/users', json={
+        "email": "email@gmail.com",
+        "password": "password",
+        "nom": "nom",
+        "prenom": "prenom",
+        "date_de_naissance": "2001-04-10"
+    })
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert 'http_requests_total{method="POST",route="/users",status="201"}' in body
+    assert 'downstream_call_duration_seconds_count{system="bcrypt",operation="hash"}' in body
+    assert 'downstream_call_duration_seconds_count{system="sql",operation="insert"}' in body
+
+
+def test_init_db_command():
+    cli_app = create_app(TestConfig)
+
+    result = cli_app.test_cli_runner().invoke(args=['init-db'])
+
+    assert result.exit_code == 0
+    with cli_app.app_context():
+        assert 'utilisateur' in db.inspect(db.engine).get_table_names()
+
+
+def test_delete_user_records_outbox_event(client):
+    client.post('/users', json={
+        "email": "email@gmail.com",
+        "password": "password",
+        "nom": "nom",
+        "prenom": "prenom",
+        "date_de_naissance": "2001-04-10"
+    })
+    token = client.post('/login', json={"email": "email@gmail.com", "password": "password"}).get_json()['token']
+    client.delete('/users/1', headers={'Authorization': f'Bearer {token}'})
+
+    # La file d'événements est réservée aux services
+    assert client.get('/events').status_code == 403
+
+    service_headers = {'X-Service-Token': TestConfig.SERVICE_TOKEN}
+    events = client.get('/events', headers=service_headers).get_json()['events']
+    assert len(events) == 1
+    assert events[0]['type'] == 'utilisateur_supprime'
+    assert events[0]['payload'] == {'utilisateur_id': 1}
+    # Une limite négative (LIMIT -1 en SQLite : aucune borne) est ramenée à 1
+    assert len(client.get('/events?limit=-1', headers=service_headers).get_json()['events']) == 1
+
+    response = client.post('/events/ack', json={'jusqu_a': events[0]['id']}, headers=service_headers)
+    assert response.get_json() == {'acquittes': 1}
+    assert client.get('/events', headers=service_headers).get_json()['events'] == []
+
+
+def test_patch_user_skips_unchanged_fields(client):
+    client.post('/users', json={
+        "email": "email@gmail.com",
+        "password": "password",
+        "nom": "nom",
+        "prenom": "prenom",
+        "date_de_naissance": "2001-04-10"
+    })
+    token = client.post('/login', json={"email": "email@gmail.com", "password": "password"}).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    response = client.patch('/users/1', json={'nom': 'nom2', 'prenom': 'prenom', 'date_de_naissance': '2001-04-10'},
+                            headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['champs_modifies'] == ['nom']
+
+    response = client.patch('/users/1', json={'nom': 'nom2'}, headers=headers)
+    assert response.get_json() == {'message': 'Aucune modification.', 'champs_modifies': []}
+
+    response = client.patch('/users/1', json={'email': 'autre@gmail.com'}, headers=headers)
+    assert response.status_code == 400
+
+
+def test_register_user_replays_idempotent_retry(client):
+    payload = {
+        "email": "email@gmail.com",
+        "password": "password",
+        "nom": "nom",
+        "prenom": "prenom",
+        "date_de_naissance": "2001-04-10"
+    }
+    headers = {'Idempotency-Key': 'inscription-1'}
+
+    first = client.post('/users', json=payload, headers=headers)
+    assert first.status_code == 201
+
+    # La relance rejoue la réponse d'origine sans hacher de nouveau le mot de passe
+    with patch('user_service.models.Utilisateur.set_password') as mock_set_password:
+        retry = client.post('/users', json=payload, headers=headers)
+    mock_set_password.assert_not_called()
+    assert retry.status_code == 201
+    assert retry.get_json() == first.get_json()
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+
+    # Même clé, corps différent
+    response = client.post('/users', json=dict(payload, nom="autre"), headers=headers)
+    assert response.status_code == 422
+
+
+def test_admission_sheds_login_and_keeps_validation_ahead(client):
+    import threading
+    import time
+    from common.admission import AdmissionController, Rejected
+
+    controller = AdmissionController(max_concurrency=1, class_limits={"auth": 1}, queue_sizes={"auth": 1},
+                                     queue_timeout=5)
+    controller.acquire("auth", "user.login_user")
+
+    # Une inscription et une validation attendent la seule place
+    waiter = threading.Thread(target=lambda: controller.acquire("auth", "user.register_user"))
+    admitted = []
+    critical = threading.Thread(target=lambda: (controller.acquire("critical", "user.validate_user"),
+                                                admitted.append("critical")))
+    waiter.start()
+    critical.start()
+    while not (controller._queues["auth"] and controller._queues["critical"]):
+        time.sleep(0.001)
+
+    # File "auth" pleine : refus immédiat
+    with pytest.raises(Rejected) as rejected:
+        controller.acquire("auth", "user.login_user")
+    assert rejected.value.reason == "queue_full"
+
+    # La place libérée revient à la validation, prioritaire sur l'inscription en attente
+    controller.release("auth", "user.login_user")
+    critical.join(1)
+    assert admitted == ["critical"]
+    assert len(controller._queues["auth"]) == 1
+    controller.release("critical", "user.validate_user")
+    waiter.join(1)
+    assert not controller._queues["auth"]
+
+    # Délestage par l'application : 503 avec Retry-After, la validation reste servie
+    class SaturatedConfig(TestConfig):
+        ADMISSION_CLASS_LIMITS = "auth=0"
+        ADMISSION_QUEUE_SIZES = "auth=0"
+        ADMISSION_RETRY_AFTER = 3
+
+    saturated_client = create_app(SaturatedConfig).test_client()
+    response = saturated_client.post('/login', json={"email": "email@gmail.com", "password": "password"})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '3'
+    assert saturated_client.get('/users/validate').status_code == 401
+
+    metrics = client.get('/metrics').get_data(as_text=True)
+    assert 'admission_rejections_total{class="auth",reason="queue_full"}' in metrics
+
+
+def test_validate_user_is_cached_until_update():
+    class CachedConfig(TestConfig):
+        CACHE_BACKEND = "memory"
+
+    cached_app = create_app(CachedConfig)
+    with cached_app.app_context():
+        db.create_all()
+    cached_client = cached_app.test_client()
+    cached_client.post('/users', json={"email": "email@gmail.com", "password": "password", "nom": "nom",
+                                       "prenom": "prenom", "date_de_naissance": "2001-04-10"})
+    token = cached_client.post('/login', json={"email": "email@gmail.com", "password": "password"}).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    user = cached_client.get('/users/validate', headers=headers).get_json()['user']
+    assert user['nom'] == 'nom'
+    # Format de date du fournisseur JSON par défaut de Flask, inchangé pour les consommateurs
+    assert user['date_de_naissance'] == 'Tue, 10 Apr 2001 00:00:00 GMT'
+    with patch('user_service.routes.db.session.get') as mock_session_get:
+        assert cached_client.get('/users/validate', headers=headers).status_code == 200
+    mock_session_get.assert_not_called()
+
+    # La mise à jour et la suppression retirent l'utilisateur du cache
+    cached_client.patch('/users/1', json={'nom': 'nom2'}, headers=headers)
+    assert cached_client.get('/users/validate', headers=headers).get_json()['user']['nom'] == 'nom2'
+    cached_client.delete('/users/1', headers=headers)
+    assert cached_client.get('/users/validate', headers=headers).status_code == 404
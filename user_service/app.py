@@ -1,41 +1,94 @@
 """
 Application principale pour le service utilisateur.
 
-Ce fichier configure l'application Flask, initialise les extensions nécessaires et enregistre les routes pour les utilisateurs.
+Ce fichier fournit la fabrique `create_app()` qui configure l'application Flask, initialise
+les extensions nécessaires et enregistre les routes pour les utilisateurs.
 
 Points principaux :
 - Chargement de la configuration.
-- Initialisation de la base de données.
+- Initialisation de la base de données (le schéma est créé par la commande `flask init-db`).
 - Enregistrement des blueprints.
+- Sérialisation JSON rapide et compression des réponses.
+- Exposition des métriques Prometheus sur `/metrics`.
+- Rejeu des inscriptions relancées avec le même en-tête `Idempotency-Key`.
+- Cache partagé par les workers de l'hôte (utilisateurs validés).
+- Contrôle d'admission : limites de concurrence par classe de priorité et délestage (503).
+- Profilage à la demande et journal des requêtes lentes.
 """
 
 
+import click
 from flask import Flask
 from flask_jwt_extended import JWTManager
 from user_service.models import db, bcrypt
 from user_service.routes import user_blueprint
 from user_service.config import Config
+from common.json_provider import init_json
+from common.profiling import init_profiling
+from common.compression import init_compression
+from common.metrics import init_metrics
+from common.idempotency import init_idempotency
+from common.admission import init_admission
+from common.cache import init_cache
 
-# Création de l'application Flask
-app = Flask(__name__)
+# Initialisation de Flask-JWT-Extended
+jwt = JWTManager()
 
-# Chargement de la configuration
-app.config.from_object(Config)
 
-# Initialisation des extensions
-db.init_app(app)
-bcrypt.init_app(app)
-jwt = JWTManager(app)
+def create_app(config=Config):
+    """Crée et configure une instance de l'application.
 
-# Enregistrement des routes 
-app.register_blueprint(user_blueprint)
+    Aucune connexion à la base de données n'est ouverte ici : le moteur SQLAlchemy ne se
+    connecte qu'au premier usage, après le fork des workers.
 
-# Création des tables dans la base de données si elles n'existent pas
-with app.app_context():
-    db.create_all()
+    Paramètres:
+        - config (object): Objet de configuration (par défaut `Config`).
 
+    Retourne:
+        - Flask: L'application configurée.
+    """
 
-# Route pour vérifier l'état de l'application
-@app.route('/',methods=['GET'])
-def health_check():
-    return {"status":"healthy"},200
+    # Création de l'application Flask
+    app = Flask(__name__)
+
+    # Chargement de la configuration
+    app.config.from_object(config)
+
+    # Initialisation des extensions
+    db.init_app(app)
+    bcrypt.init_app(app)
+    jwt.init_app(app)
+    init_json(app)
+    init_profiling(app)
+    init_compression(app)
+    init_metrics(app)
+    init_admission(app)
+    init_cache(app)
+    init_idempotency(app)
+
+    # Enregistrement des routes 
+    app.register_blueprint(user_blueprint)
+
+    # Création des tables dans la base de données si elles n'existent pas
+    @app.cli.command('init-db')
+    def init_db():
+        """Crée les tables de la base de données."""
+        db.create_all()
+        click.echo("Base de données initialisée.")
+
+    # Route pour vérifier l'état de l'application
+    @app.route('/',methods=['GET'])
+    def health_check():
+        return {"status":"healthy"},200
+
+    return app
+
+
+def dispose_engines(app):
+    """Ferme les connexions héritées du processus parent (à appeler après un fork).
+
+    Paramètres:
+        - app (Flask): Application Flask.
+    """
+    with app.app_context():
+        db.engine.dispose(close=False)
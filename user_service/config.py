@@ -13,4 +13,51 @@ load_dotenv()
 class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv("SQLALCHEMY_DATABASE_URI", "sqlite:///utilisateurs.db")
     JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "default_jwt_secret")
-    PORT=os.getenv("PORT", "5000")
\ No newline at end of file
+    PORT=os.getenv("PORT", "5000")
+
+    # Jeton partagé autorisant les autres services à lire la file d'événements (/events)
+    SERVICE_TOKEN = os.getenv("SERVICE_TOKEN")
+
+    # Réponses conservées pour les clés d'idempotence (voir common/idempotency.py)
+    IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+    IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+    IDEMPOTENCY_PENDING_TTL = float(os.getenv("IDEMPOTENCY_PENDING_TTL", "60"))
+
+    # Cache partagé par les workers de l'hôte (voir common/cache.py et common/shm_cache.py)
+    CACHE_BACKEND = os.getenv("CACHE_BACKEND", "shared")
+    CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "4096"))
+    CACHE_ENTRY_SIZE = int(os.getenv("CACHE_ENTRY_SIZE", "2048"))
+    CACHE_LARGE_MAX_ENTRIES = int(os.getenv("CACHE_LARGE_MAX_ENTRIES", "1024"))
+    CACHE_LARGE_ENTRY_SIZE = int(os.getenv("CACHE_LARGE_ENTRY_SIZE", "16384"))
+    CACHE_SHM_PATH = os.getenv("CACHE_SHM_PATH")
+    CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+    USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+
+    # Limites de concurrence et délestage (voir common/admission.py)
+    ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+    ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "0"))
+    ADMISSION_CLASS_LIMITS = os.getenv("ADMISSION_CLASS_LIMITS", "")
+    ADMISSION_ROUTE_LIMITS = os.getenv("ADMISSION_ROUTE_LIMITS", "")
+    ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "8"))
+    ADMISSION_QUEUE_SIZES = os.getenv("ADMISSION_QUEUE_SIZES", "")
+    ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2"))
+    ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+
+    # Agrégation des métriques des workers (voir common/metrics.py)
+    METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR")
+    METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+    # Profilage à la demande et journal des requêtes lentes (voir common/profiling.py)
+    PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+    PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+    PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+    PROFILE_MEMORY = os.getenv("PROFILE_MEMORY", "false").lower() == "true"
+    SLOW_REQUEST_THRESHOLD_MS = float(os.getenv("SLOW_REQUEST_THRESHOLD_MS", "1000"))
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
+    JWT_SECRET_KEY = "test_jwt_secret_key_with_enough_bytes"
+    BCRYPT_LOG_ROUNDS = 4
+    SERVICE_TOKEN = "test_service_token"
@@ -6,11 +6,20 @@ Contenu:
 - Initialisation de SQLAlchemy (pour la gestion de la base de données).
 - Initialisation de Flask-Bcrypt (pour le hachage des mots de passe).
 - Définition du modèle `Utilisateur`, qui représente un utilisateur dans la base de données.
+- Définition du modèle `Evenement`, file d'événements sortants (outbox) consommée par les autres services.
+- Chronométrage des requêtes SQL et des opérations bcrypt (métrique `downstream_call_duration_seconds`).
 """
 
 
+import time
+from datetime import datetime, timezone
+
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from common.metrics import DOWNSTREAM_LATENCY, track
+from common.profiling import record_phase
 
 
 # Initialisation de l'instance SQLAlchemy
@@ -21,6 +30,29 @@ db = SQLAlchemy()
 # Utilisé pour sécuriser les mots de passe en les hachant.
 bcrypt =Bcrypt()
 
+
+# Chronométrage de chaque requête SQL exécutée par n'importe quel moteur
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_sql_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _record_sql_timer(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info["query_start"].pop()
+    operation = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else "unknown"
+    elapsed = time.perf_counter() - start
+    DOWNSTREAM_LATENCY.observe(elapsed, "sql", operation)
+    record_phase("storage", elapsed)
+
+
+@event.listens_for(Engine, "handle_error")
+def _discard_sql_timer(context):
+    starts = context.connection.info.get("query_start") if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
 class Utilisateur(db.Model):
     """Modèle représentant un utilisateur.
 
@@ -50,7 +82,8 @@ class Utilisateur(db.Model):
         Paramètres:
             - password (str): Mot de passe en clair à hacher.
         """
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        with track("bcrypt", "hash"):
+            self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
     
     def check_password(self, password):
         """Vérifie si un mot de passe correspond au hachage stocké.
@@ -61,4 +94,27 @@ class Utilisateur(db.Model):
         Retourne:
             - bool: True si le mot de passe est correct, False sinon.
         """
-        return bcrypt.check_password_hash(self.password_hash,password)
+        with track("bcrypt", "check"):
+            return bcrypt.check_password_hash(self.password_hash,password)
+
+
+class Evenement(db.Model):
+    """Événement sortant (outbox) destiné aux autres services.
+
+    L'événement est enregistré dans la même transaction que la modification qui le
+    produit, puis lu et acquitté par le service consommateur.
+
+    Attributs:
+        - id (int): Identifiant croissant de l'événement.
+        - type (str): Type d'événement (ex: "utilisateur_supprime").
+        - payload (dict): Données de l'événement.
+        - cree_le (datetime): Date de création de l'événement.
+    """
+    id = db.Column(db.Integer,primary_key=True)
+    type = db.Column(db.String(50),nullable=False)
+    payload = db.Column(db.JSON,nullable=False)
+    cree_le = db.Column(db.DateTime,nullable=False,default=lambda: datetime.now(timezone.utc))
+
+    def to_dict(self):
+        """Retourne la représentation JSON de l'événement."""
+        return {"id": self.id, "type": self.type, "payload": self.payload, "cree_le": self.cree_le}
@@ -2,12 +2,15 @@
 Ce module définit les routes pour les opérations liées aux utilisateurs dans le service utilisateur.
 
 Endpoints:
-- POST /users: Enregistrer un nouvel utilisateur
+- POST /users: Enregistrer un nouvel utilisateur (idempotent avec l'en-tête `Idempotency-Key`).
 - POST /login: Authentifier un utilisateur et fournir un JWT token.
 - GET /users/<int:utilisateur_id>: Récupérer les détails d'un utilisateur (nécessite une authentification).
 - PUT /users/<int:utilisateur_id>: Mettre à jour les détails d'un utilisateur (nécessite une authentification).
+- PATCH /users/<int:utilisateur_id>: Modifier partiellement un utilisateur (JSON merge patch, nécessite une authentification).
 - DELETE /users/<int:utilisateur_id>: Supprimer un utilisateur (nécessite une authentification).
 - GET /users/validate: Valider l'authentification de l'utilisateur actuel.
+- GET /events: Lire les événements sortants en attente (réservé aux services, jeton `X-Service-Token`).
+- POST /events/ack: Acquitter les événements traités (réservé aux services).
 
 Dépendances :
 - Flask pour la gestion des requêtes.
@@ -16,10 +19,15 @@ Dépendances :
 """
 
 
-from flask import Blueprint, request, jsonify
-from user_service.models import db, Utilisateur
+import hmac
+
+from flask import Blueprint, request, jsonify, current_app
+from user_service.models import db, Utilisateur, Evenement
 from datetime import datetime
 from flask_jwt_extended import create_access_token,jwt_required,get_jwt_identity
+from common.idempotency import idempotent
+from common.admission import admission_class
+from common.cache import get_cache, get_or_load
 
 
 # Définir un blueprint pour les routes liées aux utilisateurs
@@ -27,11 +35,15 @@ user_blueprint = Blueprint('user', __name__)
 
 
 @user_blueprint.route('/users',methods=['POST'])
+@admission_class("auth")
+@idempotent
 def register_user():
     """Enregistrer un nouvel utilisateur dans le système.
     
     Expects: 
         Une JSON avec 'email', 'password', 'nom', 'prenom' et 'date_de_naissance'.
+        Une relance portant le même en-tête `Idempotency-Key` rejoue la réponse d'origine
+        sans hacher de nouveau le mot de passe.
 
     Returns:
         201 : Utilisateur enregistré avec succès.
@@ -70,6 +82,7 @@ def register_user():
 
 
 @user_blueprint.route('/login',methods=['POST'])
+@admission_class("auth")
 def login_user():
     """Authentifier un utilisateur et fournir un JWT token.
 
@@ -137,11 +150,20 @@ def get_user(utilisateur_id):
     }),200
 
 
-@user_blueprint.route('/users/<int:utilisateur_id>', methods=['PUT'])
+# Champs modifiables d'un utilisateur
+MUTABLE_FIELDS = ('nom', 'prenom', 'date_de_naissance')
+
+
+@user_blueprint.route('/users/<int:utilisateur_id>', methods=['PUT', 'PATCH'])
 @jwt_required()
 def update_user(utilisateur_id):
     """Mettre à jour les détails d'un utilisateur.
 
+    Avec PUT, les champs absents ou vides sont ignorés. Avec PATCH (JSON merge patch),
+    seuls les champs modifiables sont acceptés et aucun ne peut être supprimé.
+    Dans les deux cas, seuls les champs dont la valeur change sont écrits ; si rien ne
+    change, aucune écriture n'a lieu.
+
     Requires :
         Authentification via JWT.
 
@@ -149,7 +171,8 @@ def update_user(utilisateur_id):
     Une JSON avec les champs à mettre à jour ('nom', 'prenom', 'date_de_naissance').
 
     Returns :
-        200 : Utilisateur mis à jour avec succès.
+        200 : Utilisateur mis à jour avec succès, avec la liste des champs modifiés.
+        400 : Corps invalide, champ non modifiable ou date invalide.
         403 : Accès refusé si l'utilisateur tente de mettre à jour les détails d'un autre utilisateur.
         404 : Utilisateur non trouvé.
     """
@@ -166,17 +189,36 @@ def update_user(utilisateur_id):
     if not utilisateur:
         return jsonify({"error": "Utilisateur non trouvé."}), 404
 
-    # Mettre à jour les champs si fournis
-    data = request.json
-    if data.get('nom'):
-        utilisateur.nom = data['nom']
-    if data.get('prenom'):
-        utilisateur.prenom = data['prenom']
-    if data.get('date_de_naissance'):
-        utilisateur.date_de_naissance = data['date_de_naissance']
+    data = request.get_json(force=True, silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Le corps de la requête doit être un objet JSON."}), 400
 
-    db.session.commit()
-    return jsonify({"message": "Utilisateur mis à jour avec succès."}), 200
+    if request.method == 'PATCH':
+        non_modifiables = sorted(set(data) - set(MUTABLE_FIELDS))
+        if non_modifiables:
+            return jsonify({"error": f"Champs non modifiables : {', '.join(non_modifiables)}"}), 400
+        if any(value is None for value in data.values()):
+            return jsonify({"error": "Les champs d'un utilisateur ne peuvent pas être supprimés."}), 400
+    else:
+        # Mettre à jour les champs si fournis
+        data = {field: data[field] for field in MUTABLE_FIELDS if data.get(field)}
+
+    if 'date_de_naissance' in data:
+        try:
+            data['date_de_naissance'] = datetime.strptime(data['date_de_naissance'], '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            return jsonify({"error": "La date de naissance doit être au format AAAA-MM-JJ."}), 400
+
+    # Seuls les champs dont la valeur change sont écrits
+    champs_modifies = [field for field, value in data.items() if getattr(utilisateur, field) != value]
+    if champs_modifies:
+        for field in champs_modifies:
+            setattr(utilisateur, field, data[field])
+        db.session.commit()
+        get_cache(current_app).delete(f"user:{utilisateur_id}")
+
+    message = "Utilisateur mis à jour avec succès." if champs_modifies else "Aucune modification."
+    return jsonify({"message": message, "champs_modifies": champs_modifies}), 200
 
 
 
@@ -207,8 +249,12 @@ def delete_user(utilisateur_id):
         return jsonify({"error": "Utilisateur non trouvé."}), 404
 
 
+    # La suppression et l'événement associé sont enregistrés dans la même transaction ;
+    # le property_service supprime ensuite les propriétés de l'utilisateur en arrière-plan.
     db.session.delete(utilisateur)
+    db.session.add(Evenement(type="utilisateur_supprime", payload={"utilisateur_id": utilisateur_id}))
     db.session.commit()
+    get_cache(current_app).delete(f"user:{utilisateur_id}")
 
     return jsonify({"message": "Utilisateur supprimé avec succès."}), 200
 
@@ -216,6 +262,7 @@ def delete_user(utilisateur_id):
 
 
 @user_blueprint.route('/users/validate', methods=['GET'])
+@admission_class("critical")
 @jwt_required()
 def validate_user():
     """Valider l'authentification de l'utilisateur actuel.
@@ -223,6 +270,9 @@ def validate_user():
     Requires:
         Authentification via JWT.
 
+    Les utilisateurs validés sont conservés `USER_CACHE_TTL` secondes dans le cache partagé
+    par les workers (entrée retirée à la mise à jour ou à la suppression du compte).
+
     Returns:
         200 : Détails de la validation de l'utilisateur.
         404 : Utilisateur non trouvé.
@@ -232,20 +282,82 @@ def validate_user():
     utilisateur_id = get_jwt_identity()
     utilisateur_id = int(utilisateur_id)
 
-    utilisateur = db.session.get(Utilisateur,utilisateur_id)
-
-    if not utilisateur:
-        return jsonify({"valid": False, "error": "Utilisateur non trouvé."}), 404
-
-    # Retourner les détails de l'utilisateur si valide
-    return jsonify({
-        "valid": True,
-        "user": {
+    def load_user():
+        utilisateur = db.session.get(Utilisateur,utilisateur_id)
+        if not utilisateur:
+            return None
+        return {
             "id": utilisateur.id,
             "nom": utilisateur.nom,
             "prenom": utilisateur.prenom,
             "date_de_naissance": utilisateur.date_de_naissance,
             "email": utilisateur.email
         }
-    }), 200
 
+    user = get_or_load(get_cache(current_app), f"user:{utilisateur_id}", load_user,
+                       ttl=current_app.config['USER_CACHE_TTL'])
+
+    if not user:
+        return jsonify({"valid": False, "error": "Utilisateur non trouvé."}), 404
+
+    # Retourner les détails de l'utilisateur si valide
+    return jsonify({"valid": True, "user": user}), 200
+
+
+
+def _service_authorized():
+    """Vérifie le jeton de service de la requête (désactivé si `SERVICE_TOKEN` n'est pas défini)."""
+    expected = current_app.config.get('SERVICE_TOKEN')
+    provided = request.headers.get('X-Service-Token')
+    return bool(expected and provided and hmac.compare_digest(provided, expected))
+
+
+@user_blueprint.route('/events', methods=['GET'])
+def list_events():
+    """Lister les événements sortants en attente, du plus ancien au plus récent.
+
+    Requires:
+        En-tête `X-Service-Token`.
+
+    Paramètres de requête:
+        - limit: Nombre maximal d'événements (100 par défaut, entre 1 et 1000).
+
+    Returns:
+        200 : Liste des événements.
+        403 : Jeton de service absent ou invalide.
+    """
+    if not _service_authorized():
+        return jsonify({"error": "Accès refusé."}), 403
+
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+    evenements = Evenement.query.order_by(Evenement.id).limit(limit).all()
+
+    return jsonify({"events": [evenement.to_dict() for evenement in evenements]}), 200
+
+
+@user_blueprint.route('/events/ack', methods=['POST'])
+def ack_events():
+    """Acquitter (supprimer) les événements traités.
+
+    Requires:
+        En-tête `X-Service-Token`.
+
+    Expects:
+        Une JSON avec 'jusqu_a' : identifiant du dernier événement traité.
+
+    Returns:
+        200 : Nombre d'événements acquittés.
+        400 : Identifiant manquant.
+        403 : Jeton de service absent ou invalide.
+    """
+    if not _service_authorized():
+        return jsonify({"error": "Accès refusé."}), 403
+
+    jusqu_a = (request.json or {}).get('jusqu_a')
+    if not isinstance(jusqu_a, int):
+        return jsonify({"error": "Le champ 'jusqu_a' est obligatoire."}), 400
+
+    supprimes = Evenement.query.filter(Evenement.id <= jusqu_a).delete()
+    db.session.commit()
+
+    return jsonify({"acquittes": supprimes}), 200
@@ -1,4 +1,20 @@
-from user_service.app import app
+import argparse
+
+from user_service.app import create_app, dispose_engines
+from common.server import add_server_arguments, serve_production
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Service utilisateur.")
+    add_server_arguments(parser, default_port=5000)
+    args = parser.parse_args(argv)
+
+    app = create_app()
+    if args.production:
+        serve_production(app, args.host, args.port, args.workers, args.threads, post_fork=dispose_engines)
+    else:
+        app.run(debug=True, host=args.host, port=args.port)
+
 
 if __name__ == "__main__":
-    app.run(debug=True,port=app.config['PORT'])
+    main()